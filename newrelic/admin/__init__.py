@@ -18,6 +18,7 @@ import sys
 import logging
 
 _builtin_plugins = [
+    'audit_log',
     'debug_console',
     'generate_config',
     'license_key',
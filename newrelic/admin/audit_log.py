@@ -0,0 +1,41 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+
+from newrelic.admin import command, usage
+
+
+@command('audit-log', 'log_file [log_file ...]',
+"""Decodes the binary audit log written when 'audit_log.asynchronous' is
+enabled, printing the requests made to the data collector and the responses
+received as text. Rotated audit log files can be given in the order they
+were written.""", log_intercept=False)
+def audit_log(args):
+    import sys
+
+    if len(args) == 0:
+        usage('audit-log')
+        sys.exit(1)
+
+    from newrelic.common.audit_log import print_record, read_records
+
+    for log_file in args:
+        with open(log_file, 'rb') as fp:
+            try:
+                for metadata, body in read_records(fp):
+                    print_record(sys.stdout, metadata, body)
+            except ValueError as exc:
+                print('%s: %s' % (log_file, exc), file=sys.stderr)
+                sys.exit(1)
@@ -48,6 +48,10 @@ def enable_datastore_instance_feature(dbapi2_module):
 
 class DatabaseTrace(TimeTrace):
 
+    __slots__ = ('sql', 'dbapi2_module', 'connect_params', 'cursor_params',
+            'sql_parameters', 'execute_params', 'host', 'port_path_or_id',
+            'database_name', 'sql_format', 'stack_trace')
+
     __async_explain_plan_logged = False
 
     def __init__(self, sql, dbapi2_module=None,
@@ -186,6 +190,13 @@ class DatabaseTrace(TimeTrace):
                         execute_params = self.execute_params
                         transaction._explain_plan_count += 1
 
+        # Slow queries keep their own node, rather than being aggregated
+        # once the segment budget is used up or where only metrics are
+        # needed, so they can still be reported as slow SQL.
+
+        if self.is_aggregated and self.duration >= tt.explain_threshold:
+            self.is_aggregated = False
+
         self.sql_format = tt.record_sql
 
         self.connect_params = connect_params
@@ -196,6 +207,10 @@ class DatabaseTrace(TimeTrace):
         self.port_path_or_id = port_path_or_id
         self.database_name = database_name
 
+    def aggregate_key(self):
+        return (self.sql, self.dbapi2_module, self.host, self.port_path_or_id,
+                self.database_name)
+
     def terminal_node(self):
         return True
 
@@ -217,9 +232,9 @@ class DatabaseTrace(TimeTrace):
                 host=self.host,
                 port_path_or_id=self.port_path_or_id,
                 database_name=self.database_name,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self._user_attributes)
 
 
 def DatabaseTraceWrapper(wrapped, sql, dbapi2_module=None):
@@ -55,6 +55,10 @@ class DatastoreTrace(TimeTrace):
 
     """
 
+    __slots__ = ('instance_reporting_enabled', 'database_name_enabled',
+            'product', 'target', 'operation', 'host', 'port_path_or_id',
+            'database_name')
+
     def __init__(self, product, target, operation,
             host=None, port_path_or_id=None, database_name=None, **kwargs):
         parent = None
@@ -104,6 +108,10 @@ class DatastoreTrace(TimeTrace):
         if not self.database_name_enabled:
             self.database_name = None
 
+    def aggregate_key(self):
+        return (self.product, self.target, self.operation, self.host,
+                self.port_path_or_id, self.database_name)
+
     def terminal_node(self):
         return True
 
@@ -120,9 +128,9 @@ class DatastoreTrace(TimeTrace):
                 host=self.host,
                 port_path_or_id=self.port_path_or_id,
                 database_name=self.database_name,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes,)
+                user_attributes=self._user_attributes,)
 
 
 def DatastoreTraceWrapper(wrapped, product, target, operation):
@@ -23,6 +23,8 @@ from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 
 class ExternalTrace(CatHeaderMixin, TimeTrace):
 
+    __slots__ = ('library', 'url', 'method', 'params', 'settings')
+
     def __init__(self, library, url, method=None, **kwargs):
         parent = None
         if kwargs:
@@ -35,6 +37,7 @@ class ExternalTrace(CatHeaderMixin, TimeTrace):
         self.url = url
         self.method = method
         self.params = {}
+        self.settings = None
 
     def __repr__(self):
         return '<%s %s>' % (self.__class__.__name__, dict(
@@ -44,6 +47,13 @@ class ExternalTrace(CatHeaderMixin, TimeTrace):
         self._add_agent_attribute('http.statusCode', status_code)
         self.process_response_headers(headers)
 
+    def aggregate_key(self):
+        # The names of the metrics for cross application calls are taken
+        # from the parameters recorded from the response.
+
+        return (self.library, self.url, self.method,
+                tuple(sorted(self.params.items())))
+
     def terminal_node(self):
         return True
 
@@ -58,9 +68,9 @@ class ExternalTrace(CatHeaderMixin, TimeTrace):
                 duration=self.duration,
                 exclusive=self.exclusive,
                 params=self.params,
-                guid=self.guid,
+                guid=self._guid,
                 agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                user_attributes=self._user_attributes)
 
 
 def ExternalTraceWrapper(wrapped, library, url, method=None):
@@ -23,6 +23,8 @@ from newrelic.core.function_node import FunctionNode
 
 class FunctionTrace(TimeTrace):
 
+    __slots__ = ('name', 'group', 'label', 'params', 'terminal', 'rollup')
+
     def __init__(self, name, group=None, label=None,
             params=None, terminal=False, rollup=None, **kwargs):
         parent = None
@@ -62,6 +64,9 @@ class FunctionTrace(TimeTrace):
                 params=self.params, terminal=self.terminal,
                 rollup=self.rollup))
 
+    def aggregate_key(self):
+        return (self.group, self.name, self.label, self.rollup)
+
     def terminal_node(self):
         return self.terminal
 
@@ -77,9 +82,9 @@ class FunctionTrace(TimeTrace):
                 label=self.label,
                 params=self.params,
                 rollup=self.rollup,
-                guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                guid=self._guid,
+                agent_attributes=self._agent_attributes,
+                user_attributes=self._user_attributes)
 
 
 def FunctionTraceWrapper(wrapped, name=None, group=None, label=None,
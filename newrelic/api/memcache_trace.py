@@ -22,6 +22,8 @@ from newrelic.common.object_wrapper import FunctionWrapper, wrap_object
 
 class MemcacheTrace(TimeTrace):
 
+    __slots__ = ('command',)
+
     def __init__(self, command, **kwargs):
         parent = None
         if kwargs:
@@ -36,6 +38,9 @@ class MemcacheTrace(TimeTrace):
         return '<%s %s>' % (self.__class__.__name__, dict(
                 command=self.command))
 
+    def aggregate_key(self):
+        return (self.command,)
+
     def terminal_node(self):
         return True
 
@@ -47,9 +52,9 @@ class MemcacheTrace(TimeTrace):
                 end_time=self.end_time,
                 duration=self.duration,
                 exclusive=self.exclusive,
-                guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                guid=self._guid,
+                agent_attributes=self._agent_attributes,
+                user_attributes=self._user_attributes)
 
 
 def MemcacheTraceWrapper(wrapped, command):
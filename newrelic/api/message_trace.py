@@ -23,6 +23,9 @@ from newrelic.core.message_node import MessageNode
 
 class MessageTrace(CatHeaderMixin, TimeTrace):
 
+    __slots__ = ('library', 'operation', 'params', 'destination_type',
+            'destination_name', 'settings')
+
     cat_id_key = 'NewRelicID'
     cat_transaction_key = 'NewRelicTransaction'
     cat_appdata_key = 'NewRelicAppData'
@@ -47,6 +50,8 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
         self.destination_type = destination_type
         self.destination_name = destination_name
 
+        self.settings = None
+
     def __enter__(self):
         result = super(MessageTrace, self).__enter__()
 
@@ -65,6 +70,11 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
         return '<%s %s>' % (self.__class__.__name__, dict(
                 library=self.library, operation=self.operation))
 
+    def aggregate_key(self):
+        return (self.library, self.operation, self.destination_type,
+                self.destination_name,
+                tuple(sorted((self.params or {}).items())))
+
     def terminal_node(self):
         return True
 
@@ -80,9 +90,9 @@ class MessageTrace(CatHeaderMixin, TimeTrace):
                 destination_name=self.destination_name,
                 destination_type=self.destination_type,
                 params=self.params,
-                guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes)
+                guid=self._guid,
+                agent_attributes=self._agent_attributes,
+                user_attributes=self._user_attributes)
 
 
 def MessageTraceWrapper(wrapped, library, operation, destination_type,
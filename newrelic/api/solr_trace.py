@@ -20,6 +20,8 @@ import newrelic.api.object_wrapper
 
 class SolrTrace(newrelic.api.time_trace.TimeTrace):
 
+    __slots__ = ('library', 'command')
+
     def __init__(self, library, command, **kwargs):
         parent = None
         if kwargs:
@@ -35,6 +37,9 @@ class SolrTrace(newrelic.api.time_trace.TimeTrace):
         return '<%s %s>' % (self.__class__.__name__, dict(
                 library=self.library, command=self.command))
 
+    def aggregate_key(self):
+        return (self.library, self.command)
+
     def terminal_node(self):
         return True
 
@@ -47,9 +52,9 @@ class SolrTrace(newrelic.api.time_trace.TimeTrace):
                 end_time=self.end_time,
                 duration=self.duration,
                 exclusive=self.exclusive,
-                guid=self.guid,
-                agent_attributes=self.agent_attributes,
-                user_attributes=self.user_attributes,)
+                guid=self._guid,
+                agent_attributes=self._agent_attributes,
+                user_attributes=self._user_attributes,)
 
 
 class SolrTraceWrapper(object):
@@ -14,26 +14,43 @@
 
 import logging
 import random
-import time
 import sys
 import newrelic.packages.six as six
 import traceback
+from newrelic.common.stopwatch import default_timer_ns
 from newrelic.core.trace_cache import trace_cache
+from newrelic.core.aggregate_node import AggregateNode
 from newrelic.core.attribute import (
         process_user_attribute, MAX_NUM_USER_ATTRIBUTES)
 from newrelic.api.settings import STRIP_EXCEPTION_MESSAGE
 
 _logger = logging.getLogger(__name__)
 
+_INF = float('inf')
+
 
 class TimeTrace(object):
 
+    # Traces are created for every instrumented call within a transaction,
+    # so they use slots rather than an instance dictionary. The attribute
+    # dictionaries, list of children and guid are only created when first
+    # needed, as most traces are leaf nodes which never use them.
+
+    __slots__ = ('parent', 'root', 'child_count', 'children', 'start_time',
+            'start_ns', 'end_time', 'duration', 'exclusive', 'thread_id', 'activated',
+            'exited', 'is_async', 'is_aggregated', 'has_async_children',
+            'min_child_start_time', 'exc_data',
+            'should_record_segment_params', '_guid', '_agent_attributes',
+            '_user_attributes', '_aggregates', '_greenlet', '_task',
+            '_context_token', '__weakref__')
+
     def __init__(self, parent=None):
         self.parent = parent
         self.root = None
         self.child_count = 0
-        self.children = []
+        self.children = ()
         self.start_time = 0.0
+        self.start_ns = 0
         self.end_time = 0.0
         self.duration = 0.0
         self.exclusive = 0.0
@@ -41,14 +58,41 @@ class TimeTrace(object):
         self.activated = False
         self.exited = False
         self.is_async = False
+        self.is_aggregated = False
         self.has_async_children = False
-        self.min_child_start_time = float('inf')
+        self.min_child_start_time = _INF
         self.exc_data = (None, None, None)
         self.should_record_segment_params = False
-        # 16-digit random hex. Padded with zeros in the front.
-        self.guid = '%016x' % random.getrandbits(64)
-        self.agent_attributes = {}
-        self.user_attributes = {}
+        self._guid = None
+        self._agent_attributes = None
+        self._user_attributes = None
+        self._aggregates = None
+
+    @property
+    def guid(self):
+        guid = self._guid
+        if guid is None:
+            # 16-digit random hex. Padded with zeros in the front.
+            guid = self._guid = '%016x' % random.getrandbits(64)
+        return guid
+
+    @guid.setter
+    def guid(self, value):
+        self._guid = value
+
+    @property
+    def agent_attributes(self):
+        attributes = self._agent_attributes
+        if attributes is None:
+            attributes = self._agent_attributes = {}
+        return attributes
+
+    @property
+    def user_attributes(self):
+        attributes = self._user_attributes
+        if attributes is None:
+            attributes = self._user_attributes = {}
+        return attributes
 
     @property
     def transaction(self):
@@ -92,19 +136,33 @@ class TimeTrace(object):
         self.should_record_segment_params = (
                 transaction.should_record_segment_params)
 
-        # Record start time.
+        # Record start time. This is read from the monotonic timer, with
+        # the wall clock time being derived from the single reading of the
+        # wall clock made when the transaction was started.
 
-        self.start_time = time.time()
+        self.start_ns = default_timer_ns()
+        self.start_time = transaction._clock.wall_time(self.start_ns)
 
         cache = trace_cache()
         self.thread_id = cache.current_thread_id()
 
-        # Push ourselves as the current node and store parent.
-        try:
-            cache.save_trace(self)
-        except:
-            self.parent = None
-            raise
+        # Where the transaction no longer needs a node for each trace,
+        # terminal traces are aggregated with those of the same name under
+        # the same parent rather than each having its own node. As they
+        # have no children of their own, they need not be tracked against
+        # the greenlet or task they are running in.
+
+        if self.terminal_node() and transaction._aggregate_trace():
+            self.is_aggregated = True
+            cache.push_trace(self)
+
+        else:
+            # Push ourselves as the current node and store parent.
+            try:
+                cache.save_trace(self)
+            except:
+                self.parent = None
+                raise
 
         self.activated = True
 
@@ -135,13 +193,18 @@ class TimeTrace(object):
         # If recording of time for transaction has already been
         # stopped, then that time has to be used.
 
+        clock = transaction._clock
+
         if transaction.stopped:
-            self.end_time = transaction.end_time
+            end_ns = transaction._end_ns
         else:
-            self.end_time = time.time()
+            end_ns = default_timer_ns()
+
+        self.end_time = clock.wall_time(end_ns)
 
-        # Ensure end time is greater. Should be unless the
-        # system clock has been updated.
+        # Ensure end time is greater. Should only not be if the
+        # start time was overridden by instrumentation, or the
+        # transaction was stopped before the trace was started.
 
         if self.end_time < self.start_time:
             self.end_time = self.start_time
@@ -150,8 +213,16 @@ class TimeTrace(object):
         # exclusive time value had been used to accumulate
         # duration from child nodes as negative value, so just
         # add duration to that to get our own exclusive time.
-
-        self.duration = self.end_time - self.start_time
+        # Where the start time is still that derived from the timer,
+        # the duration is calculated from the integer readings of the
+        # timer so as not to lose precision to the magnitude of the
+        # wall clock time.
+
+        if (end_ns >= self.start_ns and
+                self.start_time == clock.wall_time(self.start_ns)):
+            self.duration = (end_ns - self.start_ns) / 1e9
+        else:
+            self.duration = self.end_time - self.start_time
 
         self.exclusive += self.duration
 
@@ -299,7 +370,7 @@ class TimeTrace(object):
 
         # Record a supportability metric if error attributes are being
         # overiden.
-        if 'error.class' in self.agent_attributes:
+        if self._agent_attributes and 'error.class' in self._agent_attributes:
             transaction._record_supportability(
                     'Supportability/'
                     'SpanEvent/Errors/Dropped')
@@ -395,7 +466,8 @@ class TimeTrace(object):
 
         # Observe errors on the span only if record_exception hasn't been
         # called already
-        if exc_data[0] and 'error.class' not in self.agent_attributes:
+        if exc_data[0] and not (self._agent_attributes and
+                'error.class' in self._agent_attributes):
             self._observe_exception(exc_data)
 
         # Wipe out root reference as well
@@ -413,13 +485,17 @@ class TimeTrace(object):
         # Give chance for derived class to create a standin node
         # object to be used in the transaction trace. If we get
         # one then give chance for transaction object to do
-        # something with it, as well as our parent node.
+        # something with it, as well as our parent node. Aggregated
+        # traces are instead merged into the node held by the parent for
+        # the first trace with the same name.
 
-        node = self.create_node()
+        if not (self.is_aggregated and
+                parent.process_aggregated_child(self, transaction)):
+            node = self.create_node()
 
-        if node:
-            transaction._process_node(node)
-            parent.process_child(node, self.is_async)
+            if node:
+                transaction._process_node(node)
+                parent.process_child(node, self.is_async)
 
         # ----------------------------------------------------------------------
         # SYNC  | The parent will not have exited yet, so no node will be
@@ -437,6 +513,12 @@ class TimeTrace(object):
     def create_node(self):
         return self
 
+    def aggregate_key(self):
+        # Derived classes for terminal traces return the values which
+        # identify traces which can be aggregated into a single node.
+
+        return None
+
     def terminal_node(self):
         return False
 
@@ -471,7 +553,66 @@ class TimeTrace(object):
                     exclusive_duration_remaining)
 
     def process_child(self, node, is_async):
-        self.children.append(node)
+        if self.children:
+            self.children.append(node)
+        else:
+            self.children = [node]
+
+        self._process_child_time(node, is_async)
+
+    def process_aggregated_child(self, trace, transaction):
+        key = trace.aggregate_key()
+
+        if key is None:
+            return False
+
+        # A trace whose guid has been handed out, such as in the headers
+        # of a distributed trace, keeps its own node so that the span
+        # referred to by that guid is reported.
+
+        if trace._guid is not None:
+            return False
+
+        # Attributes, such as the status code of an external call, are
+        # only kept for the first trace, so traces with different
+        # attributes are not aggregated together.
+
+        key = (type(trace), key)
+
+        if trace._agent_attributes or trace._user_attributes:
+            key += (tuple(sorted((trace._agent_attributes or {}).items())),
+                    tuple(sorted((trace._user_attributes or {}).items())))
+
+        aggregates = self._aggregates
+        if aggregates is None:
+            aggregates = self._aggregates = {}
+
+        try:
+            aggregate = aggregates.get(key)
+        except TypeError:
+            return False
+
+        if aggregate is None:
+            node = trace.create_node()
+            transaction._process_node(node)
+
+            aggregate = aggregates[key] = AggregateNode(node)
+            self.process_child(aggregate, trace.is_async)
+
+            return True
+
+        aggregate.merge_trace(trace)
+        transaction.total_time += trace.exclusive
+
+        # The trace was counted as a child when entered, but is merged
+        # into an existing child rather than being added as a new one.
+
+        self.child_count -= 1
+        self._process_child_time(trace, trace.is_async)
+
+        return True
+
+    def _process_child_time(self, node, is_async):
         if is_async:
 
             # record the lowest start time
@@ -487,7 +628,7 @@ class TimeTrace(object):
                         exclusive_duration)
 
                 # reset time range tracking
-                self.min_child_start_time = float('inf')
+                self.min_child_start_time = _INF
         else:
             self.exclusive -= node.duration
 
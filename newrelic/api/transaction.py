@@ -46,6 +46,7 @@ from newrelic.core.attribute_filter import (DST_NONE, DST_ERROR_COLLECTOR,
 from newrelic.core.config import DEFAULT_RESERVOIR_SIZE
 from newrelic.core.custom_event import create_custom_event
 from newrelic.core.stack_trace import exception_stack
+from newrelic.common.stopwatch import ClockAnchor, default_timer_ns
 from newrelic.common.encoding_utils import (generate_path_hash, obfuscate,
         deobfuscate, json_encode, json_decode, base64_decode,
         convert_to_cat_metadata_value, DistributedTracePayload, ensure_str,
@@ -73,6 +74,7 @@ class Sentinel(TimeTrace):
     def __init__(self, transaction):
         super(Sentinel, self).__init__(None)
         self.transaction = transaction
+        self.children = []
 
         # Set the thread id to the same as the transaction
         self.thread_id = transaction.thread_id
@@ -179,11 +181,17 @@ class Transaction(object):
         self.end_time = 0.0
         self.last_byte_time = 0.0
 
+        self._clock = None
+        self._end_ns = 0
+
         self.total_time = 0.0
 
         self.stopped = False
 
         self._trace_node_count = 0
+        self._segment_budget = 0
+        self._unsampled_metrics_only = False
+        self._metrics_only_until_ns = None
 
         self._errors = []
         self._slow_sql = []
@@ -302,6 +310,10 @@ class Transaction(object):
 
                 if self._settings:
                     self.enabled = True
+                    self._segment_budget = (self._settings.agent_limits.
+                            segments_per_transaction or 0)
+                    self._unsampled_metrics_only = (self._settings.
+                            transaction_segments.unsampled_metrics_only)
 
     def __del__(self):
         self._dead = True
@@ -317,9 +329,12 @@ class Transaction(object):
         if not self.enabled:
             return self
 
-        # Record the start time for transaction.
+        # Record the start time for transaction. The times of the traces
+        # within the transaction are measured using the monotonic timer
+        # relative to this single reading of the wall clock.
 
-        self.start_time = time.time()
+        self._clock = ClockAnchor()
+        self.start_time = self._clock.time
 
         # Record initial CPU user time.
 
@@ -407,7 +422,8 @@ class Transaction(object):
         # calculate the duration.
 
         if not self.stopped:
-            self.end_time = time.time()
+            self._end_ns = default_timer_ns()
+            self.end_time = self._clock.wall_time(self._end_ns)
 
         # Calculate transaction duration
 
@@ -1394,7 +1410,8 @@ class Transaction(object):
             if self.end_time:
                 duration = self.end_time - self.start_time
             else:
-                duration = time.time() - self.start_time
+                duration = (self._clock.wall_time(default_timer_ns()) -
+                        self.start_time)
 
             # Generate the additional response headers which provide
             # information back to the caller. We need to freeze the
@@ -1583,6 +1600,90 @@ class Transaction(object):
                 return
             self._slow_sql.append(node)
 
+    def _aggregate_trace(self):
+        # Once the segment budget of the transaction has been used up,
+        # terminal traces are aggregated with those of the same name under
+        # the same parent rather than each having its own node.
+
+        if self._trace_node_count >= self._segment_budget > 0:
+            return True
+
+        # The same is done where the nodes would never be reported, with
+        # only the metrics for the traces being needed. This is the case
+        # where the transaction is not sampled, so no span events will be
+        # sent, and has not yet run long enough that it could be saved as
+        # the slow transaction trace. A transaction which does go on to be
+        # saved as the slow transaction trace will have the traces from
+        # before the threshold was reached collapsed.
+
+        if (not self._unsampled_metrics_only or self._sampled or
+                self.record_tt):
+            return False
+
+        # The deadline is worked out at the first terminal trace and then
+        # kept, so the check is only a comparison for each trace after.
+
+        until_ns = self._metrics_only_until_ns
+
+        if until_ns is None:
+            until_ns = self._metrics_only_until_ns = (
+                    self._metrics_only_deadline())
+
+        return until_ns > 0 and default_timer_ns() < until_ns
+
+    def _metrics_only_deadline(self):
+        # Returns the reading of the timer up until which the terminal
+        # traces of the transaction can be aggregated, or zero where they
+        # never can be.
+
+        settings = self._settings
+
+        if (settings.distributed_tracing.enabled and
+                settings.span_events.enabled and
+                settings.collect_span_events):
+
+            # With infinite tracing, span events are sent for all
+            # transactions, whether sampled or not.
+
+            if settings.infinite_tracing.enabled:
+                return 0
+
+            # Whether the transaction is sampled is otherwise usually only
+            # decided when it ends. Inbound distributed trace headers are
+            # accepted as the transaction starts, before any of its traces,
+            # so the decision is made here at its first terminal trace
+            # instead. Where headers are still accepted after this and the
+            # upstream service sampled the trace, the transaction is then
+            # sampled and traces from that point on keep their nodes.
+
+            self._compute_sampled_and_priority()
+
+            if self._sampled:
+                return 0
+
+        # Synthetics transactions always have their trace saved.
+
+        if self.synthetics_resource_id:
+            return 0
+
+        transaction_tracer = settings.transaction_tracer
+
+        if (self.suppress_transaction_trace or
+                not transaction_tracer.enabled or
+                not settings.collect_traces):
+            return float('inf')
+
+        threshold = transaction_tracer.transaction_threshold
+
+        if threshold is None:
+            # The apdex is only known for certain once the name of the
+            # transaction is frozen, so allow for any key transaction.
+
+            threshold = 4 * max([settings.apdex_t] +
+                    list(settings.web_transactions_apdex.values()))
+
+        return self._clock.counter_ns + int(threshold * 1e9)
+
     def stop_recording(self):
         if not self.enabled:
             return
@@ -1593,7 +1694,8 @@ class Transaction(object):
         if self.end_time:
             return
 
-        self.end_time = time.time()
+        self._end_ns = default_timer_ns()
+        self.end_time = self._clock.wall_time(self._end_ns)
         self.stopped = True
 
         if self._utilization_tracker:
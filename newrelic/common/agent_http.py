@@ -16,13 +16,15 @@ from __future__ import print_function
 
 import os
 import sys
+import threading
 import time
 import zlib
-from pprint import pprint
 
 import newrelic.packages.urllib3 as urllib3
 from newrelic import version
 from newrelic.common import certs
+from newrelic.common.audit_log import AuditLogWriter, print_request, print_response
+from newrelic.common.compression import PayloadCompressor
 from newrelic.common.encoding_utils import json_decode, json_encode
 from newrelic.common.object_names import callable_name
 from newrelic.common.object_wrapper import patch_function_wrapper
@@ -72,6 +74,120 @@ def _urllib3_ssl_recursion_workaround(wrapped, instance, args, kwargs):
         return wrapped(*args, **kwargs)
 
 
+class CompressedPayload(bytes):
+    """A request payload which was compressed as it was encoded. The
+    length is that of the compressed data, with the length of the data
+    before compression being held as the uncompressed_size.
+
+    """
+
+    def __new__(
+        cls,
+        data,
+        method,
+        uncompressed_size,
+        compression_time,
+        level=None,
+        dictionary=None,
+    ):
+        payload = super(CompressedPayload, cls).__new__(cls, data)
+        payload.method = method
+        payload.uncompressed_size = uncompressed_size
+        payload.compression_time = compression_time
+        payload.level = level
+        payload.dictionary = dictionary
+        return payload
+
+    def decompress(self):
+        if self.dictionary:
+            decompressor = zlib.decompressobj(15, zdict=self.dictionary)
+            return decompressor.decompress(self) + decompressor.flush()
+
+        return zlib.decompress(self, 47)
+
+
+class _PooledConnection(object):
+    def __init__(self, pool):
+        self.pool = pool
+        self.users = 0
+        self.released = None
+        self.requests = 0
+        self.connections = 0
+
+
+class ConnectionPoolRegistry(object):
+    """Holds the connection pools used to send requests to the data
+    collector, keyed by the host, port and options of the connection, so
+    that connections are kept alive and reused across harvests and across
+    sessions. A pool which has been left unused for longer than the maximum
+    idle time is closed rather than reused, and the pools inherited by a
+    forked process are discarded.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._process_id = os.getpid()
+
+    def acquire(self, key, factory, max_idle_time=None):
+        with self._lock:
+            if self._process_id != os.getpid():
+                # The sockets of a pool inherited from the parent process
+                # are still in use by the parent, so must not be closed.
+
+                self._pools = {}
+                self._process_id = os.getpid()
+
+            entry = self._pools.get(key)
+
+            if (
+                entry is not None
+                and not entry.users
+                and max_idle_time is not None
+                and time.time() - entry.released > max_idle_time
+            ):
+                entry.pool.close()
+                entry = None
+
+            if entry is None:
+                entry = self._pools[key] = _PooledConnection(factory())
+
+            entry.users += 1
+
+            return entry.pool
+
+    def release(self, key, pool):
+        """Releases a pool obtained from acquire(), returning the number of
+        new connections made and the number of times an existing connection
+        was reused, since last released.
+
+        """
+
+        with self._lock:
+            entry = self._pools.get(key)
+
+            if entry is None or entry.pool is not pool:
+                return 0, 0
+
+            entry.users = max(0, entry.users - 1)
+            entry.released = time.time()
+
+            requests = pool.num_requests - entry.requests
+            connections = pool.num_connections - entry.connections
+
+            entry.requests = pool.num_requests
+            entry.connections = pool.num_connections
+
+        return connections, max(0, requests - connections)
+
+
+# The connection pools shared by all sessions with the data collector in
+# the process, when connections are kept alive across harvests.
+
+COLLECTOR_CONNECTION_POOLS = ConnectionPoolRegistry()
+
+
 class BaseClient(object):
     AUDIT_LOG_ID = 0
 
@@ -92,6 +208,11 @@ class BaseClient(object):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
+        compression_dictionary=None,
+        compression_time_budget=None,
+        connection_pools=None,
+        connection_max_idle_time=None,
     ):
         self._audit_log_fp = audit_log_fp
 
@@ -107,10 +228,31 @@ class BaseClient(object):
     def finalize(self):
         pass
 
+    @staticmethod
+    def prepare_payload(chunks, endpoint=None, chunk_sizes=None):
+        """Returns the payload for a request given the encoded payload as
+        an iterable of byte strings. Where a list is supplied for the
+        chunk sizes, the encoded size of each chunk is appended to it.
+
+        """
+
+        chunks = list(chunks)
+        if chunk_sizes is not None:
+            chunk_sizes.extend(len(chunk) for chunk in chunks)
+        return b"".join(chunks)
+
     @staticmethod
     def _supportability_request(params, payload, body, compression_time):
         pass
 
+    @staticmethod
+    def _supportability_connections(new, reused):
+        pass
+
+    @staticmethod
+    def retry_after():
+        return None
+
     @classmethod
     def log_request(
         cls, fp, method, url, params, payload, headers, body=None, compression_time=None
@@ -120,37 +262,48 @@ class BaseClient(object):
         if not fp:
             return
 
+        if isinstance(fp, AuditLogWriter):
+            # The payload is handed to the writer thread as it is, with
+            # decompressing and decoding it left to when the audit log is
+            # read back.
+
+            log_id = fp.next_id()
+
+            fp.put(
+                {
+                    "type": "request",
+                    "id": log_id,
+                    "time": time.time(),
+                    "pid": os.getpid(),
+                    "url": url,
+                    "params": params,
+                    "headers": headers,
+                    "encoding": getattr(payload, "method", None),
+                    "dictionary": bool(getattr(payload, "dictionary", None)),
+                },
+                payload,
+            )
+
+            return log_id
+
         # Maintain a global AUDIT_LOG_ID attached to all class instances
         # NOTE: this is not thread safe so this class cannot be used
         # across threads when audit logging is on
         cls.AUDIT_LOG_ID += 1
 
-        print(
-            "TIME: %r" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), file=fp,
-        )
-        print(file=fp)
-        print("ID: %r" % cls.AUDIT_LOG_ID, file=fp)
-        print(file=fp)
-        print("PID: %r" % os.getpid(), file=fp)
-        print(file=fp)
-        print("URL: %r" % url, file=fp)
-        print(file=fp)
-        print("PARAMS: %r" % params, file=fp)
-        print(file=fp)
-        print("HEADERS: %r" % headers, file=fp)
-        print(file=fp)
-        print("DATA:", end=" ", file=fp)
+        if isinstance(payload, CompressedPayload):
+            payload = payload.decompress()
 
-        try:
-            data = json_decode(payload.decode("utf-8"))
-        except Exception:
-            data = payload
-
-        pprint(data, stream=fp)
-
-        print(file=fp)
-        print(78 * "=", file=fp)
-        print(file=fp)
+        print_request(
+            fp,
+            cls.AUDIT_LOG_ID,
+            time.time(),
+            os.getpid(),
+            url,
+            params,
+            headers,
+            payload,
+        )
 
         fp.flush()
 
@@ -173,35 +326,27 @@ class BaseClient(object):
         if not fp:
             return
 
-        try:
-            result = json_decode(data)
-        except Exception:
-            result = data
+        exception = exc_info and repr(exc_info[1])
+
+        if isinstance(fp, AuditLogWriter):
+            fp.put(
+                {
+                    "type": "response",
+                    "id": log_id,
+                    "time": time.time(),
+                    "pid": os.getpid(),
+                    "status": status,
+                    "headers": headers and dict(headers),
+                    "exception": exception,
+                },
+                data or b"",
+            )
+
+            return
 
-        print(
-            "TIME: %r" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), file=fp
+        print_response(
+            fp, log_id, time.time(), os.getpid(), status, headers, data, exception,
         )
-        print(file=fp)
-        print("ID: %r" % log_id, file=fp)
-        print(file=fp)
-        print("PID: %r" % os.getpid(), file=fp)
-        print(file=fp)
-
-        if exc_info:
-            print("Exception: %r" % exc_info[1], file=fp)
-            print(file=fp)
-        else:
-            print("STATUS: %r" % status, file=fp)
-            print(file=fp)
-            print("HEADERS:", end=" ", file=fp)
-            pprint(dict(headers), stream=fp)
-            print(file=fp)
-            print("RESULT:", end=" ", file=fp)
-            pprint(result, stream=fp)
-            print(file=fp)
-
-        print(78 * "=", file=fp)
-        print(file=fp)
 
         fp.flush()
 
@@ -240,12 +385,23 @@ class HttpClient(BaseClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
+        compression_dictionary=None,
+        compression_time_budget=None,
+        connection_pools=None,
+        connection_max_idle_time=None,
     ):
         self._host = host
         port = self._port = port
         self._compression_threshold = compression_threshold
         self._compression_level = compression_level
         self._compression_method = compression_method
+        self._compressor = PayloadCompressor(
+            compression_method,
+            compression_level,
+            compression_dictionary,
+            compression_time_budget,
+        )
         self._max_payload_size_in_bytes = max_payload_size_in_bytes
         self._audit_log_fp = audit_log_fp
 
@@ -254,6 +410,7 @@ class HttpClient(BaseClient):
         self._headers = dict(self.BASE_HEADERS)
         self._connection_kwargs = connection_kwargs = {
             "timeout": timeout,
+            "maxsize": max(1, max_connections),
         }
         self._urlopen_kwargs = urlopen_kwargs = {}
 
@@ -301,6 +458,17 @@ class HttpClient(BaseClient):
         self._proxy = proxy
 
         self._connection_attr = None
+        self._connection_lock = threading.Lock()
+
+        self._connection_pools = connection_pools
+        self._connection_max_idle_time = connection_max_idle_time
+        self._response_state = threading.local()
+        self._connection_key = (
+            self.CONNECTION_CLS,
+            self._host,
+            self._port,
+            repr(sorted(connection_kwargs.items())),
+        )
 
     @staticmethod
     def _parse_proxy(scheme, host, port, username, password):
@@ -334,7 +502,9 @@ class HttpClient(BaseClient):
         return self
 
     def __exit__(self, exc, value, tb):
-        if self._connection_attr:
+        if self._connection_pools is not None:
+            self.close_connection()
+        elif self._connection_attr:
             self._connection_attr.__exit__(exc, value, tb)
             self._connection_attr = None
 
@@ -343,22 +513,69 @@ class HttpClient(BaseClient):
         if self._connection_attr:
             return self._connection_attr
 
+        # Requests may be made concurrently from multiple threads during a
+        # harvest, all of which must share the one connection pool.
+        with self._connection_lock:
+            if self._connection_attr:
+                return self._connection_attr
+
+            if self._connection_pools is not None:
+                self._connection_attr = self._connection_pools.acquire(
+                    self._connection_key,
+                    self._new_connection,
+                    self._connection_max_idle_time,
+                )
+            else:
+                self._connection_attr = self._new_connection()
+
+            return self._connection_attr
+
+    def _new_connection(self):
         retries = urllib3.Retry(
             total=False, connect=None, read=None, redirect=0, status=None
         )
-        self._connection_attr = self.CONNECTION_CLS(
+        return self.CONNECTION_CLS(
             self._host,
             self._port,
             strict=True,
             retries=retries,
             **self._connection_kwargs
         )
-        return self._connection_attr
 
     def close_connection(self):
-        if self._connection_attr:
-            self._connection_attr.close()
-            self._connection_attr = None
+        # Where connections are kept alive across harvests, the pool is
+        # returned to the registry rather than closed.
+
+        with self._connection_lock:
+            connection, self._connection_attr = self._connection_attr, None
+
+        if not connection:
+            return
+
+        if self._connection_pools is not None:
+            new, reused = self._connection_pools.release(
+                self._connection_key, connection
+            )
+            self._supportability_connections(new, reused)
+        else:
+            connection.close()
+
+    def retry_after(self):
+        """Returns the number of seconds the data collector asked to wait
+        before retrying, as given in the last response received by the
+        calling thread, or None if no retry hint was given.
+
+        """
+
+        retry_after = getattr(self._response_state, "retry_after", None)
+
+        if retry_after is None:
+            return None
+
+        try:
+            return urllib3.Retry(0).parse_retry_after(retry_after)
+        except urllib3.exceptions.InvalidHeader:
+            return None
 
     def log_request(
         self,
@@ -378,19 +595,75 @@ class HttpClient(BaseClient):
             fp, method, url, params, payload, headers, body, compression_time
         )
 
-    @staticmethod
-    def _compress(data, method="gzip", level=None):
+    # The encoded chunks of a payload are gathered into blocks of at least
+    # this size before being passed to the compressor, as compressing very
+    # small chunks individually is inefficient.
+
+    COMPRESSION_BLOCK_SIZE = 64 * 1024
+
+    def prepare_payload(self, chunks, endpoint=None, chunk_sizes=None):
+        """Returns the payload for a request given the encoded payload as
+        an iterable of byte strings. Where the payload exceeds the
+        compression threshold, the chunks are compressed as they are
+        produced, so the whole of the uncompressed payload is never held
+        in memory at once. The compression level used is chosen for the
+        endpoint the payload is being sent to. Where a list is supplied
+        for the chunk sizes, the encoded size of each chunk is appended
+        to it.
+
+        """
+
+        pending = []
+        pending_size = 0
+        uncompressed_size = 0
+
+        compressor = None
+        compressed = []
+        compression_time = 0.0
+
+        for chunk in chunks:
+            pending.append(chunk)
+            pending_size += len(chunk)
+
+            if chunk_sizes is not None:
+                chunk_sizes.append(len(chunk))
+
+            if compressor is None:
+                if pending_size <= self._compression_threshold:
+                    continue
+
+                level = self._compressor.level(endpoint)
+                compressor = self._compressor.compressobj(level)
+
+            if pending_size >= self.COMPRESSION_BLOCK_SIZE:
+                compression_start = time.time()
+                compressed.append(compressor.compress(b"".join(pending)))
+                compression_time += max(time.time(), compression_start) - compression_start
+
+                uncompressed_size += pending_size
+                pending = []
+                pending_size = 0
+
+        if compressor is None:
+            return b"".join(pending)
+
         compression_start = time.time()
-        level = level or zlib.Z_DEFAULT_COMPRESSION
-        wbits = 31 if method == "gzip" else 15
+        compressed.append(compressor.compress(b"".join(pending)))
+        compressed.append(compressor.flush())
+        compression_time += max(time.time(), compression_start) - compression_start
 
-        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
-        data = compressor.compress(data)
-        data += compressor.flush()
+        uncompressed_size += pending_size
 
-        compression_time = max(time.time(), compression_start) - compression_start
+        self._compressor.record(endpoint, level, uncompressed_size, compression_time)
 
-        return data, compression_time
+        return CompressedPayload(
+            b"".join(compressed),
+            self._compression_method,
+            uncompressed_size,
+            compression_time,
+            level,
+            self._compressor.dictionary,
+        )
 
     def send_request(
         self,
@@ -410,21 +683,23 @@ class HttpClient(BaseClient):
         if headers:
             merged_headers.update(headers)
         path = self._prefix + path
-        body = payload
         compression_time = None
         if payload is not None:
-            if len(payload) > self._compression_threshold:
-                body, compression_time = self._compress(
-                    payload,
-                    method=self._compression_method,
-                    level=self._compression_level,
+            if not isinstance(payload, CompressedPayload):
+                payload = self.prepare_payload(
+                    (payload,), endpoint=params and params.get("method")
                 )
-                content_encoding = self._compression_method
+
+            if isinstance(payload, CompressedPayload):
+                compression_time = payload.compression_time
+                content_encoding = payload.method
             else:
                 content_encoding = "Identity"
 
             merged_headers["Content-Encoding"] = content_encoding
 
+        body = payload
+
         request_id = self.log_request(
             self._audit_log_fp,
             "POST",
@@ -465,6 +740,8 @@ class HttpClient(BaseClient):
             connection,
         )
 
+        self._response_state.retry_after = response.headers.get("Retry-After")
+
         return response.status, response.data
 
 
@@ -489,6 +766,11 @@ class InsecureHttpClient(HttpClient):
         compression_method="gzip",
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
+        max_connections=1,
+        compression_dictionary=None,
+        compression_time_budget=None,
+        connection_pools=None,
+        connection_max_idle_time=None,
     ):
         proxy = self._parse_proxy(proxy_scheme, proxy_host, None, None, None)
         if proxy and proxy.scheme == "https":
@@ -515,6 +797,11 @@ class InsecureHttpClient(HttpClient):
             compression_method,
             max_payload_size_in_bytes,
             audit_log_fp,
+            max_connections,
+            compression_dictionary,
+            compression_time_budget,
+            connection_pools,
+            connection_max_idle_time,
         )
 
 
@@ -532,18 +819,32 @@ class SupportabilityMixin(object):
             if compression_time is not None:
                 internal_metric(
                     "Supportability/Python/Collector/ZLIB/Bytes/%s" % agent_method,
-                    len(payload),
+                    getattr(payload, "uncompressed_size", len(payload)),
                 )
                 internal_metric(
                     "Supportability/Python/Collector/ZLIB/Compress/%s" % agent_method,
                     compression_time,
                 )
+                internal_metric(
+                    "Supportability/Python/Collector/ZLIB/Ratio/%s" % agent_method,
+                    float(getattr(payload, "uncompressed_size", len(payload)))
+                    / len(body),
+                )
 
             internal_metric(
                 "Supportability/Python/Collector/Output/Bytes/%s" % agent_method,
                 len(body),
             )
 
+    @staticmethod
+    def _supportability_connections(new, reused):
+        if new:
+            internal_count_metric("Supportability/Python/Collector/Connections/New", new)
+        if reused:
+            internal_count_metric(
+                "Supportability/Python/Collector/Connections/Reused", reused
+            )
+
     @staticmethod
     def _supportability_response(status, exc, connection="direct"):
         if exc or not 200 <= status < 300:
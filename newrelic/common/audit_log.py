@@ -0,0 +1,461 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the audit log of requests made to the data
+collector and the responses received.
+
+The audit log can be written as text from the thread making the request,
+or by a background writer thread as binary records. With the latter, the
+request and response bodies are handed to the writer thread as they are,
+without being decoded or copied, and are written to the audit log file
+exactly as they were sent or received. The audit log file is rotated once
+it reaches a maximum size. The binary records can be decoded and printed
+as text using the 'newrelic-admin audit-log' command.
+
+Where processes, such as the worker processes of a web server, share the
+same audit log file, the file is locked while records are written to it
+or it is rotated. A process finding that the file was rotated by another
+process while waiting for the lock reopens the file.
+
+The audit log file starts with a magic string and is followed by the
+records. Each record consists of the lengths of the record metadata and
+of the body, followed by the JSON encoded metadata and the body itself.
+
+"""
+
+from __future__ import print_function
+
+import atexit
+import collections
+import itertools
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pprint import pprint
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from newrelic.common.compression import PAYLOAD_DICTIONARY
+from newrelic.common.encoding_utils import json_decode, json_encode
+
+_logger = logging.getLogger(__name__)
+
+_MAGIC = b'NRAUDIT1'
+
+# Length of record metadata, length of record body.
+
+_RECORD_HEADER = struct.Struct('<II')
+
+
+def print_request(fp, log_id, timestamp, pid, url, params, headers, data):
+    """Prints a request made to the data collector to the text audit log."""
+
+    print("TIME: %r" % time.strftime("%Y-%m-%d %H:%M:%S",
+            time.localtime(timestamp)), file=fp)
+    print(file=fp)
+    print("ID: %r" % log_id, file=fp)
+    print(file=fp)
+    print("PID: %r" % pid, file=fp)
+    print(file=fp)
+    print("URL: %r" % url, file=fp)
+    print(file=fp)
+    print("PARAMS: %r" % params, file=fp)
+    print(file=fp)
+    print("HEADERS: %r" % headers, file=fp)
+    print(file=fp)
+    print("DATA:", end=" ", file=fp)
+
+    try:
+        data = json_decode(data.decode("utf-8"))
+    except Exception:
+        pass
+
+    pprint(data, stream=fp)
+
+    print(file=fp)
+    print(78 * "=", file=fp)
+    print(file=fp)
+
+
+def print_response(fp, log_id, timestamp, pid, status, headers, data,
+        exception=None):
+    """Prints a response received from the data collector to the text
+    audit log. Where the request failed, the exception is printed instead.
+
+    """
+
+    try:
+        data = json_decode(data)
+    except Exception:
+        pass
+
+    print("TIME: %r" % time.strftime("%Y-%m-%d %H:%M:%S",
+            time.localtime(timestamp)), file=fp)
+    print(file=fp)
+    print("ID: %r" % log_id, file=fp)
+    print(file=fp)
+    print("PID: %r" % pid, file=fp)
+    print(file=fp)
+
+    if exception is not None:
+        print("Exception: %s" % exception, file=fp)
+        print(file=fp)
+    else:
+        print("STATUS: %r" % status, file=fp)
+        print(file=fp)
+        print("HEADERS:", end=" ", file=fp)
+        pprint(dict(headers), stream=fp)
+        print(file=fp)
+        print("RESULT:", end=" ", file=fp)
+        pprint(data, stream=fp)
+        print(file=fp)
+
+    print(78 * "=", file=fp)
+    print(file=fp)
+
+
+class AuditLogWriter(object):
+    """Writes audit log records from a background thread to a file which
+    is rotated once it reaches max_bytes, keeping backup_count rotated
+    files. Records are dropped where more than queue_size records are
+    waiting to be written.
+
+    """
+
+    def __init__(self, path, max_bytes=0, backup_count=0, queue_size=1000):
+        self.path = path
+
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._queue_size = max(1, queue_size)
+
+        self._ids = itertools.count(1)
+
+        self._queue = collections.deque()
+        self._notify = threading.Condition()
+        self._writing = False
+        self._shutdown = False
+        self._dropped = 0
+
+        self._fp = None
+        self._size = 0
+
+        self._process_id = None
+        self._thread = None
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def next_id(self):
+        """Returns the identifier for the next request to be logged."""
+
+        return next(self._ids)
+
+    def put(self, metadata, body=b''):
+        """Queues a record for writing. The metadata must be a JSON
+        encodable dictionary and the body a byte string, which is written
+        as is. Returns False if the record was dropped.
+
+        """
+
+        with self._notify:
+            if self._shutdown:
+                # The writer thread may still be writing records where
+                # waiting for it to stop timed out, in which case it will
+                # also write this record before stopping. Otherwise the
+                # record is written immediately.
+
+                if self._writing and self._process_id == os.getpid():
+                    self._queue.append((metadata, body))
+                else:
+                    self._write_records([(metadata, body)])
+
+                return True
+
+            self._start_thread()
+
+            if len(self._queue) >= self._queue_size:
+                if not self._dropped:
+                    _logger.warning('The audit log writer is not keeping '
+                            'up with the requests being logged. Records '
+                            'are being dropped from the audit log %r.',
+                            self.path)
+
+                self._dropped += 1
+                return False
+
+            self._queue.append((metadata, body))
+            self._notify.notify_all()
+
+        return True
+
+    def flush(self, timeout=None):
+        """Waits until all queued records have been written. Returns False
+        if the timeout expired before the queue was drained.
+
+        """
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self._notify:
+            while self._queue or self._writing:
+                if self._thread is None or not self._thread.is_alive():
+                    return False
+
+                if timeout is None:
+                    self._notify.wait()
+                    continue
+
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    return False
+
+                self._notify.wait(remaining)
+
+        return True
+
+    def shutdown(self, timeout=None):
+        self.flush(timeout)
+
+        with self._notify:
+            self._shutdown = True
+            self._notify.notify_all()
+            thread = self._thread
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _start_thread(self):
+        # Called with the lock held. The writer thread does not survive a
+        # fork, so a new thread is started in the child process.
+
+        if self._process_id == os.getpid():
+            return
+
+        if self._process_id is None:
+            # Records still queued on process exit are written before the
+            # writer thread is stopped. Any later records, such as those of
+            # the final harvest, are then written immediately.
+
+            atexit.register(self.shutdown, 5.0)
+
+        self._process_id = os.getpid()
+        self._queue.clear()
+        self._writing = False
+        self._fp = None
+
+        self._thread = threading.Thread(target=self._run,
+                name='NR-Audit-Log-Writer')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _open(self):
+        self._fp = open(self.path, 'ab')
+
+    def _lock(self):
+        # Locks the audit log file against other processes writing to it,
+        # reopening the file where it was rotated by another process
+        # before the lock was acquired. The size of the file is read once
+        # locked, as other processes may have written to it.
+
+        while True:
+            if self._fp is None:
+                self._open()
+
+            if fcntl is None:
+                break
+
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX)
+
+            try:
+                if (os.stat(self.path).st_ino ==
+                        os.fstat(self._fp.fileno()).st_ino):
+                    break
+            except OSError:
+                pass
+
+            self._fp.close()
+            self._fp = None
+
+        self._size = os.fstat(self._fp.fileno()).st_size
+
+        if not self._size:
+            self._fp.write(_MAGIC)
+            self._size = len(_MAGIC)
+
+    def _unlock(self):
+        if fcntl is not None and self._fp is not None:
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+
+    def _rotate(self):
+        # Called with the file locked, the lock being released when the
+        # file is closed.
+
+        if self._backup_count > 0:
+            for index in range(self._backup_count - 1, 0, -1):
+                source = '%s.%d' % (self.path, index)
+                if os.path.exists(source):
+                    os.rename(source, '%s.%d' % (self.path, index + 1))
+
+            os.rename(self.path, self.path + '.1')
+
+        else:
+            os.remove(self.path)
+
+        self._fp.close()
+        self._fp = None
+
+        self._lock()
+
+    def _write(self, metadata, body):
+        metadata = json_encode(metadata).encode('utf-8')
+        size = _RECORD_HEADER.size + len(metadata) + len(body)
+
+        if (self._max_bytes and self._size > len(_MAGIC) and
+                self._size + size > self._max_bytes):
+            self._rotate()
+
+        self._fp.write(_RECORD_HEADER.pack(len(metadata), len(body)))
+        self._fp.write(metadata)
+        self._fp.write(body)
+
+        self._size += size
+
+    def _write_records(self, records):
+        self._lock()
+
+        try:
+            for metadata, body in records:
+                self._write(metadata, body)
+
+            self._fp.flush()
+
+        finally:
+            self._unlock()
+
+    def _run(self):
+        while True:
+            with self._notify:
+                while not self._queue and not self._shutdown:
+                    self._notify.wait()
+
+                if not self._queue:
+                    return
+
+                records = list(self._queue)
+                self._queue.clear()
+                self._writing = True
+
+            try:
+                self._write_records(records)
+
+            except Exception:
+                _logger.exception('Writing to the audit log %r has failed. '
+                        'Check that the audit log file can be written.',
+                        self.path)
+
+            finally:
+                with self._notify:
+                    self._writing = False
+                    self._notify.notify_all()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def audit_log_writer(path, max_bytes=0, backup_count=0, queue_size=1000):
+    """Returns the audit log writer for the file, being shared by all
+    sessions with the data collector, so that there is only ever a single
+    thread writing to the file.
+
+    """
+
+    path = os.path.abspath(path)
+
+    with _writers_lock:
+        writer = _writers.get(path)
+
+        if writer is None:
+            writer = AuditLogWriter(path, max_bytes, backup_count, queue_size)
+            _writers[path] = writer
+
+        return writer
+
+
+def read_records(fp):
+    """Returns an iterator over the metadata and body of each record in
+    a binary audit log file.
+
+    """
+
+    if fp.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError('Not a binary audit log file.')
+
+    while True:
+        header = fp.read(_RECORD_HEADER.size)
+
+        if len(header) < _RECORD_HEADER.size:
+            return
+
+        metadata_length, body_length = _RECORD_HEADER.unpack(header)
+
+        metadata = fp.read(metadata_length)
+        body = fp.read(body_length)
+
+        if len(metadata) < metadata_length or len(body) < body_length:
+            # The last record may be incomplete where the file was read
+            # while it was being written.
+
+            return
+
+        yield json_decode(metadata.decode('utf-8')), body
+
+
+def decode_body(metadata, body):
+    """Returns the body of a record as it was before being compressed."""
+
+    encoding = metadata.get('encoding')
+
+    if encoding in ('gzip', 'deflate'):
+        if metadata.get('dictionary'):
+            decompressor = zlib.decompressobj(15, zdict=PAYLOAD_DICTIONARY)
+            return decompressor.decompress(body) + decompressor.flush()
+
+        return zlib.decompress(body, 47)
+
+    return body
+
+
+def print_record(fp, metadata, body):
+    """Prints a record from a binary audit log in the text format."""
+
+    if metadata['type'] == 'request':
+        print_request(fp, metadata['id'], metadata['time'], metadata['pid'],
+                metadata['url'], metadata['params'], metadata['headers'],
+                decode_body(metadata, body))
+    else:
+        print_response(fp, metadata['id'], metadata['time'],
+                metadata['pid'], metadata.get('status'),
+                metadata.get('headers') or {}, body,
+                metadata.get('exception'))
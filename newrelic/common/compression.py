@@ -0,0 +1,201 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the selection of how the payloads sent to the data
+collector are compressed.
+
+Where a compression level has not been configured, the level used for each
+endpoint is adapted to the time taken to compress the payloads previously
+sent to it. If compressing a payload of the size typically sent to the
+endpoint is expected to exceed the time budget the level is lowered, and
+once comfortably within the budget it is raised again, up to the default.
+
+Deflate compressed payloads can optionally be primed with a dictionary of
+the keys and values common to agent payloads. The data collector can only
+decompress such payloads if it holds the same dictionary, so this must be
+enabled explicitly.
+
+"""
+
+import threading
+import zlib
+
+MIN_LEVEL = 1
+DEFAULT_LEVEL = 6
+
+# Weight given to the most recent payload when tracking the typical size
+# of the payloads sent to an endpoint and the time taken per byte.
+
+_SMOOTHING = 0.3
+
+# Strings common to the event and metric payloads sent to the data
+# collector. Deflate finds matches nearer the end of the dictionary more
+# cheaply, so the most frequently occurring strings are placed last.
+
+PAYLOAD_DICTIONARY = "".join(
+    (
+        '"request.headers.contentLength":',
+        '"request.headers.contentType":"',
+        '"response.headers.contentLength":',
+        '"response.headers.contentType":"',
+        '"request.headers.host":"',
+        '"request.method":"',
+        '"response.status":"',
+        '"host.displayName":"',
+        '"parent.transportDuration":',
+        '"parent.transportType":"HTTP"',
+        '"parent.account":"',
+        '"parent.app":"',
+        '"parent.type":"App"',
+        '"trustedParentId":"',
+        '"tracingVendors":"',
+        '"error.class":"',
+        '"error.message":"',
+        '"error.expected":false',
+        '"type":"TransactionError"',
+        '"type":"Transaction"',
+        '"apdexPerfZone":"',
+        '"nr.apdexPerfZone":"',
+        '"queueDuration":',
+        '"externalCallCount":',
+        '"externalDuration":',
+        '"databaseCallCount":',
+        '"databaseDuration":',
+        '"totalTime":',
+        '"error":false',
+        '"nr.entryPoint":true',
+        '"transaction.name":"',
+        '"db.statement":"',
+        '"db.instance":"',
+        '"db.collection":"',
+        '"peer.address":"',
+        '"peer.hostname":"',
+        '"http.url":"',
+        '"http.method":"',
+        '"http.statusCode":',
+        '"span.kind":"client"',
+        '"component":"',
+        '"category":"datastore"',
+        '"category":"http"',
+        '"category":"generic"',
+        '"type":"Span"',
+        '"transactionId":"',
+        '"parentId":"',
+        '"traceId":"',
+        '"sampled":true',
+        '"priority":',
+        '"timestamp":',
+        '"duration":',
+        '"guid":"',
+        '"name":"',
+        '"Supportability/Python/',
+        '"Datastore/',
+        '"External/',
+        '"Python/',
+        '"OtherTransaction/Function/',
+        '"WebTransaction/Function/',
+        '"Function/',
+        '"scope":""',
+        '{"name":"',
+    )
+).encode("ascii")
+
+# The zdict argument to zlib.compressobj() is not supported by Python 2.
+
+try:
+    zlib.compressobj(DEFAULT_LEVEL, zlib.DEFLATED, 15, zlib.DEF_MEM_LEVEL,
+            zlib.Z_DEFAULT_STRATEGY, b"")
+except TypeError:
+    ZDICT_SUPPORTED = False
+else:
+    ZDICT_SUPPORTED = True
+
+
+class PayloadCompressor(object):
+
+    def __init__(self, method="gzip", level=None, dictionary=None,
+            time_budget=None):
+        self.method = method
+
+        # A gzip stream cannot be primed with a dictionary.
+
+        if method == "gzip" or not ZDICT_SUPPORTED:
+            dictionary = None
+
+        self.dictionary = dictionary
+
+        self._level = level
+        self._time_budget = time_budget
+
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def level(self, endpoint=None):
+        """Returns the compression level to use for a payload being sent
+        to the endpoint.
+
+        """
+
+        if self._level is not None:
+            return self._level
+
+        state = self._endpoints.get(endpoint)
+
+        return state and state[0] or DEFAULT_LEVEL
+
+    def compressobj(self, level):
+        wbits = 31 if self.method == "gzip" else 15
+
+        if self.dictionary:
+            return zlib.compressobj(level, zlib.DEFLATED, wbits,
+                    zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY,
+                    self.dictionary)
+
+        return zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def record(self, endpoint, level, size, compression_time):
+        """Records the time taken to compress a payload of the given size
+        for the endpoint, adjusting the level used for the endpoint where
+        the level is adaptive.
+
+        """
+
+        if self._level is not None or not self._time_budget or not size:
+            return
+
+        with self._lock:
+            state = self._endpoints.get(endpoint)
+
+            if state is None or state[0] != level or state[2] is None:
+                # The time per byte measured at another level does not
+                # apply at this level, so start the measurement afresh.
+
+                typical_size = state and state[1] or size
+                time_per_byte = compression_time / size
+            else:
+                _, typical_size, time_per_byte = state
+                typical_size += _SMOOTHING * (size - typical_size)
+                time_per_byte += _SMOOTHING * (
+                        compression_time / size - time_per_byte)
+
+            expected_time = typical_size * time_per_byte
+
+            if expected_time > self._time_budget and level > MIN_LEVEL:
+                self._endpoints[endpoint] = (level - 1, typical_size, None)
+            elif expected_time * 4 < self._time_budget and (
+                    level < DEFAULT_LEVEL):
+                self._endpoints[endpoint] = (level + 1, typical_size, None)
+            else:
+                self._endpoints[endpoint] = (level, typical_size,
+                        time_per_byte)
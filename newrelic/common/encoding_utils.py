@@ -41,6 +41,16 @@ PARENT_TYPE = {
 BASE64_DECODE_STR = getattr(base64, 'decodestring', None)
 
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 # Functions for encoding/decoding JSON. These wrappers are used in order
 # to hide the differences between Python 2 and Python 3 implementations
 # of the json module functions as well as instigate some better defaults
@@ -48,6 +58,16 @@ BASE64_DECODE_STR = getattr(base64, 'decodestring', None)
 # be supplied as key word arguments to allow the wrappers to supply
 # defaults.
 
+def _json_default(o):
+    if isinstance(o, bytes):
+        return o.decode('latin-1')
+    elif isinstance(o, types.GeneratorType):
+        return list(o)
+    elif hasattr(o, '__iter__'):
+        return list(iter(o))
+    raise TypeError(repr(o) + ' is not JSON serializable')
+
+
 def json_encode(obj, **kwargs):
     _kwargs = {}
 
@@ -82,16 +102,7 @@ def json_encode(obj, **kwargs):
     if type(b'') is type(''):  # NOQA
         _kwargs['encoding'] = 'latin-1'
 
-    def _encode(o):
-        if isinstance(o, bytes):
-            return o.decode('latin-1')
-        elif isinstance(o, types.GeneratorType):
-            return list(o)
-        elif hasattr(o, '__iter__'):
-            return list(iter(o))
-        raise TypeError(repr(o) + ' is not JSON serializable')
-
-    _kwargs['default'] = _encode
+    _kwargs['default'] = _json_default
 
     _kwargs['separators'] = (',', ':')
 
@@ -105,6 +116,131 @@ def json_encode(obj, **kwargs):
     return json.dumps(obj, **_kwargs)
 
 
+# Encoders for the payloads sent to the data collector. Each encodes an
+# object as JSON in the same way as json_encode(), but returns the JSON as
+# UTF-8 encoded bytes. Where a faster JSON library is installed it can be
+# used instead of the json module, with any object which that library is
+# unable to encode in the same way being passed back to the json module.
+
+
+def _json_encoder(obj):
+    return json_encode(obj).encode('utf-8')
+
+
+def _remembering_json_default():
+    # Returns a fallback encoder which remembers the result for each object
+    # it expands. If a faster library fails part way through encoding an
+    # object, the json module is then given the same expanded values, as
+    # any generators will already have been consumed.
+
+    expanded = {}
+
+    def _default(o):
+        key = id(o)
+        if key not in expanded:
+            expanded[key] = _json_default(o)
+        return expanded[key]
+
+    return _default
+
+
+def _orjson_encoder(obj):
+    default = _remembering_json_default()
+
+    try:
+        return orjson.dumps(obj, default=default,
+                option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # Raised for values such as integers larger than 64 bits.
+        return json_encode(obj, default=default).encode('utf-8')
+
+
+def _ujson_encoder(obj):
+    default = _remembering_json_default()
+
+    try:
+        return ujson.dumps(obj, default=default, ensure_ascii=False,
+                escape_forward_slashes=False).encode('utf-8')
+    except (TypeError, ValueError, OverflowError):
+        # The ujson module rejects byte strings rather than passing them
+        # to the fallback encoder so they can be decoded as Latin-1.
+        return json_encode(obj, default=default).encode('utf-8')
+
+
+JSON_ENCODERS = OrderedDict()
+
+if orjson is not None:
+    JSON_ENCODERS['orjson'] = _orjson_encoder
+
+if ujson is not None:
+    try:
+        # Only versions of ujson which accept a fallback encoder, needed
+        # to expand generators and iterables, can be used.
+        ujson.dumps((), default=_json_default)
+    except TypeError:
+        pass
+    else:
+        JSON_ENCODERS['ujson'] = _ujson_encoder
+
+JSON_ENCODERS['json'] = _json_encoder
+
+
+def json_encoder(backend='auto'):
+    """Returns a function which encodes an object as JSON in the same way
+    as json_encode(), but returning UTF-8 encoded bytes. The backend names
+    the JSON library to use, being one of 'orjson', 'ujson' or 'json'. If
+    'auto', the fastest which is installed is used. The json module is
+    used if the named library is not installed.
+
+    """
+
+    if backend == 'auto':
+        return next(iter(JSON_ENCODERS.values()))
+
+    return JSON_ENCODERS.get(backend, _json_encoder)
+
+
+def _json_expandable(obj):
+    # Whether the object would be encoded as a JSON array, either natively
+    # or through being expanded by the fallback encoder of json_encode().
+
+    if isinstance(obj, (list, tuple, types.GeneratorType)):
+        return True
+
+    return hasattr(obj, '__iter__') and not isinstance(obj,
+            (dict, bytes, six.text_type, six.string_types))
+
+
+def json_encode_chunks(obj, depth=2, encoder=_json_encoder):
+    """Encodes the object as JSON using an encoder returned by
+    json_encoder(), but returns an iterator over the encoded bytes in
+    chunks rather than as a single byte string. Lists and other
+    iterables, down to the given depth of nesting, are expanded an
+    element at a time, with the elements below that depth each being
+    encoded as a single chunk.
+
+    """
+
+    if depth <= 0 or not _json_expandable(obj):
+        yield encoder(obj)
+        return
+
+    yield b'['
+
+    separator = b''
+
+    for item in obj:
+        if separator:
+            yield separator
+        else:
+            separator = b','
+
+        for chunk in json_encode_chunks(item, depth - 1, encoder):
+            yield chunk
+
+    yield b']'
+
+
 def json_decode(s, **kwargs):
     # Nothing special to do here at this point but use a wrapper to be
     # consistent with encoding and allow for changes later.
@@ -49,6 +49,35 @@ except AttributeError:
         default_timer = timeit.default_timer
         timer_implementation = 'timeit.default_timer()'
 
+try:
+    # Python 3.7 and later provides the performance counter as an integer
+    # number of nanoseconds, avoiding the loss of precision of a float.
+
+    default_timer_ns = time.perf_counter_ns
+
+except AttributeError:
+    def default_timer_ns():
+        return int(default_timer() * 1e9)
+
+
+class ClockAnchor(object):
+
+    """Relates readings of the default timer to wall clock time, using a
+    single reading of the wall clock taken when created. Wall clock times
+    derived from it are not affected by any adjustments made to the system
+    clock afterwards, so always increase with the readings of the timer.
+
+    """
+
+    __slots__ = ('time', 'counter_ns')
+
+    def __init__(self):
+        self.time = time.time()
+        self.counter_ns = default_timer_ns()
+
+    def wall_time(self, counter_ns):
+        return self.time + (counter_ns - self.counter_ns) / 1e9
+
 # A timer class which deals with remembering the start time based on
 # wall clock time and duration based on a monotonic clock where
 # available.
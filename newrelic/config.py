@@ -343,6 +343,8 @@ def _process_configuration(section):
     _process_setting(
         section, "compressed_content_encoding", "get", _map_compressed_content_encoding
     )
+    _process_setting(section, "collector_json_backend", "get", None)
+    _process_setting(section, "metric_data_format", "get", None)
     _process_setting(section, "attributes.enabled", "getboolean", None)
     _process_setting(section, "attributes.exclude", "get", _map_inc_excl_attributes)
     _process_setting(section, "attributes.include", "get", _map_inc_excl_attributes)
@@ -483,6 +485,7 @@ def _process_configuration(section):
         "get",
         _map_inc_excl_attributes,
     )
+    _process_setting(section, "transaction_segments.unsampled_metrics_only", "getboolean", None)
     _process_setting(section, "local_daemon.socket_path", "get", None)
     _process_setting(section, "local_daemon.synchronous_startup", "getboolean", None)
     _process_setting(section, "agent_limits.transaction_traces_nodes", "getint", None)
@@ -495,7 +498,9 @@ def _process_configuration(section):
     )
     _process_setting(section, "agent_limits.slow_sql_data", "getint", None)
     _process_setting(section, "agent_limits.merge_stats_maximum", "getint", None)
+    _process_setting(section, "agent_limits.max_metric_names", "getint", None)
     _process_setting(section, "agent_limits.errors_per_transaction", "getint", None)
+    _process_setting(section, "agent_limits.segments_per_transaction", "getint", None)
     _process_setting(section, "agent_limits.errors_per_harvest", "getint", None)
     _process_setting(
         section, "agent_limits.slow_transaction_dry_harvests", "getint", None
@@ -505,6 +510,8 @@ def _process_configuration(section):
     _process_setting(section, "agent_limits.synthetics_transactions", "getint", None)
     _process_setting(section, "agent_limits.data_compression_threshold", "getint", None)
     _process_setting(section, "agent_limits.data_compression_level", "getint", None)
+    _process_setting(section, "agent_limits.data_compression_time_budget", "getfloat", None)
+    _process_setting(section, "agent_limits.data_compression_dictionary", "getboolean", None)
     _process_setting(
         section, "console.listener_socket", "get", _map_console_listener_socket
     )
@@ -593,6 +600,26 @@ def _process_configuration(section):
     _process_setting(section, "infinite_tracing.trace_observer_host", "get", None)
     _process_setting(section, "infinite_tracing.trace_observer_port", "getint", None)
     _process_setting(section, "infinite_tracing.span_queue_size", "getint", None)
+    _process_setting(section, "transaction_recorder.thread_local_stats", "getboolean", None)
+    _process_setting(section, "transaction_recorder.asynchronous", "getboolean", None)
+    _process_setting(section, "transaction_recorder.queue_size", "getint", None)
+    _process_setting(section, "transaction_recorder.overflow_policy", "get", None)
+    _process_setting(section, "transaction_recorder.flush_timeout", "getfloat", None)
+    _process_setting(section, "harvest_executor.max_workers", "getint", None)
+    _process_setting(section, "harvest_executor.max_upload_workers", "getint", None)
+    _process_setting(section, "harvest_spool.directory", "get", None)
+    _process_setting(section, "harvest_spool.max_bytes", "getint", None)
+    _process_setting(section, "harvest_spool.max_age", "getfloat", None)
+    _process_setting(section, "connection_pool.enabled", "getboolean", None)
+    _process_setting(section, "connection_pool.max_idle_time", "getfloat", None)
+    _process_setting(section, "adaptive_harvest.enabled", "getboolean", None)
+    _process_setting(section, "adaptive_harvest.min_period", "getfloat", None)
+    _process_setting(section, "adaptive_harvest.max_period", "getfloat", None)
+    _process_setting(section, "audit_log.asynchronous", "getboolean", None)
+    _process_setting(section, "audit_log.max_bytes", "getint", None)
+    _process_setting(section, "audit_log.backup_count", "getint", None)
+    _process_setting(section, "audit_log.queue_size", "getint", None)
+    _process_setting(section, "trace_cache.backend", "get", None)
 
 
 # Loading of configuration from specified file and for specified
@@ -3104,6 +3131,7 @@ def initialize(
 
     if _settings.monitor_mode or _settings.developer_mode:
         _settings.enabled = True
+        trace_cache.configure_trace_cache(_settings.trace_cache.backend)
         _setup_instrumentation()
         _setup_data_source()
         _setup_extensions()
@@ -58,7 +58,6 @@ from newrelic.api.transaction import Transaction
 from newrelic.api.object_wrapper import ObjectWrapper
 from newrelic.core.trace_cache import trace_cache
 
-_trace_cache = trace_cache()
 
 def shell_command(wrapped):
     args, varargs, keywords, defaults = _argspec(wrapped)
@@ -365,7 +364,7 @@ class ConsoleShell(cmd.Cmd):
         """
         """
 
-        for item in _trace_cache.active_threads():
+        for item in trace_cache().active_threads():
             transaction, thread_id, thread_type, frame = item
             print('THREAD', item, file=self.stdout)
             if transaction is not None:
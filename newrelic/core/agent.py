@@ -34,6 +34,10 @@ import newrelic.core.application
 import newrelic.packages.six as six
 
 from newrelic.common.log_file import initialize_logging
+from newrelic.core.harvest_executor import HarvestExecutor
+from newrelic.core.harvest_schedule import HarvestSchedule
+from newrelic.core.internal_metrics import InternalTraceContext
+from newrelic.core.stats_engine import CustomMetrics, EVENT_HARVEST_METHODS
 from newrelic.samplers.cpu_usage import cpu_usage_data_source
 from newrelic.samplers.memory_usage import memory_usage_data_source
 from newrelic.samplers.gc_data import garbage_collector_data_source
@@ -220,6 +224,9 @@ class Agent(object):
         self._scheduler = sched.scheduler(
                 self._harvest_timer,
                 self._harvest_shutdown.wait)
+        self._harvest_executor = HarvestExecutor('Agent',
+                config.harvest_executor.max_workers)
+        self._harvest_schedules = {}
 
         self._process_shutdown = False
 
@@ -272,6 +279,10 @@ class Agent(object):
                 self._default_harvest_duration), file=file)
         print('Flexible Harvest Duration: %.2f' % (
                 self._flexible_harvest_duration), file=file)
+        if self._harvest_schedules:
+            print('Flexible Harvest Periods: %r' % dict(
+                    (data_type, schedule.period) for data_type, schedule in
+                    self._harvest_schedules.items()), file=file)
         print('Agent Shutdown: %s' % (
                 self._harvest_shutdown.isSet()), file=file)
         print('Applications: %r' % (
@@ -575,6 +586,31 @@ class Agent(object):
         application = self._applications.get(app_name, None)
         return application.compute_sampled()
 
+    def _harvest_applications(self, shutdown, flexible, data_types=None):
+        """Harvests each of the applications, using the harvest executor
+        to run the harvests for separate applications concurrently. This
+        only returns once the harvest for every application has completed,
+        returning the observations made by each of the harvests.
+
+        """
+
+        queued = time.time()
+        results = []
+
+        def _harvest(application):
+            try:
+                results.append(application.harvest(shutdown,
+                        flexible=flexible, queue_time=time.time() - queued,
+                        data_types=data_types))
+            except Exception:
+                _logger.exception('Failed to harvest data '
+                                  'for %s.' % application.name)
+
+        self._harvest_executor.run(_harvest,
+                list(six.itervalues(self._applications)))
+
+        return results
+
     def _harvest_flexible(self, shutdown=False):
         if not self._harvest_shutdown.isSet():
             event_harvest_config = self.global_settings().event_harvest_config
@@ -593,12 +629,7 @@ class Agent(object):
         self._flexible_harvest_count += 1
         self._last_flexible_harvest = time.time()
 
-        for application in list(six.itervalues(self._applications)):
-            try:
-                application.harvest(shutdown=False, flexible=True)
-            except Exception:
-                _logger.exception('Failed to harvest data '
-                                  'for %s.' % application.name)
+        self._harvest_applications(shutdown=False, flexible=True)
 
         self._flexible_harvest_duration = \
                 time.time() - self._last_flexible_harvest
@@ -606,6 +637,45 @@ class Agent(object):
         _logger.debug('Completed harvest[flexible] of application data in %.2f '
                 'seconds.', self._flexible_harvest_duration)
 
+    def _harvest_adaptive(self, data_type):
+        # The final harvest on shutdown is a flexible harvest of all the
+        # data types, so there is nothing to do here once shutting down.
+
+        if self._harvest_shutdown.isSet():
+            return
+
+        _logger.debug('Commencing harvest[flexible] of %s application '
+                'data.', data_type)
+
+        self._flexible_harvest_count += 1
+        self._last_flexible_harvest = time.time()
+
+        results = self._harvest_applications(shutdown=False, flexible=True,
+                data_types=(data_type,))
+
+        self._flexible_harvest_duration = \
+                time.time() - self._last_flexible_harvest
+
+        _logger.debug('Completed harvest[flexible] of %s application data '
+                'in %.2f seconds.', data_type, self._flexible_harvest_duration)
+
+        schedule = self._harvest_schedules[data_type]
+        observations = [result[data_type] for result in results
+                if result and data_type in result]
+
+        internal_metrics = CustomMetrics()
+
+        with InternalTraceContext(internal_metrics):
+            period = schedule.observe(observations)
+
+        metrics = list(internal_metrics.metrics())
+
+        for application in list(six.itervalues(self._applications)):
+            application.set_harvest_scale(data_type, schedule, metrics)
+
+        self._scheduler.enter(period, 1, self._harvest_adaptive,
+                (data_type,))
+
     def _harvest_default(self, shutdown=False):
         if not self._harvest_shutdown.isSet():
             self._scheduler.enter(60.0, 2, self._harvest_default, ())
@@ -618,12 +688,7 @@ class Agent(object):
         self._default_harvest_count += 1
         self._last_default_harvest = time.time()
 
-        for application in list(six.itervalues(self._applications)):
-            try:
-                application.harvest(shutdown, flexible=False)
-            except Exception:
-                _logger.exception('Failed to harvest data '
-                                  'for %s.' % application.name)
+        self._harvest_applications(shutdown, flexible=False)
 
         self._default_harvest_duration = \
                 time.time() - self._last_default_harvest
@@ -641,12 +706,29 @@ class Agent(object):
 
         settings = newrelic.core.config.global_settings()
         event_harvest_config = settings.event_harvest_config
-
-        self._scheduler.enter(
-                event_harvest_config.report_period_ms / 1000.0,
-                1,
-                self._harvest_flexible,
-                ())
+        report_period = event_harvest_config.report_period_ms / 1000.0
+
+        if settings.adaptive_harvest.enabled:
+            # Each of the event data types is harvested on its own period,
+            # which adapts to how quickly events of that type arrive.
+
+            for data_type in EVENT_HARVEST_METHODS:
+                schedule = HarvestSchedule(data_type, report_period,
+                        settings.adaptive_harvest.min_period,
+                        settings.adaptive_harvest.max_period)
+                self._harvest_schedules[data_type] = schedule
+
+                self._scheduler.enter(
+                        schedule.period,
+                        1,
+                        self._harvest_adaptive,
+                        (data_type,))
+        else:
+            self._scheduler.enter(
+                    report_period,
+                    1,
+                    self._harvest_flexible,
+                    ())
         self._scheduler.enter(
                 60.0,
                 2,
@@ -676,6 +758,12 @@ class Agent(object):
                         'loop. Please report this problem to New Relic '
                         'support for further investigation.')
 
+        finally:
+            # The worker threads for concurrent harvests are stopped even
+            # where the harvest loop exited due to an unexpected error.
+
+            self._harvest_executor.shutdown()
+
     def activate_agent(self):
         """Starts the main background for the agent."""
         with Agent._instance_lock:
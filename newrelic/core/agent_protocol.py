@@ -17,11 +17,20 @@ import os
 
 from newrelic import version
 from newrelic.common import system_info
-from newrelic.common.agent_http import ApplicationModeClient, ServerlessModeClient
+from newrelic.common.agent_http import (
+    COLLECTOR_CONNECTION_POOLS,
+    ApplicationModeClient,
+    CompressedPayload,
+    ServerlessModeClient,
+)
+from newrelic.common.audit_log import audit_log_writer
+from newrelic.common.compression import PAYLOAD_DICTIONARY
 from newrelic.core.internal_metrics import internal_count_metric
 from newrelic.common.encoding_utils import (
     json_decode,
     json_encode,
+    json_encode_chunks,
+    json_encoder,
     serverless_payload_encode,
 )
 from newrelic.common.utilization import (
@@ -43,6 +52,7 @@ from newrelic.network.exceptions import (
     ForceAgentDisconnect,
     ForceAgentRestart,
     NetworkInterfaceException,
+    PayloadTooLarge,
     RetryDataForRequest,
 )
 
@@ -63,7 +73,7 @@ class AgentProtocol(object):
         409: ForceAgentRestart,
         410: ForceAgentDisconnect,
         411: DiscardDataForRequest,
-        413: DiscardDataForRequest,
+        413: PayloadTooLarge,
         414: DiscardDataForRequest,
         415: DiscardDataForRequest,
         417: DiscardDataForRequest,
@@ -155,7 +165,14 @@ class AgentProtocol(object):
     }
 
     def __init__(self, settings, host=None, client_cls=ApplicationModeClient):
-        if settings.audit_log_file:
+        if settings.audit_log_file and settings.audit_log.asynchronous:
+            audit_log_fp = audit_log_writer(
+                settings.audit_log_file,
+                max_bytes=settings.audit_log.max_bytes,
+                backup_count=settings.audit_log.backup_count,
+                queue_size=settings.audit_log.queue_size,
+            )
+        elif settings.audit_log_file:
             audit_log_fp = open(settings.audit_log_file, "a")
         else:
             audit_log_fp = None
@@ -176,6 +193,17 @@ class AgentProtocol(object):
             compression_method=settings.compressed_content_encoding,
             max_payload_size_in_bytes=settings.max_payload_size_in_bytes,
             audit_log_fp=audit_log_fp,
+            max_connections=settings.harvest_executor.max_upload_workers,
+            compression_dictionary=(
+                PAYLOAD_DICTIONARY
+                if settings.agent_limits.data_compression_dictionary
+                else None
+            ),
+            compression_time_budget=settings.agent_limits.data_compression_time_budget,
+            connection_pools=(
+                COLLECTOR_CONNECTION_POOLS if settings.connection_pool.enabled else None
+            ),
+            connection_max_idle_time=settings.connection_pool.max_idle_time,
         )
 
         self._params = {
@@ -198,6 +226,8 @@ class AgentProtocol(object):
         self._headers["Content-Type"] = "application/json"
         self._run_token = settings.agent_run_id
 
+        self._json_encoder = json_encoder(settings.collector_json_backend)
+
         # Logging
         self._proxy_host = settings.proxy_host
         self._proxy_port = settings.proxy_port
@@ -217,7 +247,8 @@ class AgentProtocol(object):
         self.client.close_connection()
 
     def send(self, method, payload=()):
-        params, headers, payload = self._to_http(method, payload)
+        chunk_sizes = []
+        params, headers, payload = self._to_http(method, payload, chunk_sizes)
 
         try:
             response = self.client.send_request(
@@ -230,6 +261,10 @@ class AgentProtocol(object):
         status, data = response
 
         if not 200 <= status < 300:
+            content = payload
+            if isinstance(content, CompressedPayload):
+                content = content.decompress()
+
             if status == 413:
                 internal_count_metric(
                     "Supportability/Python/Collector/MaxPayloadSizeLimit/%s" % method,
@@ -249,21 +284,39 @@ class AgentProtocol(object):
                     "params": {
                         k: v for k, v in params.items() if k in self.PARAMS_ALLOWLIST
                     },
-                    "content": payload,
+                    "content": content,
                     "agent_run_id": self._run_token,
                 },
             )
             exception = self.STATUS_CODE_RESPONSE.get(status, DiscardDataForRequest)
+            if status == 413:
+                # The size of the rejected payload, and the encoded size
+                # of each chunk of it, are used to work out how to split
+                # the data into payloads which will fit.
+                raise exception(len(payload), chunk_sizes)
+            if issubclass(exception, RetryDataForRequest):
+                raise exception(retry_after=self.client.retry_after())
             raise exception
         if status == 200:
             return json_decode(data.decode("utf-8"))["return_value"]
 
-    def _to_http(self, method, payload=()):
+    def _to_http(self, method, payload=(), chunk_sizes=None):
         params = dict(self._params)
         params["method"] = method
         if self._run_token:
             params["run_id"] = self._run_token
-        return params, self._headers, json_encode(payload).encode("utf-8")
+
+        # The payload is encoded in chunks which the client can compress
+        # as they are produced, rather than building the whole encoded
+        # payload in memory before compressing it.
+
+        payload = self.client.prepare_payload(
+            json_encode_chunks(payload, encoder=self._json_encoder),
+            endpoint=method,
+            chunk_sizes=chunk_sizes,
+        )
+
+        return params, self._headers, payload
 
     @staticmethod
     def _connect_payload(app_name, linked_applications, environment, settings):
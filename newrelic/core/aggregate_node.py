@@ -0,0 +1,69 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.metric import TimeStatsMetric
+from newrelic.core.stats_engine import TimeStats
+
+
+class AggregateNode(object):
+    """Stands in for all the terminal traces of the same name under the
+    same parent which were completed once the segment budget of the
+    transaction was exceeded. The node of the first of these traces is
+    kept, with the remainder only being accumulated into the call count
+    and timings, so the metrics reported are the same as if each had its
+    own node.
+
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.stats = TimeStats()
+        self.stats.merge_raw_time_metric(node.duration, node.exclusive)
+
+    def __getattr__(self, name):
+        return getattr(self.node, name)
+
+    @property
+    def call_count(self):
+        return int(self.stats.call_count)
+
+    def merge_trace(self, trace):
+        self.stats.merge_raw_time_metric(trace.duration, trace.exclusive)
+
+    def time_metrics(self, stats, root, parent):
+        for metric in self.node.time_metrics(stats, root, parent):
+            yield TimeStatsMetric(name=metric.name, scope=metric.scope,
+                    stats=self.stats)
+
+    def trace_node(self, stats, root, connections):
+        trace_node = self.node.trace_node(stats, root, connections)
+
+        trace_node.params['aggregate_count'] = self.call_count
+        trace_node.params['aggregate_duration_millis'] = (
+                1000.0 * self.stats.total_call_time)
+
+        return trace_node
+
+    def span_events(self, settings, base_attrs=None, parent_guid=None,
+            attr_class=dict):
+        for i_attrs, u_attrs, a_attrs in self.node.span_events(settings,
+                base_attrs=base_attrs, parent_guid=parent_guid,
+                attr_class=attr_class):
+            i_attrs['duration'] = self.stats.total_call_time
+            i_attrs['nr.aggregateCount'] = self.call_count
+
+            yield [i_attrs, u_attrs, a_attrs]
+
+    def span_event_count(self):
+        return self.node.span_event_count()
@@ -24,7 +24,9 @@ import time
 import os
 import traceback
 import imp
+import weakref
 
+from collections import namedtuple
 from functools import partial
 
 from newrelic.samplers.data_sampler import DataSampler
@@ -37,6 +39,11 @@ from newrelic.network.exceptions import (ForceAgentRestart,
 from newrelic.core.environment import environment_settings
 from newrelic.core.rules_engine import RulesEngine, SegmentCollapseEngine
 from newrelic.core.stats_engine import StatsEngine, CustomMetrics
+from newrelic.core.transaction_recorder import TransactionRecorder
+from newrelic.core.reconnect import ReconnectScheduler, retry_budget
+from newrelic.core.harvest_executor import HarvestExecutor
+from newrelic.core.harvest_spool import (HarvestSpool, HarvestSpoolDrop,
+        HarvestSpoolRetry, spool_path)
 from newrelic.core.internal_metrics import (InternalTrace,
         InternalTraceContext, internal_metric, internal_count_metric)
 from newrelic.core.profile_sessions import profile_session_manager
@@ -47,6 +54,74 @@ from newrelic.core.adaptive_sampler import AdaptiveSampler
 
 _logger = logging.getLogger(__name__)
 
+# A payload prepared during a harvest. The send callable posts the payload
+# to the data collector. The reset callable discards the data from the
+# harvest snapshot once it is no longer needed, being when the upload was
+# either accepted or rejected outright. The sent callable is only called
+# when the upload was accepted. The spool item is the method name and the
+# payload, less the agent run ID, which is written to the harvest spool if
+# the upload fails with a recoverable error, or None if the data is instead
+# rolled back into the next harvest or thrown away. For event data sent in
+# batches, the retain callable discards the events of any batches accepted
+# before a batch failed with a recoverable error from the harvest snapshot,
+# so they are not sent again.
+
+_HarvestUpload = namedtuple('_HarvestUpload',
+        ['name', 'send', 'reset', 'sent', 'spool', 'retain'])
+_HarvestUpload.__new__.__defaults__ = (None,)
+
+# Precedence of the exceptions raised by uploads sent concurrently. Only
+# the exception with the highest precedence is raised from the harvest.
+
+_HARVEST_UPLOAD_EXCEPTIONS = (ForceAgentRestart, ForceAgentDisconnect,
+        RetryDataForRequest, DiscardDataForRequest, Exception)
+
+
+def _harvest_upload_precedence(exc):
+    for index, exc_type in enumerate(_HARVEST_UPLOAD_EXCEPTIONS):
+        if isinstance(exc, exc_type):
+            return index
+
+
+class StatsEngineShard(object):
+
+    """Holds a stats engine into which the transactions for a single
+    thread are recorded. The lock is only ever contended when the shard
+    is being harvested.
+
+    """
+
+    def __init__(self, stats_engine):
+        self.lock = threading.Lock()
+        self.settings = stats_engine.settings
+        self.thread = weakref.ref(threading.current_thread())
+        self.stats_engine = stats_engine.create_workarea()
+        self.transaction_count = 0
+        self.last_transaction = 0.0
+
+    @property
+    def active(self):
+        thread = self.thread()
+        return thread is not None and thread.is_alive()
+
+    def harvest(self):
+        """Swaps out the accumulated stats engine for an empty one,
+        returning the stats engine along with the count of transactions
+        recorded and the end time of the last transaction.
+
+        """
+
+        with self.lock:
+            stats_engine = self.stats_engine
+            transaction_count = self.transaction_count
+            last_transaction = self.last_transaction
+
+            self.stats_engine = stats_engine.create_workarea()
+            self.transaction_count = 0
+            self.last_transaction = 0.0
+
+        return stats_engine, transaction_count, last_transaction
+
 
 class Application(object):
 
@@ -96,6 +171,16 @@ class Application(object):
         self._stats_custom_lock = threading.RLock()
         self._stats_custom_engine = StatsEngine()
 
+        self._stats_shards_lock = threading.Lock()
+        self._stats_shards = []
+        self._stats_shard_local = threading.local()
+
+        self._transaction_recorder_lock = threading.Lock()
+        self._transaction_recorder = None
+
+        self._upload_executor = None
+        self._harvest_spool = None
+
         self._agent_commands_lock = threading.Lock()
         self._data_samplers_lock = threading.Lock()
         self._data_samplers_started = False
@@ -322,15 +407,15 @@ class Application(object):
         # Register the application with the data collector. Any errors
         # that occur will be dealt with by create_session(). The result
         # will either be a session object or None. In the event of a
-        # failure to register we will try again, gradually backing off
-        # for longer and longer periods as we retry. The retry interval
-        # will be capped at 300 seconds.
+        # failure to register we will try again, backing off for longer
+        # and longer jittered periods as we retry, drawing the retries
+        # from a budget shared by all applications in the process. The
+        # retry interval will be capped at 300 seconds, unless the data
+        # collector asks that the agent wait for longer.
 
         active_session = None
 
-        retries = [(15, False, False), (15, False, False),
-                   (30, False, False), (60, True, False),
-                   (120, False, False), (300, False, True), ]
+        scheduler = ReconnectScheduler(retry_budget)
 
         connect_attempts = 0
         settings = global_settings()
@@ -343,6 +428,7 @@ class Application(object):
                 return
 
             connect_attempts += 1
+            retry_after = None
 
             internal_metrics = CustomMetrics()
 
@@ -359,8 +445,9 @@ class Application(object):
                             'must be manually restarted in order to connect to New '
                             'Relic.')
                     return
-                except NetworkInterfaceException:
+                except NetworkInterfaceException as e:
                     active_session = None
+                    retry_after = getattr(e, 'retry_after', None)
                 except Exception:
                     # If an exception occurs after agent has been flagged to be
                     # shutdown then we ignore the error. This is because all
@@ -434,29 +521,25 @@ class Application(object):
             # per schedule associated with the retry intervals.
 
             if not active_session:
-                if retries:
-                    timeout, warning, error = retries.pop(0)
-
-                    if warning:
-                        _logger.warning('Registration of the application '
-                                '%r with the data collector failed after '
-                                'multiple attempts. Check the prior log '
-                                'entries and remedy any issue as '
-                                'necessary, or if the problem persists, '
-                                'report this problem to New Relic '
-                                'support for further investigation.',
-                                self._app_name)
-
-                    elif error:
-                        _logger.error('Registration of the application '
-                                '%r with the data collector failed after '
-                                'further additional attempts. Please '
-                                'report this problem to New Relic support '
-                                'for further investigation.',
-                                self._app_name)
+                timeout = scheduler.next_delay(retry_after)
+
+                if connect_attempts == 4:
+                    _logger.warning('Registration of the application '
+                            '%r with the data collector failed after '
+                            'multiple attempts. Check the prior log '
+                            'entries and remedy any issue as '
+                            'necessary, or if the problem persists, '
+                            'report this problem to New Relic '
+                            'support for further investigation.',
+                            self._app_name)
 
-                else:
-                    timeout = 300
+                elif connect_attempts == 6:
+                    _logger.error('Registration of the application '
+                            '%r with the data collector failed after '
+                            'further additional attempts. Please '
+                            'report this problem to New Relic support '
+                            'for further investigation.',
+                            self._app_name)
 
                 _logger.debug('Retrying registration of the application '
                         '%r with the data collector after a further %d '
@@ -474,6 +557,9 @@ class Application(object):
                     configuration,
                     reset_stream=True)
 
+            with self._stats_shards_lock:
+                self._stats_shards = []
+
             if configuration.serverless_mode.enabled:
                 sampling_target_period = 60.0
             else:
@@ -797,6 +883,41 @@ class Application(object):
     def record_transaction(self, data):
         """Record a single transaction against this application."""
 
+        settings = self._transaction_settings(data)
+
+        if settings is None:
+            return
+
+        # When recording asynchronously, the generation of metrics and
+        # events from the transaction is deferred to the transaction
+        # recorder thread for the application.
+
+        if settings.transaction_recorder.asynchronous:
+            self.transaction_recorder(settings).put(data)
+            return
+
+        self._record_transaction(data, settings)
+
+    def _record_queued_transaction(self, data):
+        """Record a transaction which was queued with the transaction
+        recorder. The settings are checked again as the agent may have
+        been restarted since the transaction was queued.
+
+        """
+
+        settings = self._transaction_settings(data)
+
+        if settings is None:
+            return
+
+        self._record_transaction(data, settings)
+
+    def _transaction_settings(self, data):
+        """Returns the settings to record the transaction against, or
+        None if the transaction should not be recorded.
+
+        """
+
         if not self._active_session:
             return
 
@@ -823,6 +944,83 @@ class Application(object):
 
         self.validate_process()
 
+        return settings
+
+    def transaction_recorder(self, settings):
+        """Returns the transaction recorder for the application, starting
+        a new one if none is running in the current process.
+
+        """
+
+        recorder = self._transaction_recorder
+
+        if recorder is None or not recorder.active:
+            with self._transaction_recorder_lock:
+                recorder = self._transaction_recorder
+
+                if recorder is None or not recorder.active:
+                    recorder = TransactionRecorder(self._app_name,
+                            self._record_queued_transaction,
+                            settings.transaction_recorder.queue_size,
+                            settings.transaction_recorder.overflow_policy)
+
+                    self._transaction_recorder = recorder
+
+        return recorder
+
+    def flush_transaction_recorder(self, timeout=None):
+        """Waits for any transactions queued with the transaction recorder
+        to be recorded, recording metrics for the depth of the queue and
+        the number of transactions dropped since the last flush.
+
+        """
+
+        recorder = self._transaction_recorder
+
+        if recorder is None or not recorder.active:
+            return
+
+        if not recorder.flush(timeout):
+            _logger.debug('Timeout waiting for queued transactions to be '
+                    'recorded for application %r.', self._app_name)
+
+        max_depth, dropped = recorder.stats()
+
+        internal_metric('Supportability/Python/RecordTransaction/'
+                'Queue/Depth', max_depth)
+        internal_count_metric('Supportability/Python/RecordTransaction/'
+                'Queue/Dropped', dropped)
+
+    def _span_event_priority_floor(self, settings, data):
+        """Returns the minimum priority of the span event reservoir the
+        transaction will be merged into, or None if span events for the
+        transaction would not be recorded there in any case.
+
+        """
+
+        if not (data.sampled and settings.distributed_tracing.enabled and
+                settings.span_events.enabled and
+                settings.collect_span_events and
+                not settings.infinite_tracing.enabled):
+            return None
+
+        # The floor is read without holding the lock for the stats engine.
+        # The span events are only merged into the reservoir later, so the
+        # floor can be out of date by then in any case.
+
+        if settings.transaction_recorder.thread_local_stats:
+            stats_engine = self._stats_shard(settings).stats_engine
+        else:
+            stats_engine = self._stats_engine
+
+        return stats_engine.span_event_priority_floor
+
+    def _record_transaction(self, data, settings):
+        """Generates the metrics and events for the transaction and merges
+        them into the stats engine for the application.
+
+        """
+
         internal_metrics = CustomMetrics()
 
         with InternalTraceContext(internal_metrics):
@@ -834,7 +1032,9 @@ class Application(object):
                     # don't unnecessarily lock out another thread.
 
                     stats = self._stats_engine.create_workarea()
-                    stats.record_transaction(data)
+                    stats.record_transaction(data,
+                            span_event_priority_floor=(
+                            self._span_event_priority_floor(settings, data)))
 
                 except Exception:
                     _logger.exception('The generation of transaction data has '
@@ -846,6 +1046,30 @@ class Application(object):
                     if settings.debug.record_transaction_failure:
                         raise
 
+            if settings.transaction_recorder.thread_local_stats:
+                shard = self._stats_shard(settings)
+
+                with shard.lock:
+                    try:
+                        shard.transaction_count += 1
+                        shard.last_transaction = data.end_time
+
+                        shard.stats_engine.merge(stats)
+                        shard.stats_engine.merge_custom_metrics(
+                                internal_metrics.metrics())
+
+                    except Exception:
+                        _logger.exception('The merging of transaction data '
+                                'has failed. This would indicate some sort of '
+                                'internal implementation issue with the '
+                                'agent. Please report this problem to New '
+                                'Relic support for further investigation.')
+
+                        if settings.debug.record_transaction_failure:
+                            raise
+
+                return
+
             with self._stats_lock:
                 try:
                     self._transaction_count += 1
@@ -872,6 +1096,53 @@ class Application(object):
                     if settings.debug.record_transaction_failure:
                         raise
 
+    def _stats_shard(self, settings):
+        """Returns the stats engine shard for the current thread, creating
+        one if this is the first transaction recorded by the thread for
+        the current agent run.
+
+        """
+
+        shard = getattr(self._stats_shard_local, 'shard', None)
+
+        if shard is None or shard.settings is not settings:
+            shard = StatsEngineShard(self._stats_engine)
+
+            with self._stats_shards_lock:
+                self._stats_shards.append(shard)
+
+            self._stats_shard_local.shard = shard
+
+        return shard
+
+    def merge_stats_shards(self):
+        """Merges the data accumulated in the per thread stats engine
+        shards into the main stats engine. Shards for threads which have
+        exited are discarded once their data has been merged.
+
+        """
+
+        start = time.time()
+
+        with self._stats_shards_lock:
+            shards = self._stats_shards
+            self._stats_shards = [shard for shard in shards if shard.active]
+
+        for shard in shards:
+            stats, transaction_count, last_transaction = shard.harvest()
+
+            with self._stats_lock:
+                self._stats_engine.merge_shard(stats)
+
+                self._transaction_count += transaction_count
+                self._last_transaction = max(self._last_transaction,
+                        last_transaction)
+
+        internal_metric('Supportability/Python/RecordTransaction/'
+                'Shards/Count', len(shards))
+        internal_metric('Supportability/Python/RecordTransaction/'
+                'Shards/Merge', time.time() - start)
+
     def cmd_start_profiler(self, command_id=0, **kwargs):
         """Triggered by the start_profiler agent command to start a
         thread profiling session.
@@ -965,14 +1236,209 @@ class Application(object):
 
         return {command_id: {}}
 
-    def harvest(self, shutdown=False, flexible=False):
+    def _send_harvest_uploads(self, uploads, settings, internal_metrics):
+        """Sends the payloads prepared for a harvest to the data collector.
+        When only a single upload worker is configured, uploads are sent
+        one at a time and the first failure aborts the remaining uploads.
+        Otherwise all uploads are sent concurrently and the exception of
+        highest precedence from any failed upload is raised once they have
+        all completed.
+
+        """
+
+        max_workers = settings.harvest_executor.max_upload_workers
+
+        # The text audit log is not safe to write to from multiple threads.
+
+        if (max_workers <= 1 or len(uploads) <= 1 or
+                (settings.audit_log_file and
+                not settings.audit_log.asynchronous)):
+            for upload in uploads:
+                _logger.debug('Sending %s for harvest of %r.', upload.name,
+                        self._app_name)
+
+                try:
+                    upload.send()
+                except RetryDataForRequest as exc:
+                    upload = self._retain_unsent_data(upload, exc)
+                    self._spool_harvest_upload(upload, settings)
+                    raise
+
+                if upload.reset:
+                    upload.reset()
+                if upload.sent:
+                    upload.sent()
+
+            return
+
+        executor = self._upload_executor
+
+        if executor is None or executor.max_workers != max_workers:
+            if executor is not None:
+                executor.shutdown()
+
+            executor = self._upload_executor = HarvestExecutor(
+                    self._app_name, max_workers)
+
+        results = {}
+
+        def _send(upload):
+            # Internal metrics are recorded against the thread, so each
+            # upload collects its own and they are merged afterwards.
+
+            metrics = CustomMetrics()
+
+            with InternalTraceContext(metrics):
+                _logger.debug('Sending %s for harvest of %r.', upload.name,
+                        self._app_name)
+
+                try:
+                    upload.send()
+                    results[upload.name] = (None, metrics)
+                except Exception as exc:
+                    results[upload.name] = (exc, metrics)
+
+        executor.run(_send, uploads)
+
+        raised = None
+
+        for upload in uploads:
+            exc, metrics = results.get(upload.name, (None, None))
+
+            if metrics is not None:
+                internal_metrics.merge_metrics(metrics.metrics())
+
+            if isinstance(exc, RetryDataForRequest):
+                # Keep the data in the snapshot so it is rolled back,
+                # unless it could be written to the harvest spool.
+                upload = self._retain_unsent_data(upload, exc)
+                self._spool_harvest_upload(upload, settings)
+            elif upload.reset:
+                upload.reset()
+
+            if exc is None:
+                if upload.sent:
+                    upload.sent()
+                continue
+
+            if raised is None or _harvest_upload_precedence(exc) < \
+                    _harvest_upload_precedence(raised):
+                raised = exc
+
+        if raised is not None:
+            raise raised
+
+    def harvest_spool(self, settings):
+        """Returns the spool into which the payloads of uploads which
+        failed with a recoverable error are written, or None if the spool
+        has not been enabled.
+
+        """
+
+        directory = settings.harvest_spool.directory
+
+        if not directory:
+            return None
+
+        if self._harvest_spool is None:
+            self._harvest_spool = HarvestSpool(
+                    spool_path(directory, self._app_name),
+                    settings.harvest_spool.max_bytes,
+                    settings.harvest_spool.max_age)
+
+        return self._harvest_spool
+
+    def _retain_unsent_data(self, upload, exc):
+        # Where only some batches of event data were accepted, only the
+        # events which were not are rolled back or spooled.
+
+        unsent = getattr(exc, 'unsent', None)
+
+        if unsent is None:
+            return upload
+
+        sampling_info, events = unsent
+
+        if upload.retain:
+            upload.retain(events, sampling_info.get('events_seen', 0))
+
+        if upload.spool is not None:
+            upload = upload._replace(spool=(upload.spool[0], unsent))
+
+        return upload
+
+    def _spool_harvest_upload(self, upload, settings):
+        # The data for an upload written to the spool is discarded from
+        # the harvest snapshot, so that it is not also rolled back into
+        # the next harvest.
+
+        spool = self.harvest_spool(settings)
+
+        if spool is None or upload.spool is None:
+            return
+
+        method, payload = upload.spool
+
+        if spool.append(method, payload):
+            _logger.debug('Spooled %s for harvest of %r.', upload.name,
+                    self._app_name)
+
+            if upload.reset:
+                upload.reset()
+
+    def _replay_harvest_spool(self, settings):
+        """Sends any payloads written to the harvest spool, in the order
+        they were written. Replay stops at the first payload which fails
+        with a recoverable error, to be resumed on the next harvest.
+
+        """
+
+        spool = self.harvest_spool(settings)
+
+        if spool is None:
+            return
+
+        session = self._active_session
+
+        def _send(method, payload):
+            _logger.debug('Replaying spooled %s for harvest of %r.', method,
+                    self._app_name)
+
+            try:
+                session.send_spooled_data(method, payload)
+            except DiscardDataForRequest:
+                raise HarvestSpoolDrop()
+            except RetryDataForRequest as exc:
+                unsent = getattr(exc, 'unsent', None)
+                if unsent is not None:
+                    raise HarvestSpoolRetry(unsent)
+                raise
+
+        try:
+            spool.replay(_send)
+
+        except RetryDataForRequest:
+            _logger.debug('Unable to replay the harvest spool for %r. The '
+                    'replay will be retried on the next harvest.',
+                    self._app_name)
+
+    def harvest(self, shutdown=False, flexible=False, queue_time=None,
+            data_types=None):
         """Performs a harvest, reporting aggregated data for the current
-        reporting period to the data collector.
+        reporting period to the data collector. The queue_time is how
+        long the harvest waited for a worker of the agent harvest executor
+        before starting.
+
+        For a flexible harvest, data_types can restrict the harvest to a
+        subset of the event data types. The number of events seen and the
+        reservoir capacity for each of those data types is returned.
 
         """
 
+        observations = {}
+
         if self._agent_shutdown:
-            return
+            return observations
 
         if shutdown:
             self._pending_shutdown = True
@@ -981,7 +1447,7 @@ class Application(object):
             _logger.debug('Cannot perform a data harvest for %r as '
                     'there is no active session.', self._app_name)
 
-            return
+            return observations
 
         internal_metrics = CustomMetrics()
 
@@ -990,6 +1456,10 @@ class Application(object):
         with InternalTraceContext(internal_metrics):
             with InternalTrace('Supportability/Python/Harvest/Calls/' + call_metric):
 
+                if queue_time is not None:
+                    internal_metric('Supportability/Python/Harvest/'
+                            'QueueTime/' + call_metric, queue_time)
+
                 self._harvest_count += 1
 
                 start = time.time()
@@ -1004,22 +1474,55 @@ class Application(object):
                 _logger.debug('Snapshotting for harvest[%s] of %r.', call_metric, self._app_name)
 
                 configuration = self._active_session.configuration
-                transaction_count = self._transaction_count
+
+                # Ensure any transactions waiting to be recorded in the
+                # background are included in this harvest.
+
+                if configuration.transaction_recorder.asynchronous:
+                    self.flush_transaction_recorder(
+                            configuration.transaction_recorder.flush_timeout)
+
+                if configuration.transaction_recorder.thread_local_stats:
+                    self.merge_stats_shards()
+
+                # The empty containers for the next reporting period are
+                # created before the lock is acquired, so that taking the
+                # snapshot only needs to swap references. Threads recording
+                # transactions are therefore only blocked for a constant
+                # time, however much data was collected.
+
+                standby = self._stats_engine.create_standby()
 
                 with self._stats_lock:
+                    transaction_count = self._transaction_count
                     self._transaction_count = 0
 
                     self._last_transaction = 0.0
 
-                    stats = self._stats_engine.harvest_snapshot(flexible)
+                    stats = self._stats_engine.harvest_snapshot(flexible,
+                            standby, data_types)
+
+                if flexible:
+                    harvest_limits = \
+                            stats.settings.event_harvest_config.harvest_limits
+
+                    for data_type in data_types or ():
+                        reservoir = stats.event_reservoir(data_type)
+                        if reservoir is not None:
+                            observations[data_type] = (reservoir.num_seen,
+                                    reservoir.capacity,
+                                    getattr(harvest_limits, data_type))
 
                 if not flexible:
+                    standby = self._stats_custom_engine.create_standby()
+
                     with self._stats_custom_lock:
                         global_events_account = self._global_events_account
                         self._global_events_account = 0
 
                         stats_custom = \
-                                self._stats_custom_engine.harvest_snapshot()
+                                self._stats_custom_engine.harvest_snapshot(
+                                standby=standby)
 
                     # stats_custom should only contain metric stats, no
                     # transactions
@@ -1108,8 +1611,16 @@ class Application(object):
                                 'forced harvest on shutdown.')
                         period_end = self._period_start + 1.001
 
+                uploads_complete = False
+
                 try:
-                    # Send the transaction and custom metric data.
+                    # Build the payloads for each of the data types to be
+                    # sent, adding them to the list of uploads. The data
+                    # collector is then only contacted once everything has
+                    # been prepared, with the uploads being sent
+                    # concurrently where that has been enabled.
+
+                    uploads = []
 
                     # Send data set for analytics, which is Synthetic analytic
                     # events, and the sampled data set of regular requests sent
@@ -1118,14 +1629,19 @@ class Application(object):
                     synthetics_events = stats.synthetics_events
                     if synthetics_events:
                         if synthetics_events.num_samples:
-                            _logger.debug('Sending synthetics event data for '
-                                    'harvest of %r.', self._app_name)
-
-                            self._active_session.send_transaction_events(
+                            uploads.append(_HarvestUpload(
+                                    'synthetics event data',
+                                    partial(self._active_session
+                                    .send_transaction_events,
                                     synthetics_events.sampling_info,
-                                    synthetics_events)
-
-                        stats.reset_synthetics_events()
+                                    synthetics_events),
+                                    stats.reset_synthetics_events, None,
+                                    ('analytic_event_data', (
+                                    synthetics_events.sampling_info,
+                                    synthetics_events)),
+                                    synthetics_events.retain))
+                        else:
+                            stats.reset_synthetics_events()
 
                     if (configuration.collect_analytics_events and
                             configuration.transaction_events.enabled):
@@ -1142,14 +1658,24 @@ class Application(object):
                                     transaction_events.num_samples)
 
                             if transaction_events.num_samples:
-                                _logger.debug('Sending analytics event data '
-                                        'for harvest of %r.', self._app_name)
+                                # The samples are passed as a list, which the
+                                # JSON encoder can serialize directly.
 
-                                self._active_session.send_transaction_events(
-                                        transaction_events.sampling_info,
+                                transaction_event_data = list(
                                         transaction_events)
-
-                            stats.reset_transaction_events()
+                                uploads.append(_HarvestUpload(
+                                        'analytics event data',
+                                        partial(self._active_session
+                                        .send_transaction_events,
+                                        transaction_events.sampling_info,
+                                        transaction_event_data),
+                                        stats.reset_transaction_events,
+                                        None, ('analytic_event_data', (
+                                        transaction_events.sampling_info,
+                                        transaction_event_data)),
+                                        transaction_events.retain))
+                            else:
+                                stats.reset_transaction_events()
 
                     # Send span events
 
@@ -1172,18 +1698,6 @@ class Application(object):
                         else:
                             spans = stats.span_events
                             if spans:
-                                if spans.num_samples > 0:
-                                    span_samples = list(spans)
-
-                                    _logger.debug(
-                                            'Sending span event data '
-                                            'for harvest of %r.',
-                                            self._app_name)
-
-                                    self._active_session.send_span_events(
-                                        spans.sampling_info, span_samples)
-                                    span_samples = None
-
                                 # As per spec
                                 spans_seen = spans.num_seen
                                 spans_sampled = spans.num_samples
@@ -1194,7 +1708,20 @@ class Application(object):
                                         'Supportability/SpanEvent/'
                                         'TotalEventsSent', spans_sampled)
 
-                                stats.reset_span_events()
+                                if spans.num_samples > 0:
+                                    span_data = list(spans)
+                                    uploads.append(_HarvestUpload(
+                                            'span event data',
+                                            partial(self._active_session
+                                            .send_span_events,
+                                            spans.sampling_info,
+                                            span_data),
+                                            stats.reset_span_events, None,
+                                            ('span_event_data', (
+                                            spans.sampling_info,
+                                            span_data)), spans.retain))
+                                else:
+                                    stats.reset_span_events()
 
                     # Send error events
 
@@ -1205,17 +1732,6 @@ class Application(object):
                         error_events = stats.error_events
                         if error_events:
                             num_error_samples = error_events.num_samples
-                            if num_error_samples > 0:
-                                error_event_samples = list(error_events)
-
-                                _logger.debug('Sending error event data '
-                                        'for harvest of %r.', self._app_name)
-
-                                samp_info = error_events.sampling_info
-                                self._active_session.send_error_events(
-                                        samp_info,
-                                        error_event_samples)
-                                error_event_samples = None
 
                             # As per spec
                             internal_count_metric('Supportability/Events/'
@@ -1224,7 +1740,21 @@ class Application(object):
                             internal_count_metric('Supportability/Events/'
                                     'TransactionError/Sent', num_error_samples)
 
-                            stats.reset_error_events()
+                            if num_error_samples > 0:
+                                error_event_data = list(error_events)
+                                uploads.append(_HarvestUpload(
+                                        'error event data',
+                                        partial(self._active_session
+                                        .send_error_events,
+                                        error_events.sampling_info,
+                                        error_event_data),
+                                        stats.reset_error_events, None,
+                                        ('error_event_data', (
+                                        error_events.sampling_info,
+                                        error_event_data)),
+                                        error_events.retain))
+                            else:
+                                stats.reset_error_events()
 
                     # Send custom events
 
@@ -1234,23 +1764,27 @@ class Application(object):
                         customs = stats.custom_events
 
                         if customs:
-                            if customs.num_samples > 0:
-                                custom_samples = list(customs)
-
-                                _logger.debug('Sending custom event data '
-                                        'for harvest of %r.', self._app_name)
-
-                                self._active_session.send_custom_events(
-                                        customs.sampling_info, custom_samples)
-                                custom_samples = None
-
                             # As per spec
                             internal_count_metric('Supportability/Events/'
                                     'Customer/Seen', customs.num_seen)
                             internal_count_metric('Supportability/Events/'
                                     'Customer/Sent', customs.num_samples)
 
-                            stats.reset_custom_events()
+                            if customs.num_samples > 0:
+                                custom_event_data = list(customs)
+                                uploads.append(_HarvestUpload(
+                                        'custom event data',
+                                        partial(self._active_session
+                                        .send_custom_events,
+                                        customs.sampling_info,
+                                        custom_event_data),
+                                        stats.reset_custom_events, None,
+                                        ('custom_event_data', (
+                                        customs.sampling_info,
+                                        custom_event_data)),
+                                        customs.retain))
+                            else:
+                                stats.reset_custom_events()
 
                     # Send the accumulated error data.
 
@@ -1258,10 +1792,10 @@ class Application(object):
                         error_data = stats.error_data()
 
                         if error_data:
-                            _logger.debug('Sending error data for harvest '
-                                    'of %r.', self._app_name)
-
-                            self._active_session.send_errors(error_data)
+                            uploads.append(_HarvestUpload('error data',
+                                    partial(self._active_session
+                                    .send_errors, error_data), None, None,
+                                    ('error_data', (error_data,))))
 
                     if not flexible:
                         if configuration.collect_traces:
@@ -1279,26 +1813,26 @@ class Application(object):
                                             connections)
 
                                     if slow_sql_data:
-                                        _logger.debug(
-                                                'Sending slow SQL data for '
-                                                'harvest of %r.',
-                                                self._app_name)
-
-                                        self._active_session.send_sql_traces(
-                                                slow_sql_data)
+                                        uploads.append(_HarvestUpload(
+                                                'slow SQL data',
+                                                partial(self._active_session
+                                                .send_sql_traces,
+                                                slow_sql_data), None, None,
+                                                None))
 
                                 slow_transaction_data = (
                                         stats.transaction_trace_data(
                                         connections))
 
                                 if slow_transaction_data:
-                                    _logger.debug('Sending slow transaction '
-                                            'data for harvest of %r.',
-                                            self._app_name)
-
-                                    self._active_session \
-                                    .send_transaction_traces(
-                                            slow_transaction_data)
+                                    uploads.append(_HarvestUpload(
+                                            'slow transaction data',
+                                            partial(self._active_session
+                                            .send_transaction_traces,
+                                            slow_transaction_data),
+                                            None, None, (
+                                            'transaction_sample_data', (
+                                            slow_transaction_data,))))
 
                         # Create a metric_normalizer based on normalize_name
                         # If metric rename rules are empty, set normalizer
@@ -1323,19 +1857,11 @@ class Application(object):
                         _logger.debug('Normalizing metrics for harvest of %r.',
                                 self._app_name)
 
-                        metric_data = stats.metric_data(metric_normalizer)
-
-                        _logger.debug('Sending metric data for harvest of %r.',
-                                self._app_name)
-
-                        # Send metrics
-                        self._active_session.send_metric_data(
-                                self._period_start, period_end, metric_data)
-
-                        _logger.debug('Done sending data for harvest of '
-                                '%r.', self._app_name)
-
-                        stats.reset_metric_stats()
+                        if configuration.metric_data_format == 'string_table':
+                            metric_data = stats.metric_data_string_table(
+                                    metric_normalizer)
+                        else:
+                            metric_data = stats.metric_data(metric_normalizer)
 
                         # Successful, we reset the reporting period start time.
                         # If an error occurs after this point,
@@ -1345,7 +1871,33 @@ class Application(object):
                         # only really want to count errors in being able to
                         # report the main transaction metrics.
 
-                        self._period_start = period_end
+                        def _metric_data_sent():
+                            self._period_start = period_end
+
+                        # The metric data is always the last upload so that
+                        # when uploads are sent one at a time, the reporting
+                        # period is only ended once all other data has been
+                        # accepted.
+
+                        uploads.append(_HarvestUpload('metric data',
+                                partial(self._active_session.send_metric_data,
+                                self._period_start, period_end, metric_data),
+                                stats.reset_metric_stats, _metric_data_sent,
+                                None))
+
+                    self._send_harvest_uploads(uploads, configuration,
+                            internal_metrics)
+
+                    uploads_complete = True
+
+                    # The data collector has accepted this harvest, so any
+                    # payloads spooled by prior harvests can now be sent.
+
+                    self._replay_harvest_spool(configuration)
+
+                    if not flexible:
+                        _logger.debug('Done sending data for harvest of '
+                                '%r.', self._app_name)
 
                         # Fetch agent commands sent from the data collector
                         # and process them.
@@ -1422,7 +1974,12 @@ class Application(object):
                     internal_metric('Supportability/Python/Harvest/'
                             'Exception/%s' % callable_name(exc_type), 1)
 
-                    if self._period_start != period_end:
+                    # Where uploads were sent concurrently the metric data
+                    # may have been accepted while other uploads failed, so
+                    # anything not yet sent must still be rolled back.
+
+                    if (self._period_start != period_end or
+                            not uploads_complete):
                         self._stats_engine.rollback(stats)
 
                 except DiscardDataForRequest:
@@ -1452,6 +2009,16 @@ class Application(object):
                             'data collector. Please report this problem to '
                             'New Relic support for further investigation.')
 
+                spool = self._harvest_spool
+
+                if spool is not None:
+                    for name, count in spool.stats().items():
+                        internal_count_metric('Supportability/Python/'
+                                'HarvestSpool/%s' % name, count)
+
+                    internal_metric('Supportability/Python/HarvestSpool/'
+                            'Bytes', len(spool))
+
                 duration = time.time() - start
 
                 _logger.debug('Completed harvest[%s] for %r in %.2f seconds.',
@@ -1472,6 +2039,32 @@ class Application(object):
         with self._stats_lock:
             self._stats_engine.merge_custom_metrics(internal_metrics.metrics())
 
+        return observations
+
+    def set_harvest_scale(self, data_type, schedule, metrics=()):
+        """Sizes the reservoir for the event data type as decided by the
+        harvest schedule for the data type, relative to the reporting
+        period the harvest limits of the session are given for. The
+        metrics recorded when the schedule was adapted are reported for
+        the application.
+
+        """
+
+        if not self._active_session:
+            return
+
+        configuration = self._active_session.configuration
+        report_period = configuration.event_harvest_config.report_period_ms
+
+        with self._stats_lock:
+            self._stats_engine.set_harvest_scale(data_type,
+                    schedule.reservoir_scale(report_period / 1000.0))
+            self._stats_engine.merge_custom_metrics(metrics)
+            self._stats_engine.record_custom_metric(
+                    'Supportability/Python/HarvestPeriod/%s/'
+                    'ReservoirSize' % data_type,
+                    self._stats_engine.harvest_limit(data_type))
+
     def report_profile_data(self):
         """Report back any profile data.
 
@@ -1535,6 +2128,21 @@ class Application(object):
         else:
             self._agent_shutdown = True
 
+            # Any transactions still queued cannot be reported now that
+            # the session has been shutdown, so they are discarded and the
+            # transaction recorder thread stopped.
+
+            recorder = self._transaction_recorder
+
+            if recorder is not None and recorder.active:
+                recorder.shutdown(timeout=0.0)
+
+            if self._upload_executor is not None:
+                self._upload_executor.shutdown()
+
+            if self._harvest_spool is not None:
+                self._harvest_spool.close()
+
     def process_agent_commands(self):
         """Fetches agents commands from data collector and process them.
 
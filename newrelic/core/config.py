@@ -301,6 +301,34 @@ class InfiniteTracingSettings(Settings):
         return True
 
 
+class TransactionRecorderSettings(Settings):
+    pass
+
+
+class HarvestExecutorSettings(Settings):
+    pass
+
+
+class HarvestSpoolSettings(Settings):
+    pass
+
+
+class ConnectionPoolSettings(Settings):
+    pass
+
+
+class AdaptiveHarvestSettings(Settings):
+    pass
+
+
+class AuditLogSettings(Settings):
+    pass
+
+
+class TraceCacheSettings(Settings):
+    pass
+
+
 class EventHarvestConfigSettings(Settings):
     nested = True
     _lock = threading.Lock()
@@ -363,6 +391,13 @@ _settings.transaction_segments.attributes = \
 _settings.distributed_tracing = DistributedTracingSettings()
 _settings.serverless_mode = ServerlessModeSettings()
 _settings.infinite_tracing = InfiniteTracingSettings()
+_settings.transaction_recorder = TransactionRecorderSettings()
+_settings.harvest_executor = HarvestExecutorSettings()
+_settings.harvest_spool = HarvestSpoolSettings()
+_settings.connection_pool = ConnectionPoolSettings()
+_settings.adaptive_harvest = AdaptiveHarvestSettings()
+_settings.audit_log = AuditLogSettings()
+_settings.trace_cache = TraceCacheSettings()
 _settings.event_harvest_config = EventHarvestConfigSettings()
 _settings.event_harvest_config.harvest_limits = \
         EventHarvestConfigHarvestLimitSettings()
@@ -605,6 +640,8 @@ _settings.sampling_target_period_in_seconds = 60
 
 _settings.compressed_content_encoding = 'gzip'
 _settings.max_payload_size_in_bytes = 1000000
+_settings.collector_json_backend = 'auto'
+_settings.metric_data_format = 'standard'
 
 _settings.attributes.enabled = True
 _settings.attributes.exclude = []
@@ -636,6 +673,13 @@ _settings.transaction_segments.attributes.enabled = True
 _settings.transaction_segments.attributes.exclude = []
 _settings.transaction_segments.attributes.include = []
 
+# Aggregating the terminal traces of unsampled transactions changes the
+# content of transaction traces, as the part of a slow transaction which
+# ran before the transaction tracer threshold was reached is collapsed,
+# so is only done where enabled.
+
+_settings.transaction_segments.unsampled_metrics_only = False
+
 _settings.transaction_tracer.enabled = True
 _settings.transaction_tracer.transaction_threshold = None
 _settings.transaction_tracer.record_sql = 'obfuscated'
@@ -687,7 +731,9 @@ _settings.agent_limits.sql_explain_plans = 30
 _settings.agent_limits.sql_explain_plans_per_harvest = 60
 _settings.agent_limits.slow_sql_data = 10
 _settings.agent_limits.merge_stats_maximum = None
+_settings.agent_limits.max_metric_names = 20000
 _settings.agent_limits.errors_per_transaction = 5
+_settings.agent_limits.segments_per_transaction = 3000
 _settings.agent_limits.errors_per_harvest = 20
 _settings.agent_limits.slow_transaction_dry_harvests = 5
 _settings.agent_limits.thread_profiler_nodes = 20000
@@ -695,6 +741,8 @@ _settings.agent_limits.synthetics_events = 200
 _settings.agent_limits.synthetics_transactions = 20
 _settings.agent_limits.data_compression_threshold = 64 * 1024
 _settings.agent_limits.data_compression_level = None
+_settings.agent_limits.data_compression_time_budget = 0.1
+_settings.agent_limits.data_compression_dictionary = False
 
 _settings.infinite_tracing.trace_observer_host = os.environ.get(
         'NEW_RELIC_INFINITE_TRACING_TRACE_OBSERVER_HOST', None)
@@ -713,6 +761,34 @@ _settings.event_harvest_config.harvest_limits.span_event_data = \
 _settings.event_harvest_config.harvest_limits.error_event_data = \
         ERROR_EVENT_RESERVOIR_SIZE
 
+_settings.transaction_recorder.thread_local_stats = False
+_settings.transaction_recorder.asynchronous = False
+_settings.transaction_recorder.queue_size = 10000
+_settings.transaction_recorder.overflow_policy = 'drop'
+_settings.transaction_recorder.flush_timeout = 5.0
+
+_settings.harvest_executor.max_workers = 1
+_settings.harvest_executor.max_upload_workers = 1
+
+_settings.harvest_spool.directory = None
+_settings.harvest_spool.max_bytes = 10 * 1024 * 1024
+_settings.harvest_spool.max_age = 3600.0
+
+_settings.connection_pool.enabled = False
+_settings.connection_pool.max_idle_time = 120.0
+
+_settings.adaptive_harvest.enabled = False
+_settings.adaptive_harvest.min_period = 5.0
+_settings.adaptive_harvest.max_period = 60.0
+
+_settings.audit_log.asynchronous = False
+_settings.audit_log.max_bytes = 100 * 1024 * 1024
+_settings.audit_log.backup_count = 5
+_settings.audit_log.queue_size = 1000
+
+_settings.trace_cache.backend = os.environ.get(
+        'NEW_RELIC_TRACE_CACHE_BACKEND', 'thread')
+
 _settings.console.listener_socket = None
 _settings.console.allow_interpreter_cmd = False
 
@@ -28,9 +28,106 @@ from newrelic.common.agent_http import (
 from newrelic.core.agent_protocol import AgentProtocol, ServerlessModeProtocol
 from newrelic.core.agent_streaming import StreamingRpc
 from newrelic.core.config import global_settings
+from newrelic.core.internal_metrics import internal_count_metric
+from newrelic.network.exceptions import PayloadTooLarge, RetryDataForRequest
 
 _logger = logging.getLogger(__name__)
 
+# The methods for which the payload is a sampled set of events, which can
+# be split across multiple requests if too large to be sent as one.
+
+EVENT_DATA_METHODS = frozenset(
+    (
+        "analytic_event_data",
+        "custom_event_data",
+        "error_event_data",
+        "span_event_data",
+    )
+)
+
+
+def _split_sampling_info(sampling_info, count, total):
+    # The counts in the sampling info are shared between the batches in
+    # proportion to the number of events in each batch.
+
+    split = dict(sampling_info)
+    for key in ("reservoir_size", "events_seen"):
+        if key in sampling_info:
+            split[key] = sampling_info[key] * count // total
+    return split
+
+
+def _event_sizes(chunk_sizes, count):
+    # The payload of the run id, sampling info and events is encoded in
+    # chunks of "[", the run id, ",", the sampling info, ",", "[" and then
+    # each of the events separated by ",", before the closing "]" and "]".
+    # The encoded size of each event is therefore that of every other
+    # chunk from the seventh chunk on. Where the sizes are not available,
+    # the events are treated as being of equal size.
+
+    sizes = chunk_sizes and chunk_sizes[6:-2:2] or []
+    if len(sizes) != count:
+        return [1] * count
+    return sizes
+
+
+def split_event_data(sampling_info, events, sizes, batches):
+    """Splits the events into the given number of batches, of roughly equal
+    encoded size, given the encoded size of each event. Returns a list of
+    the sampling info and the events for each batch.
+
+    """
+
+    target = sum(sizes) / float(batches)
+
+    result = []
+    start = 0
+    accumulated = 0
+
+    for index, size in enumerate(sizes):
+        accumulated += size
+        remaining = batches - len(result) - 1
+
+        if remaining and (
+            accumulated >= target * (len(result) + 1)
+            or len(events) - index - 1 == remaining
+        ):
+            result.append(events[start : index + 1])
+            start = index + 1
+
+    result.append(events[start:])
+
+    total = len(events)
+    split = []
+
+    for batch in result:
+        info = _split_sampling_info(sampling_info, len(batch), total)
+        split.append((info, batch))
+
+    # Any remainder from the integer division of the counts is added to
+    # the last batch, so the counts of all batches add up to the original.
+
+    for key in ("reservoir_size", "events_seen"):
+        if key in sampling_info:
+            split[-1][0][key] += sampling_info[key] - sum(info[key] for info, _ in split)
+
+    return split
+
+
+def _merge_event_data(batches):
+    # Combines batches of events back into a single batch, adding up the
+    # counts in the sampling info of each.
+
+    sampling_info = {}
+    events = []
+
+    for info, batch in batches:
+        for key, value in info.items():
+            sampling_info[key] = sampling_info.get(key, 0) + value
+        events.extend(batch)
+
+    return sampling_info, events
+
 
 class Session(object):
     PROTOCOL = AgentProtocol
@@ -100,23 +197,85 @@ class Session(object):
         payload = (self.agent_run_id, transaction_traces)
         return self._protocol.send("transaction_sample_data", payload)
 
+    def _send_event_data(self, method, sampling_info, events):
+        """Sends a sampled set of events. Where the payload is too large to
+        be accepted, the events are split into batches which are each sent
+        as a separate request, splitting them further as necessary.
+
+        Where a batch fails with a recoverable error, the sampling info and
+        events of the batches which were not accepted are recorded against
+        the exception as unsent, so that the batches which were accepted
+        are not sent again.
+
+        """
+
+        payload = (self.agent_run_id, sampling_info, events)
+
+        try:
+            return self._protocol.send(method, payload)
+        except PayloadTooLarge as exc:
+            events = list(events)
+
+            if len(events) <= 1:
+                raise
+
+            size = exc.args and exc.args[0] or 0
+            maximum = self.configuration.max_payload_size_in_bytes
+
+            # Aim for batches well within the limit, as the size of each
+            # batch once compressed can only be estimated.
+
+            batches = 2
+            if maximum and size:
+                batches = max(batches, -(-size * 5 // (maximum * 4)))
+            batches = min(batches, len(events))
+
+            # The encoded size of each event is taken from when the
+            # payload was encoded, rather than encoding the events again.
+
+            chunk_sizes = exc.args[1] if len(exc.args) > 1 else None
+            sizes = _event_sizes(chunk_sizes, len(events))
+
+        internal_count_metric("Supportability/Python/Collector/Split/%s" % method, 1)
+        internal_count_metric(
+            "Supportability/Python/Collector/Split/Batches/%s" % method, batches
+        )
+
+        _logger.debug(
+            "Payload for %r was too large at %d bytes. Splitting %d events "
+            "into %d batches.",
+            method,
+            size,
+            len(events),
+            batches,
+        )
+
+        split = split_event_data(sampling_info, events, sizes, batches)
+
+        for index, (batch_info, batch) in enumerate(split):
+            try:
+                self._send_event_data(method, batch_info, batch)
+            except RetryDataForRequest as exc:
+                unsent = getattr(exc, "unsent", None) or (batch_info, batch)
+                exc.unsent = _merge_event_data([unsent] + split[index + 1 :])
+                raise
+
     def send_transaction_events(self, sampling_info, sample_set):
         """Called to submit sample set for analytics."""
 
-        payload = (self.agent_run_id, sampling_info, sample_set)
-        return self._protocol.send("analytic_event_data", payload)
+        return self._send_event_data("analytic_event_data", sampling_info, sample_set)
 
     def send_custom_events(self, sampling_info, custom_event_data):
         """Called to submit sample set for custom events."""
 
-        payload = (self.agent_run_id, sampling_info, custom_event_data)
-        return self._protocol.send("custom_event_data", payload)
+        return self._send_event_data(
+            "custom_event_data", sampling_info, custom_event_data
+        )
 
     def send_span_events(self, sampling_info, span_event_data):
         """Called to submit sample set for span events."""
 
-        payload = (self.agent_run_id, sampling_info, span_event_data)
-        return self._protocol.send("span_event_data", payload)
+        return self._send_event_data("span_event_data", sampling_info, span_event_data)
 
     def send_metric_data(self, start_time, end_time, metric_data):
         """Called to submit metric data for specified period of time.
@@ -128,6 +287,19 @@ class Session(object):
         payload = (self.agent_run_id, start_time, end_time, metric_data)
         return self._protocol.send("metric_data", payload)
 
+    def send_spooled_data(self, method, payload):
+        """Called to resend a payload written to the harvest spool when it
+        could not be sent. The payload does not include the agent run ID,
+        as it may have been written under a prior session.
+
+        """
+
+        if method in EVENT_DATA_METHODS:
+            return self._send_event_data(method, *payload)
+
+        payload = (self.agent_run_id,) + tuple(payload)
+        return self._protocol.send(method, payload)
+
     def get_agent_commands(self):
         """Receive agent commands from the data collector.
 
@@ -151,8 +323,7 @@ class Session(object):
     def send_error_events(self, sampling_info, error_data):
         """Called to submit sample set for error events."""
 
-        payload = (self.agent_run_id, sampling_info, error_data)
-        return self._protocol.send("error_event_data", payload)
+        return self._send_event_data("error_event_data", sampling_info, error_data)
 
     def send_sql_traces(self, sql_traces):
         """Called to sub SQL traces. The SQL traces should be an
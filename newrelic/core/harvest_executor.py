@@ -0,0 +1,154 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a bounded pool of worker threads used by the
+agent to harvest the data for multiple applications concurrently. Each
+call to run() blocks until every task submitted has completed, so that a
+harvest for all applications finishes before the next harvest starts.
+
+"""
+
+import logging
+import os
+import threading
+
+import newrelic.packages.six as six
+
+_logger = logging.getLogger(__name__)
+
+
+class _HarvestBatch(object):
+
+    def __init__(self, count):
+        self.remaining = count
+        self.done = threading.Event()
+
+    def complete(self):
+        # Called with the executor lock held.
+
+        self.remaining -= 1
+
+        if not self.remaining:
+            self.done.set()
+
+
+class HarvestExecutor(object):
+
+    def __init__(self, name, max_workers):
+        self._name = name
+        self._max_workers = max(1, max_workers)
+
+        self._lock = threading.Lock()
+        self._queue = six.moves.queue.Queue()
+        self._workers = []
+        self._shutdown = False
+
+        self._process_id = os.getpid()
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def run(self, func, items):
+        """Calls func for each of the items, using up to max_workers
+        threads, and waits for all calls to complete.
+
+        """
+
+        items = list(items)
+
+        # Where there is nothing to be gained from running the calls in
+        # parallel, or the executor has been shutdown, run the calls in
+        # the current thread.
+
+        if (self._max_workers == 1 or len(items) <= 1 or
+                not self._start_workers(len(items))):
+            for item in items:
+                self._call(func, item)
+
+            return
+
+        batch = _HarvestBatch(len(items))
+
+        for item in items:
+            self._queue.put((batch, func, item))
+
+        batch.done.wait()
+
+    def shutdown(self, timeout=None):
+        with self._lock:
+            if self._shutdown:
+                return
+
+            self._shutdown = True
+            workers = self._workers
+            self._workers = []
+
+        for _ in workers:
+            self._queue.put(None)
+
+        for worker in workers:
+            if worker is not threading.current_thread():
+                worker.join(timeout)
+
+    def _start_workers(self, count):
+        with self._lock:
+            if self._shutdown:
+                return False
+
+            # Worker threads do not survive a fork, so start afresh in the
+            # child process.
+
+            if self._process_id != os.getpid():
+                self._process_id = os.getpid()
+                self._queue = six.moves.queue.Queue()
+                self._workers = []
+
+            self._workers = [worker for worker in self._workers
+                    if worker.is_alive()]
+
+            while len(self._workers) < min(count, self._max_workers):
+                worker = threading.Thread(target=self._run,
+                        args=(self._queue,),
+                        name='NR-Harvest-Worker/%s/%d' % (self._name,
+                        len(self._workers) + 1))
+                worker.setDaemon(True)
+                worker.start()
+
+                self._workers.append(worker)
+
+        return True
+
+    def _call(self, func, item):
+        try:
+            func(item)
+
+        except Exception:
+            _logger.exception('Unexpected exception in harvest worker. '
+                    'Please report this problem to New Relic support for '
+                    'further investigation.')
+
+    def _run(self, queue):
+        while True:
+            task = queue.get()
+
+            if task is None:
+                return
+
+            batch, func, item = task
+
+            self._call(func, item)
+
+            with self._lock:
+                batch.complete()
@@ -0,0 +1,115 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the adaptive scheduling of flexible harvests,
+where each event data type is harvested on its own period.
+
+The period for a data type adapts to how many events arrive between
+harvests relative to the harvest limit the data collector gives for a
+whole reporting period. A data type which sees more events than that
+between harvests is harvested more often, giving smaller payloads and
+holding fewer events in memory. A data type which sees only a fraction
+of that is harvested less often, saving requests to the data collector.
+As the number of events seen follows the period, the period settles
+where the events seen between harvests are within those bounds.
+
+The reservoir for a data type is sized from the rate events were seen
+at, with headroom so that it neither overflows nor sits mostly empty.
+It is never larger than the harvest limit scaled to the period, keeping
+the number of events reported per reporting period within the limit.
+The reporting period is that given by the data collector for the session
+of each application, which is not known when the schedule is created.
+
+"""
+
+from newrelic.core.internal_metrics import (internal_count_metric,
+        internal_metric)
+
+# Where fewer events than this fraction of the harvest limit are seen
+# between harvests the harvest period is lengthened.
+
+LOW_WATERMARK = 0.25
+
+# The reservoir is sized to hold this many times the number of events
+# expected to be seen over the next harvest period.
+
+HEADROOM = 2.0
+
+
+class HarvestSchedule(object):
+
+    def __init__(self, data_type, report_period, min_period, max_period):
+        self.data_type = data_type
+        self.min_period = min(min_period, max_period)
+        self.max_period = max_period
+        self.period = min(max(report_period, self.min_period),
+                self.max_period)
+        self.expected = None
+
+    def observe(self, observations):
+        """Adapts the harvest period given the number of events seen, the
+        reservoir capacity and the harvest limit for each application
+        harvested. Returns the period until the next harvest of the data
+        type, with the number of events expected over that period being
+        updated.
+
+        """
+
+        fill = 0.0
+        load = 0.0
+
+        for num_seen, capacity, limit in observations:
+            if capacity > 0:
+                fill = max(fill, num_seen / float(capacity))
+            if limit > 0:
+                load = max(load, num_seen / float(limit))
+
+        prefix = 'Supportability/Python/HarvestPeriod/%s/' % self.data_type
+
+        period = self.period
+
+        if load > 1.0 and self.period > self.min_period:
+            self.period = max(self.min_period, self.period / 2.0)
+            internal_count_metric(prefix + 'Shortened', 1)
+
+        elif load < LOW_WATERMARK and self.period < self.max_period:
+            self.period = min(self.max_period, self.period * 2.0)
+            internal_count_metric(prefix + 'Lengthened', 1)
+
+        # The events expected over the next period assume they continue
+        # to arrive at the rate seen over the last period.
+
+        self.expected = load * self.period / period
+
+        internal_metric(prefix + 'Fill', fill)
+        internal_metric(prefix + 'Load', load)
+        internal_metric(prefix + 'Period', self.period)
+
+        return self.period
+
+    def reservoir_scale(self, report_period):
+        """Returns the factor by which to scale the harvest limit for the
+        data type to give the reservoir size, where the harvest limit is
+        for the given reporting period. This is the reporting period of
+        the session of the application, as given by the data collector.
+
+        """
+
+        budget = self.period / float(report_period)
+
+        if self.expected is None:
+            return budget
+
+        return min(budget, max(LOW_WATERMARK * budget,
+                HEADROOM * self.expected))
@@ -0,0 +1,502 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a bounded, append-only spool file into which the
+payloads of harvest uploads which could not be sent to the data collector
+are written. The spooled payloads are replayed in the order they were
+written once the data collector can again be reached.
+
+The spool file is a fixed size and memory mapped. It starts with a header
+recording the offsets of the first unsent record and of the end of the
+written records, followed by the records themselves. Each record consists
+of the length of the record data, the time it was written and a checksum,
+followed by the compressed JSON encoded method name and payload.
+
+Only one process can use the spool file at a time. Other processes, such as
+the workers of a pre-forking server, spool to files of their own, which are
+taken over by the process using the spool file once they have exited.
+
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from newrelic.common.encoding_utils import json_decode, json_encode
+
+_logger = logging.getLogger(__name__)
+
+_MAGIC = b'NRSPOOL1'
+
+# Magic, offset of first unsent record, offset of end of written records.
+
+_FILE_HEADER = struct.Struct('<8sQQ')
+
+# Length of record data, time record was written, checksum of record data.
+
+_RECORD_HEADER = struct.Struct('<IdI')
+
+
+def spool_path(directory, app_name):
+    """Returns the path of the spool file for the application."""
+
+    digest = hashlib.sha1(app_name.encode('utf-8')).hexdigest()
+    return os.path.join(directory, 'newrelic-%s.spool' % digest)
+
+
+class HarvestSpool(object):
+
+    def __init__(self, path, max_bytes, max_age):
+        self._main_path = path
+        self._path = path
+        self._size = max(max_bytes, _FILE_HEADER.size + _RECORD_HEADER.size)
+        self._max_age = max_age
+
+        self._lock = threading.Lock()
+
+        self._file = None
+        self._mmap = None
+        self._process_id = None
+
+        self._read_offset = _FILE_HEADER.size
+        self._write_offset = _FILE_HEADER.size
+
+        self._replaying = False
+        self._counts = {}
+
+    @property
+    def path(self):
+        return self._path
+
+    def __len__(self):
+        with self._lock:
+            if not self._open():
+                return 0
+
+            return self._write_offset - self._read_offset
+
+    def append(self, method, payload):
+        """Writes the payload for the method to the end of the spool.
+        Returns False if the spool does not have room for the payload.
+
+        """
+
+        data = zlib.compress(json_encode([method, payload]).encode('utf-8'))
+        record = _RECORD_HEADER.pack(len(data), time.time(),
+                zlib.crc32(data) & 0xffffffff) + data
+
+        with self._lock:
+            if not self._open():
+                return False
+
+            if not self._write(record):
+                self._count('Dropped', method)
+                return False
+
+            self._count('Spooled', method)
+
+        return True
+
+    def replay(self, send):
+        """Passes each of the spooled payloads to send, in the order they
+        were written, as the method name and the payload. A payload is
+        only removed from the spool once send returns, or if it raises an
+        exception for which the payload should be dropped. Where only part
+        of the payload was accepted, the remainder is spooled again and the
+        replay stops. Any other exception stops the replay and is raised.
+        Payloads older than the maximum age are dropped without being sent.
+
+        """
+
+        with self._lock:
+            if self._replaying:
+                return
+
+            # A process spooling to a file of its own tries again to take
+            # over the spool file shared by all processes, such as once
+            # the process which was using it has exited.
+
+            if self._path != self._main_path and self._mmap is not None:
+                self._close()
+
+            # The process using the shared spool file takes over the files
+            # of any other processes which have exited since it was opened.
+
+            elif self._process_id == os.getpid() and self._mmap is not None:
+                self._adopt_orphaned_spools()
+
+            self._replaying = True
+
+        try:
+            self._replay(send)
+
+        finally:
+            with self._lock:
+                self._replaying = False
+
+    def _replay(self, send):
+        while True:
+            with self._lock:
+                if not self._open():
+                    return
+
+                record = self._peek()
+
+                if record is None:
+                    return
+
+                end, written, method, payload = record
+
+                if (self._max_age is not None and
+                        time.time() - written > self._max_age):
+                    self._consume(end)
+                    self._count('Expired', method)
+                    continue
+
+            try:
+                send(method, payload)
+
+            except HarvestSpoolDrop:
+                with self._lock:
+                    self._consume(end)
+                    self._count('Discarded', method)
+
+                continue
+
+            except HarvestSpoolRetry as exc:
+                with self._lock:
+                    self._consume(end)
+
+                self.append(method, exc.payload)
+
+                return
+
+            with self._lock:
+                self._consume(end)
+                self._count('Replayed', method)
+
+    def stats(self):
+        """Returns a dictionary mapping metric names to counts of payloads
+        spooled, replayed and dropped since stats were last retrieved.
+
+        """
+
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            return counts
+
+    def close(self, remove=False):
+        with self._lock:
+            # A spool file of this process's own is also removed where
+            # there is nothing left in it to be replayed.
+
+            if (self._path != self._main_path and
+                    self._read_offset == self._write_offset):
+                remove = True
+
+            self._close()
+
+            if remove:
+                try:
+                    os.remove(self._path)
+                except OSError:
+                    pass
+
+    def _close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        self._process_id = None
+
+    def _count(self, kind, method):
+        for name in (kind, '%s/%s' % (kind, method)):
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def _open(self):
+        # The spool file is opened lazily and opened again in a child
+        # process after a fork, as the file lock is not inherited.
+
+        if self._process_id == os.getpid():
+            return self._mmap is not None
+
+        self._close()
+
+        self._process_id = os.getpid()
+        self._path = self._main_path
+
+        try:
+            directory = os.path.dirname(self._path)
+
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            # Only one process can use the spool file at a time. Any other
+            # process reporting as the same application, such as the
+            # workers of a pre-forking server, spools to a file of its own.
+            # The records in that file are taken over by the process using
+            # the shared spool file once the other process has exited.
+
+            self._file = _open_locked(self._path)
+
+            if self._file is None:
+                self._path = '%s.%d' % (self._main_path, os.getpid())
+                self._file = _open_locked(self._path)
+
+            if self._file is None:
+                raise IOError('Unable to lock %r.' % self._path)
+
+            fd = self._file.fileno()
+
+            self._file.seek(0, os.SEEK_END)
+
+            if self._file.tell() != self._size:
+                self._file.truncate(self._size)
+
+            self._mmap = mmap.mmap(fd, self._size)
+
+        except Exception:
+            _logger.exception('Unable to open the harvest spool file %r. '
+                    'Payloads which fail to be sent will not be spooled.',
+                    self._path)
+
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+            return False
+
+        # Resume from any payloads left in the spool by a prior process,
+        # provided the offsets recorded in the header are sane.
+
+        magic, read_offset, write_offset = _FILE_HEADER.unpack_from(
+                self._mmap, 0)
+
+        if (magic == _MAGIC and _FILE_HEADER.size <= read_offset <=
+                write_offset <= self._size):
+            self._read_offset = read_offset
+            self._write_offset = write_offset
+        else:
+            self._read_offset = self._write_offset = _FILE_HEADER.size
+            self._write_header()
+
+        if self._path == self._main_path:
+            self._adopt_orphaned_spools()
+
+        return True
+
+    def _adopt_orphaned_spools(self):
+        # Appends the unsent records from the spool files of other
+        # processes which have since exited, then removes those files. The
+        # file of a process still running remains locked by it.
+
+        directory, name = os.path.split(self._main_path)
+        prefix = name + '.'
+
+        try:
+            names = os.listdir(directory or os.curdir)
+        except OSError:
+            return
+
+        for name in names:
+            if not name.startswith(prefix) or \
+                    not name[len(prefix):].isdigit():
+                continue
+
+            path = os.path.join(directory, name)
+
+            try:
+                orphan = _open_locked(path, create=False)
+            except (IOError, OSError):
+                continue
+
+            if orphan is None:
+                continue
+
+            try:
+                for record in _read_records(orphan.read()):
+                    if not self._write(record):
+                        _logger.warning('Discarding records from the '
+                                'harvest spool file %r as there is no room '
+                                'for them in %r.', path, self._path)
+                        break
+
+                os.remove(path)
+
+            except Exception:
+                _logger.exception('Unable to take over the records of the '
+                        'harvest spool file %r.', path)
+
+            finally:
+                orphan.close()
+
+    def _write(self, record):
+        if self._write_offset + len(record) > self._size:
+            self._compact()
+
+        if self._write_offset + len(record) > self._size:
+            return False
+
+        self._mmap[self._write_offset:
+                self._write_offset + len(record)] = record
+        self._write_offset += len(record)
+        self._write_header()
+
+        return True
+
+    def _write_header(self):
+        _FILE_HEADER.pack_into(self._mmap, 0, _MAGIC, self._read_offset,
+                self._write_offset)
+
+    def _peek(self):
+        while self._read_offset < self._write_offset:
+            start = self._read_offset + _RECORD_HEADER.size
+
+            length, written, checksum = _RECORD_HEADER.unpack_from(
+                    self._mmap, self._read_offset)
+
+            end = start + length
+            data = self._mmap[start:end]
+
+            if end > self._write_offset or (
+                    zlib.crc32(data) & 0xffffffff) != checksum:
+                # The remainder of the spool is corrupt, most likely due to
+                # the process being killed part way through a write.
+
+                _logger.warning('Discarding corrupt records from the harvest '
+                        'spool file %r.', self._path)
+
+                self._consume(self._write_offset)
+                return None
+
+            try:
+                method, payload = json_decode(
+                        zlib.decompress(data).decode('utf-8'))
+            except Exception:
+                self._consume(end)
+                continue
+
+            return end, written, method, payload
+
+    def _consume(self, end):
+        self._read_offset = end
+
+        if self._read_offset >= self._write_offset:
+            self._read_offset = self._write_offset = _FILE_HEADER.size
+
+        self._write_header()
+
+    def _compact(self):
+        # Move any unsent records to the start of the spool to make room
+        # at the end for more records. This cannot be done while a replay
+        # is in progress as the records would move under the replay.
+
+        if self._replaying or self._read_offset == _FILE_HEADER.size:
+            return
+
+        length = self._write_offset - self._read_offset
+        self._mmap.move(_FILE_HEADER.size, self._read_offset, length)
+
+        self._read_offset = _FILE_HEADER.size
+        self._write_offset = _FILE_HEADER.size + length
+        self._write_header()
+
+
+def _open_locked(path, create=True):
+    # Opens the file, returning None where it is locked by another process.
+
+    flags = os.O_RDWR | (os.O_CREAT if create else 0)
+
+    fd = os.open(path, flags, 0o600)
+    spool_file = os.fdopen(fd, 'r+b')
+
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            spool_file.close()
+            return None
+
+        # The file may have been taken over and removed by another process
+        # between it being opened and locked, in which case it is opened
+        # again.
+
+        try:
+            removed = os.stat(path).st_ino != os.fstat(fd).st_ino
+        except OSError:
+            removed = True
+
+        if removed:
+            spool_file.close()
+            return create and _open_locked(path) or None
+
+    return spool_file
+
+
+def _read_records(data):
+    # Yields the unsent records from the content of a spool file, stopping
+    # at the first which is corrupt.
+
+    if len(data) < _FILE_HEADER.size:
+        return
+
+    magic, read_offset, write_offset = _FILE_HEADER.unpack_from(data, 0)
+
+    if magic != _MAGIC or not (_FILE_HEADER.size <= read_offset <=
+            write_offset <= len(data)):
+        return
+
+    while read_offset + _RECORD_HEADER.size <= write_offset:
+        length, written, checksum = _RECORD_HEADER.unpack_from(data,
+                read_offset)
+
+        end = read_offset + _RECORD_HEADER.size + length
+
+        if end > write_offset or (zlib.crc32(
+                data[end - length:end]) & 0xffffffff) != checksum:
+            return
+
+        yield data[read_offset:end]
+
+        read_offset = end
+
+
+class HarvestSpoolDrop(Exception):
+    """Raised by the send function passed to HarvestSpool.replay() where a
+    payload should be dropped from the spool rather than retried."""
+
+
+class HarvestSpoolRetry(Exception):
+    """Raised by the send function passed to HarvestSpool.replay() where
+    only part of a payload was accepted. The payload is replaced by the
+    part which was not, written to the end of the spool, and the replay
+    stops."""
+
+    def __init__(self, payload):
+        super(HarvestSpoolRetry, self).__init__()
+        self.payload = payload
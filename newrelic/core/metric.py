@@ -21,3 +21,8 @@ ApdexMetric = namedtuple('ApdexMetric',
 
 TimeMetric = namedtuple('TimeMetric',
         ['name', 'scope', 'duration', 'exclusive'])
+
+# A time metric for a number of calls which have already been accumulated
+# into a stats object, such as for aggregated segments of a transaction.
+
+TimeStatsMetric = namedtuple('TimeStatsMetric', ['name', 'scope', 'stats'])
@@ -12,12 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import random
+
 import newrelic.core.attribute as attribute
 
 from newrelic.core.attribute_filter import (DST_SPAN_EVENTS,
         DST_TRANSACTION_SEGMENTS)
 
 
+def _generate_guid():
+    # 16-digit random hex. Padded with zeros in the front.
+    return '%016x' % random.getrandbits(64)
+
+
 class GenericNodeMixin(object):
     @property
     def processed_user_attributes(self):
@@ -25,7 +32,7 @@ class GenericNodeMixin(object):
             return self._processed_user_attributes
 
         self._processed_user_attributes = u_attrs = {}
-        user_attributes = getattr(self, 'user_attributes', u_attrs)
+        user_attributes = getattr(self, 'user_attributes', None) or u_attrs
         for k, v in user_attributes.items():
             k, v = attribute.process_user_attribute(k, v)
             u_attrs[k] = v
@@ -33,7 +40,7 @@ class GenericNodeMixin(object):
 
     def get_trace_segment_params(self, settings, params=None):
         _params = attribute.resolve_agent_attributes(
-                self.agent_attributes,
+                self.agent_attributes or {},
                 settings.attribute_filter,
                 DST_TRANSACTION_SEGMENTS)
 
@@ -53,11 +60,12 @@ class GenericNodeMixin(object):
                 settings,
                 base_attrs=None,
                 parent_guid=None,
-                attr_class=dict):
+                attr_class=dict,
+                guid=None):
         i_attrs = base_attrs and base_attrs.copy() or attr_class()
         i_attrs['type'] = 'Span'
         i_attrs['name'] = self.name
-        i_attrs['guid'] = self.guid
+        i_attrs['guid'] = guid or self.guid or _generate_guid()
         i_attrs['timestamp'] = int(self.start_time * 1000)
         i_attrs['duration'] = self.duration
         i_attrs['category'] = 'generic'
@@ -66,7 +74,7 @@ class GenericNodeMixin(object):
             i_attrs['parentId'] = parent_guid
 
         a_attrs = attribute.resolve_agent_attributes(
-                self.agent_attributes,
+                self.agent_attributes or {},
                 settings.attribute_filter,
                 DST_SPAN_EVENTS,
                 attr_class=attr_class)
@@ -83,20 +91,30 @@ class GenericNodeMixin(object):
     def span_events(self,
             settings, base_attrs=None, parent_guid=None, attr_class=dict):
 
+        # The guid of a trace is only generated when something refers to
+        # it, so one is generated here for the span where that never
+        # happened. It is shared with the children as their parent id.
+
+        guid = self.guid or _generate_guid()
+
         yield self.span_event(
                 settings,
                 base_attrs=base_attrs,
                 parent_guid=parent_guid,
-                attr_class=attr_class)
+                attr_class=attr_class,
+                guid=guid)
 
         for child in self.children:
             for event in child.span_events(
                     settings,
                     base_attrs=base_attrs,
-                    parent_guid=self.guid,
+                    parent_guid=guid,
                     attr_class=attr_class):
                 yield event
 
+    def span_event_count(self):
+        return 1 + sum(child.span_event_count() for child in self.children)
+
 
 class DatastoreNodeMixin(GenericNodeMixin):
 
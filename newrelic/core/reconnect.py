@@ -0,0 +1,113 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the scheduling of retries when registering an
+application with the data collector fails.
+
+Delays between attempts grow exponentially with decorrelated jitter, so
+that a large number of processes which restart together do not continue
+to retry in lockstep. A retry hint given by the data collector is always
+honoured, and all applications in the process draw their retries from a
+shared budget, so that many applications failing together cannot retry
+faster than the budget refills.
+
+"""
+
+import random
+import threading
+import time
+
+BASE_DELAY = 15.0
+MAX_DELAY = 300.0
+
+# Upper bound on how long a retry hint from the data collector can hold off
+# the next attempt.
+
+MAX_RETRY_AFTER = 3600.0
+
+
+class RetryBudget(object):
+
+    """A token bucket holding the retries available to all applications in
+    the process. Each retry takes a token, with tokens being replaced at a
+    fixed interval up to the capacity of the bucket.
+
+    """
+
+    def __init__(self, capacity=10, refill_interval=30.0, clock=time.time):
+        self._capacity = capacity
+        self._refill_interval = refill_interval
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._updated = clock()
+
+    def acquire(self):
+        """Takes a retry from the budget, returning the number of seconds
+        until the retry may be made. When the budget is exhausted the token
+        is still reserved, so that waiting retries are served in turn.
+
+        """
+
+        with self._lock:
+            now = self._clock()
+
+            self._tokens = min(self._capacity, self._tokens +
+                    max(0.0, now - self._updated) / self._refill_interval)
+            self._updated = now
+
+            self._tokens -= 1
+
+            if self._tokens >= 0:
+                return 0.0
+
+            return -self._tokens * self._refill_interval
+
+
+# The budget shared by all applications in the process.
+
+retry_budget = RetryBudget()
+
+
+class ReconnectScheduler(object):
+
+    def __init__(self, budget=None, base_delay=BASE_DELAY,
+            max_delay=MAX_DELAY, uniform=random.uniform):
+        self._budget = budget
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._uniform = uniform
+
+        self._delay = base_delay
+
+    def next_delay(self, retry_after=None):
+        """Returns the number of seconds to wait before the next attempt,
+        given any number of seconds the data collector asked the agent to
+        wait before retrying.
+
+        """
+
+        self._delay = min(self._max_delay, self._uniform(self._base_delay,
+                self._delay * 3))
+
+        delay = self._delay
+
+        if retry_after:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+
+        if self._budget is not None:
+            delay = max(delay, self._budget.acquire())
+
+        return delay
@@ -21,13 +21,15 @@ data whereby it is sent to the core application.
 
 import base64
 import copy
+import itertools
 import logging
 import operator
 import random
 import zlib
 import time
 import sys
-from heapq import heapreplace, heapify
+from array import array
+from heapq import heapreplace, heapify, nlargest
 
 import newrelic.packages.six as six
 
@@ -37,7 +39,7 @@ from newrelic.core.attribute import create_user_attributes
 from newrelic.core.attribute import process_user_attribute
 from newrelic.core.database_utils import explain_plan
 from newrelic.core.error_collector import TracedError
-from newrelic.core.metric import TimeMetric
+from newrelic.core.metric import TimeMetric, TimeStatsMetric
 from newrelic.core.stack_trace import exception_stack
 
 from newrelic.api.settings import STRIP_EXCEPTION_MESSAGE
@@ -54,6 +56,17 @@ EVENT_HARVEST_METHODS = {
     'error_event_data': ('reset_error_events',),
 }
 
+# The attribute holding the container which each of the event reset methods
+# replaces. Used to swap in containers prepared ahead of time instead.
+
+EVENT_CONTAINERS = {
+    'reset_transaction_events': '_transaction_events',
+    'reset_synthetics_events': '_synthetics_events',
+    'reset_span_events': '_span_events',
+    'reset_custom_events': '_custom_events',
+    'reset_error_events': '_error_events',
+}
+
 
 def c2t(count=0, total=0.0, min=0.0, max=0.0, sum_of_squares=0.0):
     return (count, total, total, min, max, sum_of_squares)
@@ -179,6 +192,430 @@ class CountStats(TimeStats):
         pass
 
 
+_TIME_STATS = 0
+_COUNT_STATS = 1
+_APDEX_STATS = 2
+
+_STATS_TYPES = (TimeStats, CountStats, ApdexStats)
+
+
+def _stats_kind(stats):
+    if isinstance(stats, ApdexStats):
+        return _APDEX_STATS
+    elif isinstance(stats, CountStats):
+        return _COUNT_STATS
+    return _TIME_STATS
+
+
+class MetricStatsTable(object):
+
+    """Table for accumulating apdex, time and value metrics.
+
+    """
+
+    # Rather than holding a separate list based stats object per metric,
+    # the stats are held in contiguous array columns with the key of
+    # (name, scope) mapping to the slot in those columns. The columns
+    # follow the same layout as used for the list based stats objects,
+    # so for apdex metrics the count, total and exclusive columns hold
+    # the satisfying, tolerating and frustrating counts. The type of
+    # stats held in each slot is tracked so that the merge semantics of
+    # the original stats object can be applied.
+    #
+    # Lookups return a copy of the stats for the slot in the form of the
+    # list based stats object. Changes made to the returned object will
+    # not be reflected in the table. Where only a single value is needed
+    # it can be read directly from the columns without the copy.
+
+    def __init__(self):
+        self._index = {}
+        self._keys = []
+        self._kinds = array('b')
+        self._count = array('d')
+        self._total = array('d')
+        self._exclusive = array('d')
+        self._min = array('d')
+        self._max = array('d')
+        self._sum_of_squares = array('d')
+
+    def _columns(self):
+        return (self._count, self._total, self._exclusive, self._min,
+                self._max, self._sum_of_squares)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __getitem__(self, key):
+        return self._stats(self._index[key])
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        slot = self._index.get(key)
+        if slot is None:
+            return default
+        return self._stats(slot)
+
+    def call_count(self, key):
+        """Returns the call count of the metric with the given key, or
+        None if there is no such metric.
+
+        """
+
+        slot = self._index.get(key)
+        if slot is None:
+            return None
+        return int(self._count[slot])
+
+    def total_call_time(self, key):
+        """Returns the total call time of the metric with the given key,
+        or None if there is no such metric.
+
+        """
+
+        slot = self._index.get(key)
+        if slot is None:
+            return None
+        return self._total[slot]
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self._stats(slot) for slot in range(len(self._keys))]
+
+    def items(self):
+        return [(key, self._stats(slot))
+                for slot, key in enumerate(self._keys)]
+
+    iteritems = items
+
+    def _stats(self, slot):
+        # The columns hold floats, but counts are given as integers as
+        # they are by the list based stats objects.
+
+        kind = self._kinds[slot]
+        stats = _STATS_TYPES[kind]()
+
+        if kind == _APDEX_STATS:
+            stats[:] = [int(self._count[slot]), int(self._total[slot]),
+                    int(self._exclusive[slot]), self._min[slot],
+                    self._max[slot], self._sum_of_squares[slot]]
+        else:
+            stats[:] = [int(self._count[slot]), self._total[slot],
+                    self._exclusive[slot], self._min[slot], self._max[slot],
+                    self._sum_of_squares[slot]]
+
+        return stats
+
+    def _slot(self, key, kind, values):
+        # Allocates a slot for a key which has not been seen before,
+        # initialising the columns from the supplied values.
+
+        slot = len(self._keys)
+        self._index[key] = slot
+        self._keys.append(key)
+        self._kinds.append(kind)
+
+        for column, value in zip(self._columns(), values):
+            column.append(value)
+
+        return slot
+
+    def merge_raw_time_metric(self, key, duration, exclusive=None):
+        """Merge time value against the metric with the given key."""
+
+        if exclusive is None:
+            exclusive = duration
+
+        slot = self._index.get(key)
+
+        if slot is None:
+            self._slot(key, _TIME_STATS, (1, duration, exclusive, duration,
+                    duration, duration ** 2))
+            return
+
+        kind = self._kinds[slot]
+
+        if kind == _COUNT_STATS:
+            return
+
+        count = self._count
+        minimum = self._min
+
+        self._total[slot] += duration
+        self._exclusive[slot] += exclusive
+        minimum[slot] = count[slot] and min(minimum[slot],
+                duration) or duration
+        self._max[slot] = max(self._max[slot], duration)
+        self._sum_of_squares[slot] += duration ** 2
+
+        # Must update the call count last as update of the
+        # minimum call time is dependent on initial value.
+
+        count[slot] += 1
+
+    def merge_apdex_metric(self, key, metric):
+        """Merge data from an apdex metric object against the metric with
+        the given key.
+
+        """
+
+        slot = self._index.get(key)
+
+        if slot is None:
+            slot = self._slot(key, _APDEX_STATS, (0, 0, 0, metric.apdex_t,
+                    metric.apdex_t, 0))
+
+        self._merge_apdex(slot, metric.satisfying, metric.tolerating,
+                metric.frustrating, metric.apdex_t, metric.apdex_t)
+
+    def _merge_apdex(self, slot, satisfying, tolerating, frustrating,
+            apdex_t_min, apdex_t_max):
+        self._count[slot] += satisfying
+        self._total[slot] += tolerating
+        self._exclusive[slot] += frustrating
+
+        self._min[slot] = ((self._count[slot] or self._total[slot] or
+                self._exclusive[slot]) and min(self._min[slot],
+                apdex_t_min) or apdex_t_min)
+        self._max[slot] = max(self._max[slot], apdex_t_max)
+
+    def _merge_slot(self, slot, kind, count, total, exclusive, minimum,
+            maximum, sum_of_squares):
+        # Merges the values for a single metric into an existing slot
+        # applying the semantics of the type of stats held in the slot.
+
+        if kind == _COUNT_STATS:
+            self._count[slot] += count
+
+        elif kind == _APDEX_STATS:
+            # Note that the minimum apdex_t value of the incoming stats
+            # is used for both bounds, as is done by ApdexStats.
+
+            self._merge_apdex(slot, count, total, exclusive, minimum,
+                    minimum)
+
+        else:
+            self._total[slot] += total
+            self._exclusive[slot] += exclusive
+            self._min[slot] = (self._count[slot] and min(self._min[slot],
+                    minimum) or minimum)
+            self._max[slot] = max(self._max[slot], maximum)
+            self._sum_of_squares[slot] += sum_of_squares
+
+            # Must update the call count last as update of the
+            # minimum call time is dependent on initial value.
+
+            self._count[slot] += count
+
+    def merge_stats(self, key, stats):
+        """Merge data from a list based stats object against the metric
+        with the given key.
+
+        """
+
+        slot = self._index.get(key)
+
+        if slot is None:
+            self._slot(key, _stats_kind(stats), stats)
+        else:
+            self._merge_slot(slot, self._kinds[slot], *stats)
+
+    def merge_table(self, other):
+        """Merge all metrics from another table into this one."""
+
+        if not other._keys:
+            return
+
+        # Where this table is empty the columns of the other table can
+        # be adopted wholesale as a bulk copy of each column.
+
+        if not self._keys:
+            self._index = dict(other._index)
+            self._keys = list(other._keys)
+            self._kinds = array('b', other._kinds)
+            self._count = array('d', other._count)
+            self._total = array('d', other._total)
+            self._exclusive = array('d', other._exclusive)
+            self._min = array('d', other._min)
+            self._max = array('d', other._max)
+            self._sum_of_squares = array('d', other._sum_of_squares)
+            return
+
+        index = self._index
+        rows = six.moves.zip(other._keys, other._kinds, other._count,
+                other._total, other._exclusive, other._min, other._max,
+                other._sum_of_squares)
+
+        for (key, kind, count, total, exclusive, minimum, maximum,
+                sum_of_squares) in rows:
+            slot = index.get(key)
+
+            if slot is None:
+                self._slot(key, kind, (count, total, exclusive, minimum,
+                        maximum, sum_of_squares))
+            else:
+                self._merge_slot(slot, self._kinds[slot], count, total,
+                        exclusive, minimum, maximum, sum_of_squares)
+
+    def normalized(self, normalizer):
+        """Returns a new table where the metric names have been passed
+        through the normalizer, with the stats for any metrics whose names
+        collapse to the same name being merged.
+
+        """
+
+        table = MetricStatsTable()
+
+        for slot, (name, scope) in enumerate(self._keys):
+            key = (normalizer(name)[0], scope)
+            values = (self._count[slot], self._total[slot],
+                    self._exclusive[slot], self._min[slot], self._max[slot],
+                    self._sum_of_squares[slot])
+
+            target = table._index.get(key)
+
+            if target is None:
+                table._slot(key, self._kinds[slot], values)
+            else:
+                table._merge_slot(target, table._kinds[target], *values)
+
+        return table
+
+    def _weight(self, slot):
+        # The number of times a metric was recorded. For apdex metrics
+        # this is the total of the satisfying, tolerating and frustrating
+        # counts held in the count, total and exclusive columns.
+
+        if self._kinds[slot] == _APDEX_STATS:
+            return (self._count[slot] + self._total[slot] +
+                    self._exclusive[slot])
+        return self._count[slot]
+
+    def folded(self, maximum, rollup):
+        """Returns a new table retaining the stats of at most the maximum
+        number of metrics, being those recorded the most times, along with
+        a dictionary mapping the key of each rollup metric to the number
+        of metrics folded into it. The rollup callable is passed the key
+        and the kind of stats of each metric and returns the key of the
+        rollup metric to fold the stats into, or None if the metric must
+        always be retained. Stats are only folded into a rollup metric
+        holding the same kind of stats.
+
+        """
+
+        candidates = []
+        exempt = []
+
+        for slot, key in enumerate(self._keys):
+            target = rollup(key, self._kinds[slot])
+            if target is None:
+                exempt.append(slot)
+            else:
+                candidates.append((slot, target))
+
+        if len(candidates) <= maximum:
+            return self, {}
+
+        retained = set(slot for slot, _ in nlargest(maximum, candidates,
+                key=lambda candidate: self._weight(candidate[0])))
+
+        table = MetricStatsTable()
+        folded = {}
+
+        for slot in exempt:
+            table._slot(self._keys[slot], self._kinds[slot], (
+                    self._count[slot], self._total[slot],
+                    self._exclusive[slot], self._min[slot], self._max[slot],
+                    self._sum_of_squares[slot]))
+
+        for slot, target in candidates:
+            kind = self._kinds[slot]
+            values = (self._count[slot], self._total[slot],
+                    self._exclusive[slot], self._min[slot], self._max[slot],
+                    self._sum_of_squares[slot])
+
+            key = self._keys[slot]
+
+            if slot not in retained:
+                existing = table._index.get(target)
+
+                if existing is None or table._kinds[existing] == kind:
+                    key = target
+                    folded[target] = folded.get(target, 0) + 1
+
+            existing = table._index.get(key)
+
+            if existing is None:
+                table._slot(key, kind, values)
+            else:
+                table._merge_slot(existing, kind, *values)
+
+        return table, folded
+
+    def string_table(self):
+        """Returns the metrics in the table in a compact form, as a list
+        of the distinct metric names and scopes along with a list of rows
+        each holding the index of the name and scope of the metric in the
+        list of strings, followed by the stats for the metric. Stats which
+        are whole numbers are given as integers.
+
+        """
+
+        strings = ['']
+        index = {'': 0}
+        metrics = []
+
+        columns = self._columns()
+
+        for slot, key in enumerate(self._keys):
+            row = []
+
+            for string in key:
+                position = index.get(string)
+                if position is None:
+                    position = index[string] = len(strings)
+                    strings.append(string)
+                row.append(position)
+
+            for column in columns:
+                value = column[slot]
+                row.append(int(value) if value.is_integer() else value)
+
+            metrics.append(row)
+
+        return {'strings': strings, 'metrics': metrics}
+
+
+_FOLDED_METRIC_NAMES = {
+    _TIME_STATS: '%s/all-folded',
+    _COUNT_STATS: '%s/all-folded/count',
+    _APDEX_STATS: '%s/all-folded/apdex',
+}
+
+
+def _metric_rollup(key, kind):
+    # Metrics beyond the cardinality limit are folded into a rollup named
+    # after the first segment of the metric name, with a separate rollup
+    # for each kind of stats. Supportability metrics and the rollups
+    # themselves are never folded.
+
+    name, scope = key
+
+    if name.startswith('Supportability/') or '/all-folded' in name:
+        return None
+
+    return (_FOLDED_METRIC_NAMES[kind] % name.split('/', 1)[0], scope)
+
+
 class CustomMetrics(object):
 
     """Table for collection a set of value metrics.
@@ -219,6 +656,18 @@ class CustomMetrics(object):
 
         return six.iteritems(self.__stats_table)
 
+    def merge_metrics(self, metrics):
+        """Merges in an iterable of metric name and stats pairs, such as
+        is returned by the metrics() method of another instance.
+
+        """
+        for name, other in metrics:
+            stats = self.__stats_table.get(name)
+            if stats is None:
+                self.__stats_table[name] = copy.copy(other)
+            else:
+                stats.merge_stats(other)
+
     def reset_metric_stats(self):
         """Resets the accumulated statistics back to initial state for
         metric data.
@@ -298,6 +747,24 @@ class SampledDataSet(object):
             'events_seen': self.num_seen
         }
 
+    @property
+    def min_priority(self):
+        """Returns the priority a sample must exceed to be retained, or
+        None if the data set is not yet full and any sample would be kept.
+
+        """
+
+        if self.capacity <= 0:
+            return float('inf')
+
+        # May be called without holding the lock for the stats engine,
+        # so the queue is only read once, as it is replaced on reset.
+
+        pq = self.pq
+
+        if self.heap and pq:
+            return pq[0][0]
+
     def __iter__(self):
         return self.samples
 
@@ -325,25 +792,112 @@ class SampledDataSet(object):
             priority = random.random()
 
         entry = (priority, self.num_seen, sample)
-        if self.num_seen == self.capacity:
-            self.pq.append(entry)
-            self.heap = self.heap or heapify(self.pq) or True
-        elif not self.heap:
+        if not self.heap:
             self.pq.append(entry)
+            if len(self.pq) >= self.capacity:
+                heapify(self.pq)
+                self.heap = True
         else:
             sampled = self.should_sample(priority)
             if not sampled:
                 return
             heapreplace(self.pq, entry)
 
+    def add_many(self, samples, priorities=None):
+        """Adds a batch of samples to the data set. The priorities are
+        consumed in step with the samples and any sample without a priority
+        is given a random one. Selection of the samples to be retained is
+        done in a single pass over the batch rather than one heap operation
+        per sample.
+
+        """
+
+        if priorities is None:
+            priorities = itertools.repeat(None)
+
+        seen = self.num_seen
+        entries = []
+
+        for sample, priority in six.moves.zip(samples, priorities):
+            seen += 1
+            if priority is None:
+                priority = random.random()
+            entries.append((priority, seen, sample))
+
+        self.num_seen = seen
+        self._select(entries)
+
+    def add_unsampled(self, count):
+        """Counts samples which were seen but were never added because
+        their priority could not have been retained.
+
+        """
+
+        self.num_seen += count
+
+    def retain(self, samples, num_seen):
+        """Discards all but the given samples, such as where only some of
+        the samples could be sent, with num_seen being the count of samples
+        seen for which the retained samples stand in.
+
+        """
+
+        retained = set(map(id, samples))
+
+        self.pq = [entry for entry in self.pq if id(entry[-1]) in retained]
+        self.heap = len(self.pq) >= self.capacity
+        self.num_seen = num_seen
+
+        if self.heap:
+            heapify(self.pq)
+
     def merge(self, other_data_set):
+        # The samples of other_data_set are renumbered so that the sequence
+        # numbers in the queue remain unique and samples are never compared
+        # with each other when priorities are equal.
+
+        seen = self.num_seen
+        entries = []
+
         for priority, seen_at, sample in other_data_set.pq:
-            self.add(sample, priority)
+            seen += 1
+            entries.append((priority, seen, sample))
 
-        # Merge the num_seen from the other_data_set, but take care not to
-        # double-count the actual samples of other_data_set since the .add
-        # call above will add one to self.num_seen each time
-        self.num_seen += other_data_set.num_seen - other_data_set.num_samples
+        self.num_seen += other_data_set.num_seen
+        self._select(entries)
+
+    def _select(self, entries):
+        if self.capacity <= 0 or not entries:
+            return
+
+        if self.heap:
+            # Anything at or below the lowest priority sample in a full
+            # queue would be rejected anyway, so discard it up front.
+
+            threshold = self.pq[0][0]
+            entries = [entry for entry in entries if entry[0] > threshold]
+
+            # When only a handful of samples survive it is cheaper to swap
+            # them into the heap individually than to reselect.
+
+            if len(entries) * 8 <= self.capacity:
+                for entry in entries:
+                    if entry[0] > self.pq[0][0]:
+                        heapreplace(self.pq, entry)
+                return
+
+        self.pq.extend(entries)
+
+        if len(self.pq) > self.capacity:
+            # The sort is stable, so samples already held win any ties
+            # in priority against the newly added samples.
+
+            self.pq.sort(key=operator.itemgetter(0), reverse=True)
+            del self.pq[self.capacity:]
+
+        if len(self.pq) >= self.capacity:
+            heapify(self.pq)
+            self.heap = True
 
 
 class LimitedDataSet(list):
@@ -386,6 +940,12 @@ class LimitedDataSet(list):
             self.append(sample)
         self.num_seen += 1
 
+    def retain(self, samples, num_seen):
+        retained = set(map(id, samples))
+
+        self[:] = [sample for sample in self if id(sample) in retained]
+        self.num_seen = num_seen
+
     def merge(self, other_data_set):
         for sample in other_data_set:
             self.add(sample)
@@ -426,7 +986,7 @@ class StatsEngine(object):
 
     def __init__(self):
         self.__settings = None
-        self.__stats_table = {}
+        self.__stats_table = MetricStatsTable()
         self._transaction_events = SampledDataSet()
         self._error_events = SampledDataSet()
         self._custom_events = SampledDataSet()
@@ -440,6 +1000,7 @@ class StatsEngine(object):
         self.__transaction_errors = []
         self._synthetics_events = LimitedDataSet()
         self.__synthetics_transactions = []
+        self._harvest_scales = {}
 
     @property
     def settings(self):
@@ -461,6 +1022,16 @@ class StatsEngine(object):
     def span_events(self):
         return self._span_events
 
+    @property
+    def span_event_priority_floor(self):
+        """Returns the priority a transaction must exceed for its span
+        events to be retained, or None if the span event reservoir still
+        has room.
+
+        """
+
+        return self._span_events.min_priority
+
     @property
     def span_stream(self):
         return self._span_stream
@@ -485,6 +1056,45 @@ class StatsEngine(object):
 
         return len(self.__stats_table)
 
+    def _limited_metrics(self, maximum):
+        """Returns the stats table with all but the maximum number of
+        metrics recorded the most times folded into rollup metrics, along
+        with supportability metrics for the number of metrics folded.
+        Where no metrics need to be folded the stats table is returned.
+
+        """
+
+        table, folded = self.__stats_table.folded(maximum, _metric_rollup)
+
+        if not folded:
+            return table
+
+        table.merge_stats(('Supportability/Python/MetricCardinality/'
+                'Folded', ''), CountStats(call_count=sum(
+                six.itervalues(folded))))
+
+        for (name, _), count in six.iteritems(folded):
+            table.merge_stats(('Supportability/Python/MetricCardinality/'
+                    'Folded/%s' % name, ''), CountStats(call_count=count))
+
+        return table
+
+    def _check_metrics_count(self):
+        # Keeping exact stats only for the heaviest metrics requires that
+        # the stats for other metrics are accumulated for a while before
+        # choosing which to fold, so the table is allowed to grow to twice
+        # the limit before it is cut back down to the limit.
+
+        settings = self.__settings
+
+        if settings is None:
+            return
+
+        maximum = settings.agent_limits.max_metric_names
+
+        if maximum and len(self.__stats_table) > 2 * maximum:
+            self.__stats_table = self._limited_metrics(maximum)
+
     def record_apdex_metric(self, metric):
         """Record a single apdex metric, merging the data with any data
         from prior apdex metrics with the same name.
@@ -501,11 +1111,7 @@ class StatsEngine(object):
         # as an empty string anyway.
 
         key = (metric.name, '')
-        stats = self.__stats_table.get(key)
-        if stats is None:
-            stats = ApdexStats(apdex_t=metric.apdex_t)
-            self.__stats_table[key] = stats
-        stats.merge_apdex_metric(metric)
+        self.__stats_table.merge_apdex_metric(key, metric)
 
         return key
 
@@ -522,6 +1128,8 @@ class StatsEngine(object):
         for metric in metrics:
             self.record_apdex_metric(metric)
 
+        self._check_metrics_count()
+
     def record_time_metric(self, metric):
         """Record a single time metric, merging the data with any data
         from prior time metrics with the same name and scope.
@@ -535,17 +1143,12 @@ class StatsEngine(object):
         # scope of None is reserved for apdex metrics.
 
         key = (metric.name, metric.scope or '')
-        stats = self.__stats_table.get(key)
-        if stats is None:
-            stats = TimeStats(call_count=1,
-                    total_call_time=metric.duration,
-                    total_exclusive_call_time=metric.exclusive,
-                    min_call_time=metric.duration,
-                    max_call_time=metric.duration,
-                    sum_of_squares=metric.duration ** 2)
-            self.__stats_table[key] = stats
+
+        if type(metric) is TimeStatsMetric:
+            self.__stats_table.merge_stats(key, metric.stats)
         else:
-            stats.merge_time_metric(metric)
+            self.__stats_table.merge_raw_time_metric(key, metric.duration,
+                    metric.exclusive)
 
         return key
 
@@ -562,6 +1165,8 @@ class StatsEngine(object):
         for metric in metrics:
             self.record_time_metric(metric)
 
+        self._check_metrics_count()
+
     def record_exception(self, exc=None, value=None, tb=None, params={},
             ignore_errors=[]):
 
@@ -769,11 +1374,9 @@ class StatsEngine(object):
         else:
             new_stats = TimeStats(1, value, value, value, value, value**2)
 
-        stats = self.__stats_table.get(key)
-        if stats is None:
-            self.__stats_table[key] = new_stats
-        else:
-            stats.merge_stats(new_stats)
+        self.__stats_table.merge_stats(key, new_stats)
+
+        self._check_metrics_count()
 
         return key
 
@@ -872,12 +1475,16 @@ class StatsEngine(object):
         if len(self.__synthetics_transactions) < maximum:
             self.__synthetics_transactions.append(transaction)
 
-    def record_transaction(self, transaction):
+    def record_transaction(self, transaction, span_event_priority_floor=None):
         """Record any apdex and time metrics for the transaction as
         well as any errors which occurred for the transaction. If the
         transaction qualifies to become the slow transaction remember
         it for later.
 
+        The span_event_priority_floor is that of the stats engine this
+        work area will be merged into. Span events are not built if the
+        transaction priority is not above it.
+
         """
 
         if not self.__settings:
@@ -923,8 +1530,8 @@ class StatsEngine(object):
                 error_collector.enabled and
                 settings.collect_error_events):
             events = transaction.error_events(self.__stats_table)
-            for event in events:
-                self._error_events.add(event, priority=transaction.priority)
+            self._error_events.add_many(events,
+                    itertools.repeat(transaction.priority))
 
         # Capture any sql traces if transaction tracer enabled.
 
@@ -985,8 +1592,18 @@ class StatsEngine(object):
                 for event in transaction.span_protos(settings):
                     self._span_stream.put(event)
             elif transaction.sampled:
-                for event in transaction.span_events(self.__settings):
-                    self._span_events.add(event, priority=transaction.priority)
+                # Building span events is expensive, so where the parent
+                # stats engine reservoir is already full of higher priority
+                # events skip building them and only count them as seen.
+
+                if (span_event_priority_floor is not None and
+                        transaction.priority <= span_event_priority_floor):
+                    self._span_events.add_unsampled(
+                            transaction.span_event_count())
+                else:
+                    self._span_events.add_many(
+                            transaction.span_events(self.__settings),
+                            itertools.repeat(transaction.priority))
 
     def metric_data(self, normalizer=None):
         """Returns a list containing the low level metric data for
@@ -1004,8 +1621,31 @@ class StatsEngine(object):
             return []
 
         result = []
-        normalized_stats = {}
 
+        normalized_stats = self._normalized_stats_table(normalizer)
+
+        for key, value in normalized_stats.items():
+            key = dict(name=key[0], scope=key[1])
+            result.append((key, value))
+
+        return result
+
+    def metric_data_string_table(self, normalizer=None):
+        """Returns a dictionary containing the metric data in the compact
+        form returned by the string table method of the metric stats
+        table, where the metric names and scopes are sent once each in a
+        string table, with each metric referring to them by index. Used
+        in place of metric_data() where the metric_data_format setting is
+        string_table.
+
+        """
+
+        if not self.__settings:
+            return MetricStatsTable().string_table()
+
+        return self._normalized_stats_table(normalizer).string_table()
+
+    def _normalized_stats_table(self, normalizer):
         # Metric Renaming and Re-Aggregation. After applying the metric
         # renaming rules, the metrics are re-aggregated to collapse the
         # metrics with same names after the renaming.
@@ -1013,29 +1653,29 @@ class StatsEngine(object):
         if self.__settings.debug.log_raw_metric_data:
             _logger.info('Raw metric data for harvest of %r is %r.',
                     self.__settings.app_name,
-                    list(six.iteritems(self.__stats_table)))
+                    self.__stats_table.items())
+
+        # Only the metrics recorded the most times are reported, with the
+        # remainder being folded into rollup metrics.
+
+        stats_table = self.__stats_table
+
+        maximum = self.__settings.agent_limits.max_metric_names
+
+        if maximum and len(stats_table) > maximum:
+            stats_table = self._limited_metrics(maximum)
 
         if normalizer is not None:
-            for key, value in six.iteritems(self.__stats_table):
-                key = (normalizer(key[0])[0], key[1])
-                stats = normalized_stats.get(key)
-                if stats is None:
-                    normalized_stats[key] = copy.copy(value)
-                else:
-                    stats.merge_stats(value)
+            normalized_stats = stats_table.normalized(normalizer)
         else:
-            normalized_stats = self.__stats_table
+            normalized_stats = stats_table
 
         if self.__settings.debug.log_normalized_metric_data:
             _logger.info('Normalized metric data for harvest of %r is %r.',
                     self.__settings.app_name,
-                    list(six.iteritems(normalized_stats)))
+                    normalized_stats.items())
 
-        for key, value in six.iteritems(normalized_stats):
-            key = dict(name=key[0], scope=key[1])
-            result.append((key, value))
-
-        return result
+        return normalized_stats
 
     def metric_data_count(self):
         """Returns a count of the number of unique metrics.
@@ -1324,7 +1964,7 @@ class StatsEngine(object):
         """
 
         self.__settings = settings
-        self.__stats_table = {}
+        self.__stats_table = MetricStatsTable()
         self.__sql_stats_table = {}
         self.__slow_transaction = None
         self.__slow_transaction_map = {}
@@ -1348,7 +1988,44 @@ class StatsEngine(object):
 
         """
 
-        self.__stats_table = {}
+        self.__stats_table = MetricStatsTable()
+
+    def harvest_limit(self, nr_method):
+        """Returns the reservoir size for the event data type, being the
+        harvest limit from the settings scaled by any factor set with
+        set_harvest_scale().
+
+        """
+
+        limit = getattr(self.__settings.event_harvest_config.harvest_limits,
+                nr_method)
+        scale = self._harvest_scales.get(nr_method)
+
+        if scale is None or not limit:
+            return limit
+
+        return max(1, int(limit * scale))
+
+    def set_harvest_scale(self, nr_method, scale):
+        """Scales the reservoir size for the event data type. Used when
+        the data type is harvested more or less often than the reporting
+        period the harvest limits are given for. Takes effect when the
+        reservoir is next reset.
+
+        """
+
+        # The mapping is replaced rather than updated as it is shared
+        # with snapshots and work areas created from this stats engine.
+
+        scales = dict(self._harvest_scales)
+        scales[nr_method] = scale
+        self._harvest_scales = scales
+
+    def event_reservoir(self, nr_method):
+        """Returns the container holding the events of the data type."""
+
+        stats_method = EVENT_HARVEST_METHODS[nr_method][0]
+        return getattr(self, EVENT_CONTAINERS[stats_method])
 
     def reset_transaction_events(self):
         """Resets the accumulated statistics back to initial state for
@@ -1358,32 +2035,28 @@ class StatsEngine(object):
 
         if self.__settings is not None:
             self._transaction_events = SampledDataSet(
-                    self.__settings.event_harvest_config.
-                    harvest_limits.analytic_event_data)
+                    self.harvest_limit('analytic_event_data'))
         else:
             self._transaction_events = SampledDataSet()
 
     def reset_error_events(self):
         if self.__settings is not None:
             self._error_events = SampledDataSet(
-                    self.__settings.event_harvest_config.
-                    harvest_limits.error_event_data)
+                    self.harvest_limit('error_event_data'))
         else:
             self._error_events = SampledDataSet()
 
     def reset_custom_events(self):
         if self.__settings is not None:
             self._custom_events = SampledDataSet(
-                    self.__settings.event_harvest_config.
-                    harvest_limits.custom_event_data)
+                    self.harvest_limit('custom_event_data'))
         else:
             self._custom_events = SampledDataSet()
 
     def reset_span_events(self):
         if self.__settings is not None:
             self._span_events = SampledDataSet(
-                    self.__settings.event_harvest_config.
-                    harvest_limits.span_event_data)
+                    self.harvest_limit('span_event_data'))
         else:
             self._span_events = SampledDataSet()
 
@@ -1398,7 +2071,7 @@ class StatsEngine(object):
         else:
             self._synthetics_events = LimitedDataSet()
 
-    def reset_non_event_types(self):
+    def reset_non_event_types(self, standby=None):
         # The slow transaction map is retained but we need to
         # perform some housework on each harvest snapshot. What
         # we do is add the slow transaction to the map of
@@ -1432,12 +2105,19 @@ class StatsEngine(object):
                 self.__slow_transaction_old_duration = None
 
         self.__slow_transaction = None
-        self.__synthetics_transactions = []
-        self.__sql_stats_table = {}
-        self.__stats_table = {}
-        self.__transaction_errors = []
 
-    def harvest_snapshot(self, flexible=False):
+        if standby is None:
+            self.__synthetics_transactions = []
+            self.__sql_stats_table = {}
+            self.__stats_table = MetricStatsTable()
+            self.__transaction_errors = []
+        else:
+            self.__synthetics_transactions = standby.__synthetics_transactions
+            self.__sql_stats_table = standby.__sql_stats_table
+            self.__stats_table = standby.__stats_table
+            self.__transaction_errors = standby.__transaction_errors
+
+    def harvest_snapshot(self, flexible=False, standby=None, data_types=None):
         """Creates a snapshot of the accumulated statistics, error
         details and slow transaction and returns it. This is a shallow
         copy, only copying the top level objects. The originals are then
@@ -1447,7 +2127,25 @@ class StatsEngine(object):
         carry forward to subsequent runs. This method would be called
         to snapshot the data when doing the harvest.
 
+        If a standby stats engine is supplied, being an empty stats engine
+        created with the same settings, the containers reset on this stats
+        engine are taken from the standby rather than being created. This
+        allows the new containers to be created before any lock is held
+        while the snapshot is taken, so that only references are swapped
+        while holding the lock.
+
+        For a flexible harvest, data_types can restrict the snapshot to a
+        subset of the event data types in the whitelist, so that each data
+        type can be harvested on its own schedule.
+
         """
+        # A standby created before the settings or reservoir scales were
+        # last replaced would have containers sized for the old values.
+
+        if standby is not None and (standby.__settings is not self.__settings
+                or standby._harvest_scales is not self._harvest_scales):
+            standby = None
+
         snapshot = self._snapshot()
 
         # Data types only appear in one place, so during a snapshot it must be
@@ -1465,22 +2163,30 @@ class StatsEngine(object):
             snapshot.reset_non_event_types()
         else:
             whitelist_stats, other_stats = snapshot, self
-            self.reset_non_event_types()
+            self.reset_non_event_types(standby)
 
         event_harvest_whitelist = \
                 self.__settings.event_harvest_config.whitelist
 
+        if flexible and data_types is not None:
+            event_harvest_whitelist = \
+                    event_harvest_whitelist & frozenset(data_types)
+
         # Iterate through harvest types. If they are in the list of types to
         # harvest reset them on stats_engine otherwise remove them from the
         # snapshot.
         for nr_method, stats_methods in EVENT_HARVEST_METHODS.items():
             for stats_method in stats_methods:
                 if nr_method in event_harvest_whitelist:
-                    reset = getattr(whitelist_stats, stats_method)
+                    stats = whitelist_stats
                 else:
-                    reset = getattr(other_stats, stats_method)
+                    stats = other_stats
 
-                reset()
+                if stats is self and standby is not None:
+                    container = EVENT_CONTAINERS[stats_method]
+                    setattr(self, container, getattr(standby, container))
+                else:
+                    getattr(stats, stats_method)()
 
         return snapshot
 
@@ -1496,6 +2202,20 @@ class StatsEngine(object):
 
         return stats
 
+    def create_standby(self):
+        """Creates and returns a new empty stats engine object with the
+        same settings, for use as the standby passed to harvest_snapshot().
+        This does not copy this stats engine, so can be called without
+        holding the lock used to protect it.
+
+        """
+
+        stats = StatsEngine()
+        stats._harvest_scales = self._harvest_scales
+        stats.reset_stats(self.__settings)
+
+        return stats
+
     def merge(self, snapshot):
         """Merges data from a single transaction. Snapshot is an instance of
         StatsEngine that contains stats for the single transaction.
@@ -1514,6 +2234,25 @@ class StatsEngine(object):
         self._merge_sql(snapshot)
         self._merge_traces(snapshot)
 
+    def merge_shard(self, shard):
+        """Merges data from a stats engine shard. Unlike merge(), the shard
+        is an instance of StatsEngine which may contain stats for many
+        transactions, so all sampled transaction events are merged.
+        """
+
+        if not self.__settings:
+            return
+
+        self.merge_metric_stats(shard)
+        self._merge_transaction_events(shard, rollback=True)
+        self._merge_synthetics_events(shard)
+        self._merge_error_events(shard)
+        self._merge_error_traces(shard)
+        self._merge_custom_events(shard)
+        self._merge_span_events(shard)
+        self._merge_sql(shard)
+        self._merge_traces(shard)
+
     def rollback(self, snapshot):
         """Performs a "rollback" merge after a failed harvest. Snapshot is a
         copy of the main StatsEngine data that we attempted to harvest, but
@@ -1544,12 +2283,9 @@ class StatsEngine(object):
         if not self.__settings:
             return
 
-        for key, other in six.iteritems(snapshot.__stats_table):
-            stats = self.__stats_table.get(key)
-            if not stats:
-                self.__stats_table[key] = other
-            else:
-                stats.merge_stats(other)
+        self.__stats_table.merge_table(snapshot.__stats_table)
+
+        self._check_metrics_count()
 
     def _merge_transaction_events(self, snapshot, rollback=False):
 
@@ -1663,12 +2399,9 @@ class StatsEngine(object):
             return
 
         for name, other in metrics:
-            key = (name, '')
-            stats = self.__stats_table.get(key)
-            if not stats:
-                self.__stats_table[key] = other
-            else:
-                stats.merge_stats(other)
+            self.__stats_table.merge_stats((name, ''), other)
+
+        self._check_metrics_count()
 
     def _snapshot(self):
         copy = object.__new__(StatsEngineSnapshot)
@@ -14,6 +14,17 @@
 
 """This module implements a global cache for tracking any traces.
 
+Two implementations of the cache are provided. The default keeps the
+current trace for each thread, greenlet or asyncio task in a dictionary
+keyed by the identifier of the thread, greenlet or task, which must be
+worked out on every lookup. On Python 3.7 and later, the current trace can
+instead be kept in a context variable, being looked up directly and being
+propagated to new asyncio tasks as part of their context. The traces are
+still also kept against the thread identifier, for use by the thread
+profiler and where the active traces must be enumerated. The cache used
+is selected by the trace_cache.backend setting when the agent is
+initialized.
+
 """
 
 import sys
@@ -28,6 +39,11 @@ try:
 except ImportError:
     import _thread as thread
 
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
 from newrelic.core.config import global_settings
 from newrelic.core.loop_node import LoopNode
 
@@ -209,8 +225,7 @@ class TraceCache(object):
         """Updates the cache state so that a new root can be created if the
         trace in the cache is from a different task (for asyncio). Returns the
         current trace after the cache is updated."""
-        thread_id = self.current_thread_id()
-        trace = self._cache.get(thread_id)
+        trace = self.current_trace()
         if not trace:
             return None
 
@@ -219,15 +234,35 @@ class TraceCache(object):
 
         task = current_task(self.asyncio)
         if task is not None and id(trace._task) != id(task):
-            self._cache.pop(thread_id, None)
+            self._drop_current()
             return None
 
         if trace.root and trace.root.exited:
-            self._cache.pop(thread_id, None)
+            self._drop_current()
             return None
 
         return trace
 
+    def _drop_current(self):
+        self._cache.pop(self.current_thread_id(), None)
+
+    def get_trace(self, thread_id):
+        """Returns the trace saved away under the specified thread ID."""
+
+        return self._cache.get(thread_id)
+
+    def set_trace(self, thread_id, trace):
+        """Makes the specified trace the current trace for the thread ID,
+        which must be that of the current executing thread. Where the trace
+        is None, any trace saved away under the thread ID is dropped.
+
+        """
+
+        if trace is None:
+            self._cache.pop(thread_id, None)
+        else:
+            self._cache[thread_id] = trace
+
     def save_trace(self, trace):
         """Saves the specified trace away under the thread ID of
         the current executing thread. Will also cache a reference to the
@@ -273,6 +308,17 @@ class TraceCache(object):
                     task = current_task(self.asyncio)
                     trace._task = task
 
+    def push_trace(self, trace):
+        """Saves the specified trace away under the thread ID of the
+        current executing thread, without the validation and tracking of
+        greenlets and tasks done by save_trace(). This is only used for
+        terminal traces aggregated once the segment budget of a
+        transaction is exceeded, which have no children of their own.
+
+        """
+
+        self._cache[trace.thread_id] = trace
+
     def thread_start(self, trace):
         current_thread_id = self.current_thread_id()
         if current_thread_id not in self._cache:
@@ -407,6 +453,102 @@ class TraceCache(object):
             root.add_child(node)
 
 
+class ContextTraceCache(TraceCache):
+    """Trace cache which keeps the current trace in a context variable,
+    so that it can be looked up without working out the identifier of
+    the current thread, greenlet or task.
+
+    Traces are still also saved away under the thread ID, so that the
+    active traces can be enumerated. Where a trace is completed from a
+    different context to that in which it was saved, such as where the
+    last of its children running in another task completes it, only the
+    traces saved away under the thread ID are updated. As the trace in
+    the context variable will then have exited, it is ignored in favour
+    of that saved away under the thread ID when looked up.
+
+    """
+
+    def __init__(self):
+        super(ContextTraceCache, self).__init__()
+        self._context = contextvars.ContextVar("newrelic_trace", default=None)
+
+    def current_trace(self):
+        ref = self._context.get()
+        if ref is None:
+            return None
+
+        trace = ref()
+        if trace is not None and not trace.exited:
+            return trace
+
+        return self._cache.get(self.current_thread_id())
+
+    def current_transaction(self):
+        trace = self.current_trace()
+        return trace and trace.transaction
+
+    def _set_context(self, trace):
+        return self._context.set(None if trace is None else weakref.ref(trace))
+
+    def _restore_context(self, trace, previous):
+        token = getattr(trace, "_context_token", None)
+        if token is None:
+            return
+
+        trace._context_token = None
+
+        # Resetting the context variable fails where the trace is being
+        # completed from a context other than the one it was saved in,
+        # in which case that context must be left as is.
+
+        try:
+            self._context.reset(token)
+        except (ValueError, RuntimeError):
+            return
+
+        self._set_context(previous)
+
+    def save_trace(self, trace):
+        super(ContextTraceCache, self).save_trace(trace)
+        trace._context_token = self._set_context(trace)
+
+    def push_trace(self, trace):
+        super(ContextTraceCache, self).push_trace(trace)
+        trace._context_token = self._set_context(trace)
+
+    def pop_current(self, trace):
+        super(ContextTraceCache, self).pop_current(trace)
+        self._restore_context(trace, trace.parent)
+
+    def complete_root(self, root):
+        super(ContextTraceCache, self).complete_root(root)
+        self._restore_context(root, None)
+
+    def thread_start(self, trace):
+        thread_id = super(ContextTraceCache, self).thread_start(trace)
+        if thread_id:
+            self._set_context(trace)
+        return thread_id
+
+    def thread_stop(self, thread_id):
+        super(ContextTraceCache, self).thread_stop(thread_id)
+        if thread_id:
+            self._set_context(None)
+
+    def set_trace(self, thread_id, trace):
+        super(ContextTraceCache, self).set_trace(thread_id, trace)
+        self._set_context(trace)
+
+    def _drop_current(self):
+        super(ContextTraceCache, self)._drop_current()
+        self._set_context(None)
+
+
+TRACE_CACHE_BACKENDS = {
+    "thread": TraceCache,
+    "contextvars": ContextTraceCache,
+}
+
 _trace_cache = TraceCache()
 
 
@@ -414,9 +556,52 @@ def trace_cache():
     return _trace_cache
 
 
+def configure_trace_cache(backend):
+    """Replaces the trace cache with one of the named backend. This can
+    only be done before any traces have been saved in the cache. Returns
+    whether the backend is now in use.
+
+    """
+
+    global _trace_cache
+
+    cache_type = TRACE_CACHE_BACKENDS.get(backend)
+
+    if cache_type is None:
+        _logger.warning("Unknown trace cache backend %r. The trace cache "
+                "backend must be one of %s.", backend,
+                ", ".join(sorted(TRACE_CACHE_BACKENDS)))
+        return False
+
+    if type(_trace_cache) is cache_type:
+        return True
+
+    if cache_type is ContextTraceCache and contextvars is None:
+        _logger.warning("The contextvars trace cache backend requires "
+                "Python 3.7 or later. The thread trace cache backend will "
+                "be used instead.")
+        return False
+
+    if len(_trace_cache._cache):
+        _logger.warning("The trace cache backend cannot be changed once "
+                "traces have been recorded. The %r trace cache backend "
+                "will not be used.", backend)
+        return False
+
+    _trace_cache = cache_type()
+
+    return True
+
+
 def greenlet_loaded(module):
     _trace_cache.greenlet = module
 
+    if (isinstance(_trace_cache, ContextTraceCache) and
+            not hasattr(module.getcurrent(), "gr_context")):
+        _logger.warning("The contextvars trace cache backend requires "
+                "greenlet 0.4.17 or later for each greenlet to have its own "
+                "context. Traces may be attributed to the wrong greenlet.")
+
 
 def asyncio_loaded(module):
     _trace_cache.asyncio = module
@@ -548,8 +548,8 @@ class TransactionNode(_TransactionNode):
         def _add_call_time(source, target):
             # include time for keys previously added to stats table via
             # stats_engine.record_transaction
-            if (source, '') in stats_table:
-                call_time = stats_table[(source, '')].total_call_time
+            call_time = stats_table.total_call_time((source, ''))
+            if call_time is not None:
                 if target in intrinsics:
                     intrinsics[target] += call_time
                 else:
@@ -558,8 +558,8 @@ class TransactionNode(_TransactionNode):
         def _add_call_count(source, target):
             # include counts for keys previously added to stats table via
             # stats_engine.record_transaction
-            if (source, '') in stats_table:
-                call_count = stats_table[(source, '')].call_count
+            call_count = stats_table.call_count((source, ''))
+            if call_count is not None:
                 if target in intrinsics:
                     intrinsics[target] += call_count
                 else:
@@ -605,3 +605,6 @@ class TransactionNode(_TransactionNode):
             attr_class=attr_class,
         ):
             yield event
+
+    def span_event_count(self):
+        return self.root.span_event_count()
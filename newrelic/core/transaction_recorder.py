@@ -0,0 +1,181 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the background recording of finished transactions
+for an application. Rather than converting a transaction into metrics and
+events in the thread which ran the transaction, the transaction is placed
+on a bounded queue which is drained by a dedicated recorder thread.
+
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# What to do with a finished transaction when the queue is full. With the
+# 'drop' policy the transaction is discarded and counted as dropped. With
+# the 'block' policy the thread which ran the transaction waits until the
+# recorder thread has made room in the queue.
+
+OVERFLOW_POLICIES = ('drop', 'block')
+
+
+class TransactionRecorder(object):
+
+    def __init__(self, name, record, maxsize, overflow_policy='drop'):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            _logger.warning('Unknown transaction recorder overflow policy '
+                    '%r. Falling back to the drop policy.', overflow_policy)
+            overflow_policy = 'drop'
+
+        self._record = record
+        self._maxsize = max(1, maxsize)
+        self._overflow_policy = overflow_policy
+
+        self._queue = collections.deque()
+        self._notify = threading.Condition()
+        self._recording = False
+        self._shutdown = False
+
+        self._max_depth = 0
+        self._dropped = 0
+
+        self._process_id = os.getpid()
+
+        self._thread = threading.Thread(target=self._run,
+                name='NR-Transaction-Recorder/%s' % name)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    @property
+    def active(self):
+        return (not self._shutdown and self._process_id == os.getpid() and
+                self._thread.is_alive())
+
+    def put(self, data):
+        """Queues a finished transaction for recording. Returns False if
+        the transaction was dropped.
+
+        """
+
+        with self._notify:
+            while (len(self._queue) >= self._maxsize and
+                    self._overflow_policy == 'block' and
+                    not self._shutdown):
+                self._notify.wait()
+
+            if self._shutdown:
+                return False
+
+            if len(self._queue) >= self._maxsize:
+                self._dropped += 1
+                return False
+
+            self._queue.append(data)
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._notify.notify_all()
+
+        return True
+
+    def flush(self, timeout=None):
+        """Waits until all queued transactions have been recorded. Returns
+        False if the timeout expired before the queue was drained.
+
+        """
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self._notify:
+            while self._queue or self._recording:
+                if not self._thread.is_alive():
+                    return False
+
+                if timeout is None:
+                    self._notify.wait()
+                    continue
+
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    return False
+
+                self._notify.wait(remaining)
+
+        return True
+
+    def stats(self):
+        """Returns the maximum depth of the queue and the number of dropped
+        transactions since stats were last retrieved.
+
+        """
+
+        with self._notify:
+            max_depth, dropped = self._max_depth, self._dropped
+            self._max_depth, self._dropped = len(self._queue), 0
+
+        return max_depth, dropped
+
+    def shutdown(self, timeout=None):
+        """Stops the recorder thread once the queued transactions have
+        been recorded. Where the timeout expires first, any transactions
+        still queued are discarded and counted as dropped.
+
+        """
+
+        self.flush(timeout)
+
+        with self._notify:
+            self._shutdown = True
+            self._dropped += len(self._queue)
+            self._queue.clear()
+            self._notify.notify_all()
+
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._notify:
+                while not self._queue and not self._shutdown:
+                    self._notify.wait()
+
+                if not self._queue:
+                    return
+
+                data = self._queue.popleft()
+                self._recording = True
+
+                # Wake any thread blocked waiting for room in the queue.
+
+                self._notify.notify_all()
+
+            try:
+                self._record(data)
+
+            except Exception:
+                _logger.exception('The recording of transaction data in '
+                        'the background has failed. This would indicate '
+                        'some sort of internal implementation issue with '
+                        'the agent. Please report this problem to New '
+                        'Relic support for further investigation.')
+
+            finally:
+                with self._notify:
+                    self._recording = False
+                    self._notify.notify_all()
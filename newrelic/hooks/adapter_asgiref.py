@@ -9,20 +9,20 @@ def _bind_thread_handler(loop, source_task, *args, **kwargs):
 class ContextOf(object):
     def __init__(self, trace_cache_id):
         self.trace_cache = trace_cache()
-        self.trace = self.trace_cache._cache.get(trace_cache_id)
+        self.trace = self.trace_cache.get_trace(trace_cache_id)
         self.thread_id = None
         self.restore = None
 
     def __enter__(self):
         if self.trace:
             self.thread_id = self.trace_cache.current_thread_id()
-            self.restore = self.trace_cache._cache.get(self.thread_id)
-            self.trace_cache._cache[self.thread_id] = self.trace
+            self.restore = self.trace_cache.get_trace(self.thread_id)
+            self.trace_cache.set_trace(self.thread_id, self.trace)
         return self
 
     def __exit__(self, exc, value, tb):
         if self.restore:
-            self.trace_cache._cache[self.thread_id] = self.restore
+            self.trace_cache.set_trace(self.thread_id, self.restore)
 
 
 async def context_wrapper_async(awaitable, trace_cache_id):
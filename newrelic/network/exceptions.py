@@ -23,4 +23,18 @@ class NetworkInterfaceException(Exception): pass
 class ForceAgentRestart(NetworkInterfaceException): pass
 class ForceAgentDisconnect(NetworkInterfaceException): pass
 class DiscardDataForRequest(NetworkInterfaceException): pass
-class RetryDataForRequest(NetworkInterfaceException): pass
+
+
+class RetryDataForRequest(NetworkInterfaceException):
+    """The request should be retried later. Where the data collector gave
+    a hint as to when to retry, retry_after is the number of seconds it
+    asked the agent to wait.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.retry_after = kwargs.pop('retry_after', None)
+        super(RetryDataForRequest, self).__init__(*args, **kwargs)
+
+
+class PayloadTooLarge(DiscardDataForRequest): pass
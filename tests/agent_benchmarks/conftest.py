@@ -0,0 +1,201 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import platform
+import time
+import timeit
+
+import pytest
+
+import newrelic.packages.six as six
+from newrelic import version
+from newrelic.api.application import register_application
+from newrelic.core.agent import agent_instance, shutdown_agent
+from newrelic.core.config import global_settings
+
+from testing_support.fixtures import initialize_agent
+from testing_support.mock_collector import MockCollector
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+if six.PY2:
+    collect_ignore = ['test_harvest_overhead_asgi.py',
+            'test_trace_cache_asyncio.py']
+
+_results = []
+_measurements = []
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark-json', action='store', default=None,
+            help='Save the benchmark results as JSON to the given path, '
+            'for comparison with the results of a prior run.')
+
+
+@pytest.fixture
+def benchmark(request):
+    """Returns a function which times a callable and records the best time
+    per operation out of a number of repeats. The recorded results are
+    reported at the end of the test session.
+
+    """
+
+    def _benchmark(func, operations=1, number=10, repeat=5, name=None):
+        timings = timeit.repeat(func, number=number, repeat=repeat)
+        per_operation = min(timings) / number / operations
+
+        _results.append((name or request.node.name, per_operation))
+
+        return per_operation
+
+    return _benchmark
+
+
+@pytest.fixture
+def measurement(request):
+    """Returns a function which records named measurements other than
+    timings, such as payload sizes, to be reported along with the timings
+    at the end of the test session.
+
+    """
+
+    def _measurement(name=None, **values):
+        _measurements.append((name or request.node.name, values))
+
+    return _measurement
+
+
+@pytest.fixture(scope='session')
+def collector():
+    with MockCollector() as collector:
+        yield collector
+
+
+@pytest.fixture(scope='session')
+def collector_application(collector):
+    """Registers the agent with the local stand in for the data collector
+    and returns the internal application object. The harvest thread is
+    disabled so that harvests only occur when explicitly requested.
+
+    """
+
+    initialize_agent(app_name='Python Agent Benchmark', default_settings={
+        'developer_mode': False,
+        'license_key': 'BENCHMARKLICENSEKEY',
+        'host': 'localhost',
+        'port': collector.port,
+        'debug.disable_certificate_validation': True,
+        'utilization.detect_aws': False,
+        'utilization.detect_azure': False,
+        'utilization.detect_docker': False,
+        'utilization.detect_gcp': False,
+        'utilization.detect_kubernetes': False,
+        'utilization.detect_pcf': False,
+        'distributed_tracing.enabled': True,
+
+        # Sample every transaction, so that the cost of recording and
+        # reporting span events is always included.
+
+        'sampling_target': 1000000,
+    })
+
+    register_application(timeout=10.0)
+
+    application = agent_instance().application(global_settings().app_name)
+
+    assert application.active
+
+    yield application
+
+    shutdown_agent()
+
+
+def _harvest(application):
+    application.harvest(flexible=True)
+    application.harvest()
+
+
+@pytest.fixture
+def harvest_overhead(collector, collector_application, measurement):
+    """Returns a function which runs a workload against an application
+    reporting to the local stand in for the data collector, followed by a
+    harvest. The duration of the harvest, the memory peak over the workload
+    and harvest, and the size of the payloads sent to each endpoint are
+    recorded as measurements. The statistics of the collector for the
+    harvest are returned.
+
+    """
+
+    def _harvest_overhead(workload, name=None):
+        _harvest(collector_application)
+        collector.reset()
+
+        if tracemalloc:
+            tracemalloc.start()
+
+        workload()
+
+        start = time.time()
+        _harvest(collector_application)
+        duration = time.time() - start
+
+        if tracemalloc:
+            memory_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            memory_peak = None
+
+        stats = collector.stats()
+
+        measurement(name, duration_ms=round(duration * 1e3, 3),
+                memory_peak_bytes=memory_peak,
+                payload_bytes=dict((method, values['bytes'])
+                        for method, values in stats.items()))
+
+        return stats
+
+    return _harvest_overhead
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _results and not _measurements:
+        return
+
+    terminalreporter.section('benchmarks')
+
+    for name, per_operation in _results:
+        terminalreporter.write_line('%-60s %10.3f usec/op' % (
+                name, per_operation * 1e6))
+
+    for name, values in _measurements:
+        terminalreporter.write_line('%-60s %s' % (name, ', '.join(
+                '%s=%s' % item for item in sorted(values.items()))))
+
+    path = terminalreporter.config.getoption('benchmark_json')
+
+    if path:
+        with open(path, 'w') as fp:
+            json.dump({
+                'agent_version': version,
+                'python_version': platform.python_version(),
+                'benchmarks': dict((name, per_operation)
+                        for name, per_operation in _results),
+                'measurements': dict(_measurements),
+            }, fp, indent=2, sort_keys=True)
+
+        terminalreporter.write_line('Saved benchmark results to %s' % path)
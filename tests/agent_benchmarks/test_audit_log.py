@@ -0,0 +1,54 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.common.agent_http import DeveloperModeClient
+from newrelic.common.audit_log import AuditLogWriter
+from newrelic.common.encoding_utils import json_encode
+
+# Compares the time taken to send a span_event_data payload of a thousand
+# spans with no audit log, with the text audit log and with the
+# asynchronous audit log.
+
+PAYLOAD = json_encode(['1234567', {'reservoir_size': 1000,
+        'events_seen': 1000}, [[{'type': 'Span', 'guid': '%016x' % index,
+        'name': 'Function/myapp.views:handler', 'duration': 0.001 * index,
+        'priority': 1.5}, {}, {}] for index in range(1000)]]).encode('utf-8')
+
+
+@pytest.mark.parametrize('audit_log', (None, 'text', 'asynchronous'))
+def test_audit_log_send_request(benchmark, tmpdir, audit_log):
+    path = str(tmpdir.join('audit.log'))
+
+    if audit_log == 'text':
+        audit_log_fp = open(path, 'a')
+    elif audit_log == 'asynchronous':
+        audit_log_fp = AuditLogWriter(path, queue_size=100000)
+    else:
+        audit_log_fp = None
+
+    client = DeveloperModeClient('localhost', 1, audit_log_fp=audit_log_fp)
+
+    def _send():
+        client.send_request(params={'method': 'span_event_data'},
+                payload=PAYLOAD)
+
+    try:
+        benchmark(_send, number=5, name='audit_log[%s]' % audit_log)
+    finally:
+        if audit_log == 'asynchronous':
+            audit_log_fp.shutdown(10.0)
+        elif audit_log_fp is not None:
+            audit_log_fp.close()
@@ -0,0 +1,79 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import add_custom_parameter
+from newrelic.api.wsgi_application import WSGIApplicationWrapper
+
+# Measures the overhead of the agent for a synthetic WSGI workload, with the
+# agent reporting to a local stand in for the data collector. The overhead
+# of each request is the difference in time taken for a request with and
+# without the agent.
+
+REQUESTS = 1000
+
+ENVIRON = {
+    'REQUEST_METHOD': 'GET',
+    'PATH_INFO': '/orders',
+    'QUERY_STRING': 'page=1',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '80',
+    'HTTP_HOST': 'localhost',
+    'wsgi.url_scheme': 'http',
+}
+
+
+def _handler(environ, start_response):
+    for name in ('load_orders', 'render_orders'):
+        with FunctionTrace(name):
+            add_custom_parameter('step', name)
+
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+            ('Content-Length', '2')])
+    return [b'OK']
+
+
+_instrumented = WSGIApplicationWrapper(_handler)
+
+
+def _request(application):
+    body = application(dict(ENVIRON), lambda status, headers: None)
+    try:
+        return b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def test_wsgi_request_overhead(benchmark, measurement,
+        collector_application):
+    bare = benchmark(lambda: _request(_handler), number=REQUESTS,
+            name='wsgi_request[bare]')
+    instrumented = benchmark(lambda: _request(_instrumented),
+            number=REQUESTS, name='wsgi_request[instrumented]')
+
+    measurement('wsgi_request_overhead', overhead_ns=int(
+            (instrumented - bare) * 1e9))
+
+
+def test_wsgi_harvest(harvest_overhead):
+    def _workload():
+        for _ in range(REQUESTS):
+            _request(_instrumented)
+
+    stats = harvest_overhead(_workload, 'wsgi_harvest')
+
+    assert stats['metric_data']['requests'] == 1
+    assert stats['analytic_event_data']['requests'] == 1
+    assert stats['span_event_data']['requests'] == 1
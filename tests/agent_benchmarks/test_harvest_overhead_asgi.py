@@ -0,0 +1,94 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from newrelic.api.asgi_application import ASGIApplicationWrapper
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import add_custom_parameter
+
+# Measures the overhead of the agent for a synthetic ASGI workload, with the
+# agent reporting to a local stand in for the data collector. The overhead
+# of each request is the difference in time taken for a request with and
+# without the agent.
+
+REQUESTS = 1000
+
+SCOPE = {
+    'asgi': {'spec_version': '2.1', 'version': '3.0'},
+    'client': ('127.0.0.1', 54768),
+    'headers': [(b'host', b'localhost')],
+    'http_version': '1.1',
+    'method': 'GET',
+    'path': '/orders',
+    'query_string': b'page=1',
+    'raw_path': b'/orders',
+    'root_path': '',
+    'scheme': 'http',
+    'server': ('127.0.0.1', 8000),
+    'type': 'http',
+}
+
+
+async def _handler(scope, receive, send):
+    for name in ('load_orders', 'render_orders'):
+        with FunctionTrace(name):
+            add_custom_parameter('step', name)
+
+    await send({'type': 'http.response.start', 'status': 200,
+            'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'OK'})
+
+
+_instrumented = ASGIApplicationWrapper(_handler)
+
+
+async def _receive():
+    return {'type': 'http.request'}
+
+
+async def _send(message):
+    pass
+
+
+def _requests(application, count):
+    async def _run():
+        for _ in range(count):
+            await application(dict(SCOPE), _receive, _send)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_run())
+    finally:
+        loop.close()
+
+
+def test_asgi_request_overhead(benchmark, measurement,
+        collector_application):
+    bare = benchmark(lambda: _requests(_handler, REQUESTS),
+            operations=REQUESTS, number=1, name='asgi_request[bare]')
+    instrumented = benchmark(lambda: _requests(_instrumented, REQUESTS),
+            operations=REQUESTS, number=1, name='asgi_request[instrumented]')
+
+    measurement('asgi_request_overhead', overhead_ns=int(
+            (instrumented - bare) * 1e9))
+
+
+def test_asgi_harvest(harvest_overhead):
+    stats = harvest_overhead(lambda: _requests(_instrumented, REQUESTS),
+            'asgi_harvest')
+
+    assert stats['metric_data']['requests'] == 1
+    assert stats['analytic_event_data']['requests'] == 1
+    assert stats['span_event_data']['requests'] == 1
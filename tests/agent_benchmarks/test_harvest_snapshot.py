@@ -0,0 +1,62 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.stats_engine import StatsEngine
+
+# The time taken to snapshot the stats engine is the time for which threads
+# recording transactions are blocked during a harvest. With a standby stats
+# engine prepared beforehand it should not depend on the amount of data.
+
+SETTINGS = finalize_application_settings()
+
+
+def _populated(metrics):
+    stats = StatsEngine()
+    stats.reset_stats(SETTINGS)
+
+    for i in range(metrics):
+        stats.record_custom_metric('Custom/%d' % i, i)
+        stats.span_events.add(i)
+
+    return stats
+
+
+@pytest.mark.parametrize('metrics', (10, 10000))
+@pytest.mark.parametrize('use_standby', (False, True),
+        ids=('reset', 'standby'))
+def test_harvest_snapshot_lock_hold(benchmark, metrics, use_standby):
+    engines = [(_populated(metrics), None) for _ in range(20)]
+
+    if use_standby:
+        engines = [(stats, stats.create_standby()) for stats, _ in engines]
+
+    pending = list(engines)
+    snapshots = []
+
+    # The snapshots are retained so the cost of freeing the harvested data,
+    # which happens after the lock is released, is not included.
+
+    def _snapshot():
+        stats, standby = pending.pop()
+        snapshots.append(stats.harvest_snapshot(False, standby))
+
+    benchmark(_snapshot, number=len(engines), repeat=1,
+            name='harvest_snapshot[%s-%d]' % (
+            use_standby and 'standby' or 'reset', metrics))
+
+    for stats, _ in engines:
+        assert not stats.stats_table
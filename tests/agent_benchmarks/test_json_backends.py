@@ -0,0 +1,158 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.common.encoding_utils import (JSON_ENCODERS, json_decode,
+        json_encode, json_encode_chunks, json_encoder)
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.function_node import FunctionNode
+from newrelic.core.root_node import RootNode
+from newrelic.core.stats_engine import (CustomMetrics, SampledDataSet,
+        StatsEngine)
+from newrelic.core.transaction_node import TransactionNode
+
+# Compares the JSON libraries which can be used to encode the payloads sent
+# to the data collector, using the payloads produced by recording real
+# transactions. Only the libraries which are installed are benchmarked.
+
+SETTINGS = finalize_application_settings({'agent_run_id': '1234567'})
+SETTINGS.distributed_tracing.enabled = True
+SETTINGS.span_events.enabled = True
+SETTINGS.collect_span_events = True
+
+
+def _transaction_node(index):
+    children = tuple(FunctionNode(
+            group='Function',
+            name='function_%d' % i,
+            children=(),
+            start_time=1524764430.0,
+            end_time=1524764430.001,
+            duration=0.001,
+            exclusive=0.001,
+            label=None,
+            params=None,
+            rollup=None,
+            guid='%016x' % (index * 100 + i),
+            agent_attributes={},
+            user_attributes={'user': 'attribute'},) for i in range(10))
+
+    root = RootNode(
+            name='Function/main',
+            children=children,
+            start_time=1524764430.0,
+            end_time=1524764430.1,
+            duration=0.1,
+            exclusive=0.09,
+            guid='%016x' % index,
+            agent_attributes={},
+            user_attributes={},
+            path='OtherTransaction/Function/main',
+            trusted_parent_span=None,
+            tracing_vendors=None,
+    )
+
+    return TransactionNode(
+            settings=SETTINGS,
+            path='OtherTransaction/Function/main',
+            type='OtherTransaction',
+            group='Function',
+            base_name='main',
+            name_for_metric='Function/main',
+            port=None,
+            request_uri=None,
+            queue_start=0.0,
+            start_time=1524764430.0,
+            end_time=1524764430.1,
+            last_byte_time=0.0,
+            total_time=0.1,
+            response_time=0.1,
+            duration=0.1,
+            exclusive=0.09,
+            root=root,
+            errors=(),
+            slow_sql=(),
+            custom_events=SampledDataSet(),
+            apdex_t=0.5,
+            suppress_apdex=False,
+            custom_metrics=CustomMetrics(),
+            guid='%016x' % index,
+            cpu_time=0.0,
+            suppress_transaction_trace=False,
+            client_cross_process_id=None,
+            referring_transaction_guid=None,
+            record_tt=False,
+            synthetics_resource_id=None,
+            synthetics_job_id=None,
+            synthetics_monitor_id=None,
+            synthetics_header=None,
+            is_part_of_cat=False,
+            trip_id='%016x' % index,
+            path_hash=None,
+            referring_path_hash=None,
+            alternate_path_hashes=[],
+            trace_intrinsics={},
+            distributed_trace_intrinsics={},
+            agent_attributes=[],
+            user_attributes=[],
+            priority=1.0,
+            parent_transport_duration=None,
+            parent_span=None,
+            parent_type=None,
+            parent_account=None,
+            parent_app=None,
+            parent_tx=None,
+            parent_transport_type=None,
+            sampled=True,
+            root_span_guid=None,
+            trace_id='%032x' % index,
+            loop_time=0.0,
+    )
+
+
+def _payloads():
+    stats = StatsEngine()
+    stats.reset_stats(SETTINGS)
+
+    for index in range(100):
+        stats.record_transaction(_transaction_node(index))
+
+    return {
+        'analytic_event_data': ('1234567', stats.transaction_events
+                .sampling_info, list(stats.transaction_events)),
+        'span_event_data': ('1234567', stats.span_events.sampling_info,
+                list(stats.span_events)),
+        'metric_data': ('1234567', 1524764430.0, 1524764490.0,
+                stats.metric_data()),
+    }
+
+
+PAYLOADS = _payloads()
+
+
+@pytest.mark.parametrize('method', sorted(PAYLOADS))
+@pytest.mark.parametrize('backend', list(JSON_ENCODERS))
+def test_json_backend_encode(benchmark, method, backend):
+    payload = PAYLOADS[method]
+    encoder = json_encoder(backend)
+
+    def _encode():
+        return b''.join(json_encode_chunks(payload, encoder=encoder))
+
+    benchmark(_encode, number=20, name='json_backend[%s-%s]' % (
+            backend, method))
+
+    assert json_decode(_encode().decode('utf-8')) == json_decode(
+            json_encode(payload))
@@ -0,0 +1,75 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.common.encoding_utils import json_encode
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.stats_engine import StatsEngine
+
+# Compares the size and encoding time of the metric_data payload in the
+# standard format with the string table format, for a harvest of around
+# three thousand metrics, most of them scoped to one of a set of
+# transactions.
+
+TRANSACTIONS = 100
+METRICS_PER_TRANSACTION = 30
+
+
+def _stats_engine():
+    settings = finalize_application_settings()
+
+    stats = StatsEngine()
+    stats.reset_stats(settings)
+
+    table = stats.stats_table
+
+    for transaction in range(TRANSACTIONS):
+        scope = 'WebTransaction/Function/myapp.views:handler_%d' % transaction
+        table.merge_raw_time_metric((scope, ''), 0.1, 0.05)
+
+        for metric in range(METRICS_PER_TRANSACTION):
+            name = 'Function/myapp.services.module_%d:function_%d' % (
+                    metric % 10, metric)
+            table.merge_raw_time_metric((name, scope), 0.001 * metric)
+            table.merge_raw_time_metric((name, ''), 0.001 * metric)
+
+    return stats
+
+
+def _metric_data(stats, metric_data_format):
+    if metric_data_format == 'string_table':
+        return stats.metric_data_string_table()
+    return stats.metric_data()
+
+
+@pytest.mark.parametrize('metric_data_format', ('standard', 'string_table'))
+def test_metric_data_format_encode(benchmark, metric_data_format):
+    stats = _stats_engine()
+
+    def _encode():
+        return json_encode(('1234567', 1524764430.0, 1524764490.0,
+                _metric_data(stats, metric_data_format)))
+
+    benchmark(_encode, number=5, name='metric_data_format[%s]' %
+            metric_data_format)
+
+
+def test_metric_data_format_size():
+    stats = _stats_engine()
+
+    standard = json_encode(_metric_data(stats, 'standard'))
+    string_table = json_encode(_metric_data(stats, 'string_table'))
+
+    assert len(string_table) * 2 < len(standard)
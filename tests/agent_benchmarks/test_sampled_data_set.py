@@ -0,0 +1,95 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+import pytest
+
+from newrelic.core.stats_engine import SampledDataSet
+
+# Span events are recorded at up to 2000 per harvest, with each transaction
+# contributing a batch of events which all share the transaction priority.
+
+CAPACITY = 2000
+BATCH_SIZE = 100
+BATCHES = 100
+
+
+def _batches():
+    return [([{'span': i} for i in range(BATCH_SIZE)],
+            [random.random()] * BATCH_SIZE) for _ in range(BATCHES)]
+
+
+def _record_sequential(batches):
+    data_set = SampledDataSet(CAPACITY)
+    for samples, priorities in batches:
+        for sample, priority in zip(samples, priorities):
+            data_set.add(sample, priority)
+    return data_set
+
+
+def _record_batched(batches):
+    data_set = SampledDataSet(CAPACITY)
+    for samples, priorities in batches:
+        data_set.add_many(samples, priorities)
+    return data_set
+
+
+@pytest.mark.parametrize('record', (_record_sequential, _record_batched),
+        ids=('add', 'add_many'))
+def test_span_event_recording(benchmark, record):
+    batches = _batches()
+
+    benchmark(lambda: record(batches), operations=BATCH_SIZE * BATCHES,
+            name='span_event_recording[%s]' % record.__name__)
+
+    data_set = record(batches)
+
+    assert data_set.num_seen == BATCH_SIZE * BATCHES
+    assert data_set.num_samples == CAPACITY
+
+
+def _populated(count):
+    data_set = SampledDataSet(CAPACITY)
+    data_set.add_many(range(count))
+    return data_set
+
+
+def _merge_sequential(data_set, other):
+    for priority, _, sample in other.pq:
+        data_set.add(sample, priority)
+    data_set.num_seen += other.num_seen - other.num_samples
+
+
+@pytest.mark.parametrize('merge', (_merge_sequential, SampledDataSet.merge),
+        ids=('add', 'merge'))
+def test_data_set_merge(benchmark, merge):
+    other = _populated(CAPACITY)
+
+    def _merge():
+        merge(_populated(CAPACITY), other)
+
+    # The cost of populating the target data set is included in the timing
+    # so it is reported separately to allow it to be subtracted out.
+
+    benchmark(lambda: _populated(CAPACITY), operations=CAPACITY,
+            name='data_set_merge[setup]')
+    benchmark(_merge, operations=CAPACITY,
+            name='data_set_merge[%s]' % merge.__name__)
+
+    data_set = _populated(CAPACITY)
+    merge(data_set, other)
+
+    assert data_set.num_seen == 2 * CAPACITY
+    assert data_set.num_samples == CAPACITY
@@ -0,0 +1,43 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.application import application_instance
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.datastore_trace import DatastoreTrace
+
+from testing_support.fixtures import override_application_settings
+
+# Measures the cost per call of a transaction making a large number of
+# datastore calls in a loop, with and without the segment budget, past
+# which the calls are aggregated into a single segment.
+
+CALLS = 10000
+
+
+def _transaction():
+    with BackgroundTask(application_instance(), 'segment_budget'):
+        for _ in range(CALLS):
+            with DatastoreTrace('Redis', None, 'get'):
+                pass
+
+
+@pytest.mark.parametrize('budget', (0, 3000), ids=('unlimited', 'budget'))
+def test_segment_budget(benchmark, collector_application, budget):
+    transaction = override_application_settings({
+            'agent_limits.segments_per_transaction': budget})(_transaction)
+
+    benchmark(transaction, operations=CALLS, number=1,
+            name='segment_budget[%s]' % ('budget' if budget else 'unlimited'))
@@ -0,0 +1,63 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import newrelic.core.trace_cache as trace_cache_module
+from newrelic.api.application import application_instance
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import current_transaction
+
+# Compares the cost of looking up the current transaction, and of entering
+# and exiting a trace, for each of the trace cache backends, from a thread.
+# The same from an asyncio task is measured in test_trace_cache_asyncio.py.
+
+LOOKUPS = 10000
+
+BACKENDS = [name for name in sorted(trace_cache_module.TRACE_CACHE_BACKENDS)
+        if name != 'contextvars' or trace_cache_module.contextvars]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch, collector_application):
+    cache_type = trace_cache_module.TRACE_CACHE_BACKENDS[request.param]
+    monkeypatch.setattr(trace_cache_module, '_trace_cache', cache_type())
+    return request.param
+
+
+def _lookups():
+    for _ in range(LOOKUPS):
+        current_transaction()
+
+
+def _traces():
+    for _ in range(LOOKUPS):
+        with FunctionTrace('trace'):
+            pass
+
+
+def _in_transaction(func):
+    def _run():
+        with BackgroundTask(application_instance(), 'trace_cache'):
+            func()
+    return _run
+
+
+@pytest.mark.parametrize('workload', (_lookups, _traces),
+        ids=('current_transaction', 'function_trace'))
+def test_trace_cache_thread(benchmark, backend, workload):
+    benchmark(_in_transaction(workload), operations=LOOKUPS, number=1,
+            name='trace_cache[%s-thread-%s]' % (backend,
+            workload.__name__.strip('_')))
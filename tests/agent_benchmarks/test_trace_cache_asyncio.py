@@ -0,0 +1,50 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import pytest
+
+import newrelic.core.trace_cache as trace_cache_module
+
+from test_trace_cache import (LOOKUPS, _in_transaction, _lookups,  # NOQA
+        _traces, backend)
+
+# Compares the cost of looking up the current transaction, and of entering
+# and exiting a trace, for each of the trace cache backends, from an asyncio
+# task.
+
+
+def _in_task(func):
+    async def _task():
+        func()
+
+    def _run():
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(_task())
+        finally:
+            loop.close()
+
+    return _run
+
+
+@pytest.mark.skipif(not trace_cache_module.contextvars,
+        reason='Requires Python 3.7 or later.')
+@pytest.mark.parametrize('workload', (_lookups, _traces),
+        ids=('current_transaction', 'function_trace'))
+def test_trace_cache_task(benchmark, backend, workload):
+    benchmark(_in_task(_in_transaction(workload)), operations=LOOKUPS,
+            number=1, name='trace_cache[%s-task-%s]' % (backend,
+            workload.__name__.strip('_')))
@@ -0,0 +1,55 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from newrelic.api.application import application_instance
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.common.stopwatch import default_timer_ns
+
+# Measures the cost of reading the clocks used to time traces, along with
+# that of entering and exiting a trace, the duration of which is now
+# calculated from the monotonic timer rather than the wall clock.
+
+READINGS = 100000
+TRACES = 10000
+
+
+def _readings(clock):
+    def _run():
+        for _ in range(READINGS):
+            clock()
+    return _run
+
+
+def test_clock_wall_time(benchmark):
+    benchmark(_readings(time.time), operations=READINGS, number=1,
+            name='trace_clock[time]')
+
+
+def test_clock_default_timer_ns(benchmark):
+    benchmark(_readings(default_timer_ns), operations=READINGS, number=1,
+            name='trace_clock[default_timer_ns]')
+
+
+def test_clock_function_trace(benchmark, collector_application):
+    def _transaction():
+        with BackgroundTask(application_instance(), 'trace_clock'):
+            for _ in range(TRACES):
+                with FunctionTrace('trace'):
+                    pass
+
+    benchmark(_transaction, operations=TRACES, number=1,
+            name='trace_clock[function_trace]')
@@ -0,0 +1,88 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.application import application_instance
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.function_trace import FunctionTrace
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Measures the memory held per segment of a transaction, both for the
+# traces which are open at the same time, such as for deeply nested calls
+# or concurrent coroutines, and for the nodes of the segments which have
+# completed, which are held until the end of the transaction.
+
+SEGMENTS = 1000
+
+
+def _traced_memory(func):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    return result, after - before
+
+
+def _function_trace(parent):
+    return FunctionTrace('segment', parent=parent)
+
+
+def _datastore_trace(parent):
+    return DatastoreTrace('Redis', None, 'get', parent=parent)
+
+
+@pytest.mark.skipif(tracemalloc is None, reason='Requires tracemalloc.')
+@pytest.mark.parametrize('trace_type', (_function_trace, _datastore_trace),
+        ids=('function', 'datastore'))
+def test_segment_memory(benchmark, measurement, collector_application,
+        trace_type):
+    application = application_instance()
+
+    with BackgroundTask(application, 'segment_memory') as transaction:
+        root = transaction.root_span
+
+        traces, open_bytes = _traced_memory(
+                lambda: [trace_type(root) for _ in range(SEGMENTS)])
+
+        def _complete():
+            for trace in traces:
+                trace.__enter__()
+                trace.__exit__(None, None, None)
+
+        _, node_bytes = _traced_memory(_complete)
+
+        traces[:] = []
+
+        assert len(root.children) == SEGMENTS
+
+        def _segment():
+            with trace_type(root):
+                pass
+
+        benchmark(_segment, operations=1, number=SEGMENTS,
+                name='segment_memory[%s]' % trace_type.__name__)
+
+        measurement('segment_memory[%s]' % trace_type.__name__,
+                open_trace_bytes=open_bytes // SEGMENTS,
+                node_bytes=node_bytes // SEGMENTS)
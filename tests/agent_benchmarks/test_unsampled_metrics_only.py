@@ -0,0 +1,63 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.application import application_instance
+from newrelic.api.background_task import BackgroundTask
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.transaction import create_distributed_trace_payload
+from newrelic.common.object_wrapper import transient_function_wrapper
+
+from testing_support.fixtures import override_application_settings
+
+# Measures the cost per request of short unsampled transactions each making
+# a hundred datastore calls, with and without the traces of such transactions
+# being recorded only as metrics. The agent is otherwise configured to
+# sample every transaction, so the sampler is overridden. A distributed
+# trace payload is created first, as whether a transaction is sampled is
+# otherwise not decided until it ends.
+
+REQUESTS = 200
+CALLS = 100
+
+
+@transient_function_wrapper('newrelic.core.adaptive_sampler',
+        'AdaptiveSampler.compute_sampled')
+def _force_unsampled(wrapped, instance, args, kwargs):
+    return False
+
+
+def _requests():
+    for _ in range(REQUESTS):
+        with BackgroundTask(application_instance(), 'unsampled'):
+            create_distributed_trace_payload()
+
+            for _ in range(CALLS):
+                with DatastoreTrace('Redis', None, 'get'):
+                    pass
+
+
+@pytest.mark.parametrize('metrics_only', (False, True),
+        ids=('nodes', 'metrics_only'))
+def test_unsampled_metrics_only(benchmark, collector_application,
+        metrics_only):
+    requests = override_application_settings({
+            'transaction_tracer.transaction_threshold': None,
+            'transaction_segments.unsampled_metrics_only': metrics_only,
+    })(_force_unsampled(_requests))
+
+    benchmark(requests, operations=REQUESTS, number=1,
+            name='unsampled_metrics_only[%s]' % (
+            'metrics_only' if metrics_only else 'nodes'))
@@ -0,0 +1,205 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.api.background_task import background_task
+from newrelic.api.database_trace import DatabaseTrace
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.external_trace import ExternalTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.time_trace import current_trace
+from newrelic.api.transaction import (current_transaction,
+        insert_distributed_trace_headers)
+from newrelic.common.object_wrapper import transient_function_wrapper
+
+from testing_support.fixtures import (override_application_settings,
+        validate_transaction_metrics, validate_tt_segment_params,
+        dt_enabled)
+from testing_support.validators.validate_span_events import (
+        validate_span_events)
+
+# Once the budget of five segments is used up by the function traces and
+# the first two datastore traces, the remaining datastore traces are
+# aggregated into a single node.
+
+_budget_settings = {'agent_limits.segments_per_transaction': 5}
+
+
+def _traces(count):
+    for _ in range(3):
+        with FunctionTrace('function'):
+            pass
+
+    for _ in range(count):
+        with DatastoreTrace('Redis', None, 'get'):
+            pass
+
+
+@override_application_settings(_budget_settings)
+@validate_transaction_metrics('test_segment_budget_metrics',
+        background_task=True,
+        scoped_metrics=[
+            ('Function/function', 3),
+            ('Datastore/operation/Redis/get', 20)],
+        rollup_metrics=[
+            ('Datastore/all', 20),
+            ('Datastore/Redis/all', 20),
+            ('Datastore/allOther', 20)])
+@background_task(name='test_segment_budget_metrics')
+def test_segment_budget_metrics():
+    _traces(20)
+
+
+@dt_enabled
+@override_application_settings(_budget_settings)
+@validate_span_events(count=1, exact_intrinsics={
+        'name': 'Datastore/operation/Redis/get', 'nr.aggregateCount': 18})
+@validate_span_events(count=2, exact_intrinsics={
+        'name': 'Datastore/operation/Redis/get'},
+        unexpected_intrinsics=['nr.aggregateCount'])
+@validate_tt_segment_params(present_params=('aggregate_count',
+        'aggregate_duration_millis'))
+@background_task(name='test_segment_budget_span_events')
+def test_segment_budget_span_events():
+    _traces(20)
+
+
+@dt_enabled
+@override_application_settings({'agent_limits.segments_per_transaction': 0})
+@validate_span_events(count=20, exact_intrinsics={
+        'name': 'Datastore/operation/Redis/get'},
+        unexpected_intrinsics=['nr.aggregateCount'])
+@background_task(name='test_segment_budget_disabled')
+def test_segment_budget_disabled():
+    _traces(20)
+
+
+@override_application_settings(_budget_settings)
+@validate_transaction_metrics('test_segment_budget_non_terminal',
+        background_task=True,
+        scoped_metrics=[('Function/nested', 10)])
+@background_task(name='test_segment_budget_non_terminal')
+def test_segment_budget_non_terminal():
+    _traces(2)
+
+    # Traces which may have children of their own are never aggregated.
+
+    for _ in range(10):
+        with FunctionTrace('nested') as trace:
+            assert not trace.is_aggregated
+            assert current_trace() is trace
+
+
+@override_application_settings(_budget_settings)
+@background_task(name='test_segment_budget_parent_exclusive')
+def test_segment_budget_parent_exclusive():
+    with FunctionTrace('parent') as parent:
+        _traces(20)
+
+        children = len(parent.children)
+
+    assert children == 6
+    assert parent.child_count == children
+    assert 0.0 <= parent.exclusive <= parent.duration
+
+
+_external_txn_names = ('WebTransaction/Function/a',
+        'WebTransaction/Function/b')
+
+
+@override_application_settings(_budget_settings)
+@validate_transaction_metrics('test_segment_budget_external_response',
+        background_task=True,
+        rollup_metrics=[
+            ('External/example.com/all', 10),
+            ('ExternalTransaction/example.com/1#1/'
+                'WebTransaction/Function/a', 5),
+            ('ExternalTransaction/example.com/1#1/'
+                'WebTransaction/Function/b', 5)])
+@background_task(name='test_segment_budget_external_response')
+def test_segment_budget_external_response():
+    # The metric names and attributes of external traces depend on the
+    # response, so only those with the same response are aggregated.
+
+    _traces(2)
+
+    with FunctionTrace('parent') as parent:
+        for i in range(10):
+            with ExternalTrace('library', 'http://example.com/',
+                    'GET') as trace:
+                trace.process_response(200 + i % 2, [])
+                trace.params['cross_process_id'] = '1#1'
+                trace.params['external_txn_name'] = \
+                        _external_txn_names[i % 2]
+
+    assert len(parent.children) == 2
+    assert [child.call_count for child in parent.children] == [5, 5]
+    assert set(child.agent_attributes['http.statusCode']
+            for child in parent.children) == set((200, 201))
+
+
+@override_application_settings(dict(_budget_settings, **{
+        'transaction_tracer.explain_threshold': 0.0}))
+@background_task(name='test_segment_budget_slow_sql')
+def test_segment_budget_slow_sql():
+    # Database traces over the explain threshold keep their own nodes so
+    # they can be reported as slow SQL.
+
+    _traces(2)
+
+    with FunctionTrace('parent') as parent:
+        for _ in range(5):
+            with DatabaseTrace('select 1'):
+                pass
+
+    assert len(parent.children) == 5
+    assert len(current_transaction()._slow_sql) == 5
+
+
+_span_guids = []
+
+
+@transient_function_wrapper('newrelic.core.stats_engine',
+        'StatsEngine.record_transaction')
+def _capture_span_guids(wrapped, instance, args, kwargs):
+    result = wrapped(*args, **kwargs)
+
+    _span_guids.extend(event[0]['guid']
+            for _, _, event in instance.span_events.pq)
+
+    return result
+
+
+@dt_enabled
+@override_application_settings({'agent_limits.segments_per_transaction': 2})
+def test_segment_budget_distributed_trace_headers():
+    # Traces whose guid is sent in the headers of a distributed trace keep
+    # their own node, so that the span referred to is reported.
+
+    span_ids = []
+
+    @_capture_span_guids
+    @background_task(name='test_segment_budget_distributed_trace_headers')
+    def _test():
+        for _ in range(5):
+            with ExternalTrace('library', 'http://example.com/', 'GET'):
+                headers = []
+                insert_distributed_trace_headers(headers)
+                span_ids.append(dict(headers)['traceparent'].split('-')[2])
+
+    del _span_guids[:]
+
+    _test()
+
+    assert len(span_ids) == 5
+    assert set(span_ids) <= set(_span_guids)
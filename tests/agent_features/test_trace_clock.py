@@ -0,0 +1,68 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from newrelic.api.background_task import background_task
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import current_transaction
+from newrelic.common.stopwatch import ClockAnchor, default_timer_ns
+
+
+def test_clock_anchor_wall_time():
+    clock = ClockAnchor()
+
+    assert clock.wall_time(clock.counter_ns) == clock.time
+    assert clock.wall_time(clock.counter_ns + 1500000000) == (
+            clock.time + 1.5)
+
+
+@background_task(name='test_trace_clock_system_clock_changed')
+def test_trace_clock_system_clock_changed(monkeypatch):
+    # Setting the system clock back while the trace is running must not
+    # affect the times recorded for it.
+
+    with FunctionTrace('trace') as trace:
+        monkeypatch.setattr(time, 'time', lambda: 0.0)
+        time.sleep(0.01)
+
+    assert trace.start_time > 0.0
+    assert trace.end_time > trace.start_time
+    assert trace.duration >= 0.01
+    assert abs(trace.duration - (trace.end_time - trace.start_time)) < 1e-6
+
+
+@background_task(name='test_trace_clock_start_time_overridden')
+def test_trace_clock_start_time_overridden():
+    # Instrumentation may replace the start time with a wall clock time
+    # recorded elsewhere, in which case the duration is calculated from
+    # the wall clock times.
+
+    with FunctionTrace('trace') as trace:
+        trace.start_time -= 1.0
+
+    assert 1.0 <= trace.duration < 2.0
+    assert trace.duration == trace.end_time - trace.start_time
+
+
+@background_task(name='test_trace_clock_transaction_stopped')
+def test_trace_clock_transaction_stopped():
+    transaction = current_transaction()
+
+    with FunctionTrace('trace') as trace:
+        transaction.stop_recording()
+        end_ns = default_timer_ns()
+
+    assert trace.end_time == transaction.end_time
+    assert trace.start_ns + int(trace.duration * 1e9) <= end_ns
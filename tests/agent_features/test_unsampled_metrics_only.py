@@ -0,0 +1,248 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+
+from newrelic.api.background_task import background_task
+from newrelic.api.database_trace import DatabaseTrace
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import (current_transaction,
+        accept_distributed_trace_payload, create_distributed_trace_payload)
+from newrelic.api.web_transaction import web_transaction
+from newrelic.common.object_wrapper import transient_function_wrapper
+
+from testing_support.fixtures import (override_application_settings,
+        validate_transaction_metrics, dt_enabled)
+
+# Transactions which are not sampled, and have not run long enough to be
+# saved as the slow transaction trace, only need the metrics for their
+# traces, so terminal traces are aggregated as they are once the segment
+# budget is used up. The thresholds are returned to their defaults, as the
+# tests otherwise make every transaction a candidate for a trace.
+
+_default_thresholds = {
+    'transaction_segments.unsampled_metrics_only': True,
+    'transaction_tracer.transaction_threshold': None,
+    'transaction_tracer.explain_threshold': 0.5,
+}
+
+
+@transient_function_wrapper('newrelic.core.adaptive_sampler',
+        'AdaptiveSampler.compute_sampled')
+def force_unsampled(wrapped, instance, args, kwargs):
+    wrapped(*args, **kwargs)
+    return False
+
+
+def _children(count, trace_type=DatastoreTrace, args=('Redis', None, 'get')):
+    with FunctionTrace('parent') as parent:
+        for _ in range(count):
+            with trace_type(*args):
+                pass
+
+    return len(parent.children)
+
+
+@override_application_settings(_default_thresholds)
+@validate_transaction_metrics('test_unsampled_metrics_only',
+        background_task=True,
+        scoped_metrics=[('Datastore/operation/Redis/get', 20)],
+        rollup_metrics=[('Datastore/all', 20)])
+@background_task(name='test_unsampled_metrics_only')
+def test_unsampled_metrics_only():
+    assert _children(20) == 1
+
+
+@override_application_settings(dict(_default_thresholds, **{
+        'transaction_segments.unsampled_metrics_only': False}))
+@background_task(name='test_unsampled_metrics_only_disabled')
+def test_unsampled_metrics_only_disabled():
+    assert _children(20) == 20
+
+
+@override_application_settings(dict(_default_thresholds, **{
+        'transaction_tracer.transaction_threshold': 0.0}))
+@background_task(name='test_unsampled_metrics_only_trace_candidate')
+def test_unsampled_metrics_only_trace_candidate():
+    assert _children(20) == 20
+
+
+@dt_enabled
+@override_application_settings(_default_thresholds)
+@background_task(name='test_unsampled_metrics_only_sampled')
+def test_unsampled_metrics_only_sampled():
+    create_distributed_trace_payload()
+
+    assert current_transaction().sampled
+    assert _children(20) == 20
+
+
+@force_unsampled
+@override_application_settings(dict(_default_thresholds, **{
+        'distributed_tracing.enabled': True}))
+@background_task(name='test_unsampled_metrics_only_not_sampled')
+def test_unsampled_metrics_only_not_sampled():
+    create_distributed_trace_payload()
+
+    assert current_transaction().sampled is False
+    assert _children(20) == 1
+
+
+@force_unsampled
+@override_application_settings(dict(_default_thresholds, **{
+        'distributed_tracing.enabled': True}))
+@background_task(name='test_unsampled_metrics_only_no_payload')
+def test_unsampled_metrics_only_no_payload():
+    # Whether the transaction is sampled is decided at its first terminal
+    # trace where no distributed trace payload was created or accepted.
+
+    assert _children(20) == 1
+    assert current_transaction().sampled is False
+
+
+@force_unsampled
+@override_application_settings(dict(_default_thresholds, **{
+        'distributed_tracing.enabled': True}))
+@web_transaction(name='test_unsampled_metrics_only_web_transaction')
+def test_unsampled_metrics_only_web_transaction():
+    assert _children(20) == 1
+    assert current_transaction().sampled is False
+
+
+_deadlines = []
+
+
+@transient_function_wrapper('newrelic.api.transaction',
+        'Transaction._metrics_only_deadline')
+def _count_deadlines(wrapped, instance, args, kwargs):
+    result = wrapped(*args, **kwargs)
+    _deadlines.append(result)
+    return result
+
+
+@force_unsampled
+@override_application_settings(dict(_default_thresholds, **{
+        'distributed_tracing.enabled': True}))
+@background_task(name='test_unsampled_metrics_only_deadline_kept')
+def test_unsampled_metrics_only_deadline_kept():
+    _deadlines[:] = []
+
+    _count_deadlines(_children)(20)
+
+    assert len(_deadlines) == 1
+
+
+_sampled_payload = json.dumps({
+    'v': [0, 1],
+    'd': {
+        'ac': '1',
+        'ap': '2827902',
+        'id': '7d3efb1b173fecfa',
+        'pr': 10.001,
+        'sa': True,
+        'ti': 1518469636035,
+        'tr': 'd6b4ba0c3a712ca',
+        'ty': 'App',
+    }
+})
+
+
+@force_unsampled
+@override_application_settings(dict(_default_thresholds, **{
+        'distributed_tracing.enabled': True,
+        'trusted_account_key': '1'}))
+@background_task(name='test_unsampled_metrics_only_payload_accepted_later')
+def test_unsampled_metrics_only_payload_accepted_later():
+    # Where a payload from a service which sampled the trace is accepted
+    # after the decision was made, traces from then on keep their nodes.
+
+    transaction = current_transaction()
+
+    with FunctionTrace('parent') as parent:
+        for _ in range(10):
+            with DatastoreTrace('Redis', None, 'get'):
+                pass
+
+        assert transaction.sampled is False
+        assert accept_distributed_trace_payload(_sampled_payload)
+
+        for _ in range(10):
+            with DatastoreTrace('Redis', None, 'get'):
+                pass
+
+    assert transaction.sampled
+    assert len(parent.children) == 11
+
+
+@force_unsampled
+@override_application_settings(dict(_default_thresholds, **{
+        'distributed_tracing.enabled': True}))
+@background_task(name='test_unsampled_metrics_only_infinite_tracing')
+def test_unsampled_metrics_only_infinite_tracing():
+    # Span events are sent for every transaction with infinite tracing.
+    # The trace observer is only set while the traces are run, as the
+    # libraries needed to stream the span events may not be installed.
+
+    create_distributed_trace_payload()
+
+    settings = current_transaction().settings
+    settings.infinite_tracing._trace_observer_host = 'x'
+
+    try:
+        assert _children(20) == 20
+    finally:
+        settings.infinite_tracing._trace_observer_host = None
+
+
+@override_application_settings(_default_thresholds)
+@background_task(name='test_unsampled_metrics_only_record_tt')
+def test_unsampled_metrics_only_record_tt():
+    current_transaction().record_tt = True
+
+    assert _children(20) == 20
+
+
+@override_application_settings(dict(_default_thresholds, **{
+        'transaction_tracer.transaction_threshold': 0.05}))
+@background_task(name='test_unsampled_metrics_only_threshold_reached')
+def test_unsampled_metrics_only_threshold_reached():
+    # Traces started once the transaction has run long enough to be saved
+    # as the slow transaction trace each have their own node, with those
+    # from before being collapsed.
+
+    with FunctionTrace('parent') as parent:
+        for _ in range(10):
+            with DatastoreTrace('Redis', None, 'get'):
+                pass
+
+        time.sleep(0.05)
+
+        for _ in range(10):
+            with DatastoreTrace('Redis', None, 'get'):
+                pass
+
+    assert len(parent.children) == 11
+
+
+@override_application_settings(dict(_default_thresholds, **{
+        'transaction_tracer.explain_threshold': 0.0}))
+@background_task(name='test_unsampled_metrics_only_slow_sql')
+def test_unsampled_metrics_only_slow_sql():
+    # Database traces over the explain threshold keep their own nodes so
+    # they can be reported as slow SQL.
+
+    assert _children(5, DatabaseTrace, ('select 1',)) == 5
+    assert len(current_transaction()._slow_sql) == 5
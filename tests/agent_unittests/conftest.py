@@ -15,6 +15,7 @@
 import pytest
 import sys
 import tempfile
+import newrelic.packages.six as six
 from newrelic.core.agent import agent_instance
 from testing_support.fixtures import collector_agent_registration_fixture
 
@@ -26,6 +27,9 @@ _default_settings = {
     'debug.record_transaction_failure': True,
 }
 
+if six.PY2:
+    collect_ignore = ['test_trace_cache_asyncio.py']
+
 collector_agent_registration = collector_agent_registration_fixture(
         app_name='Python Agent Test (agent_unittests)',
         default_settings=_default_settings)
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import pytest
+import threading
 from newrelic.core.agent import Agent
 from newrelic.core.config import finalize_application_settings
 from testing_support.fixtures import override_generic_settings
@@ -73,3 +74,62 @@ def test_agent_final_harvest(agent):
 
     assert agent._applications['fake'].harvest_flexible == 1
     assert agent._applications['fake'].harvest_default == 1
+
+
+class ConcurrentFakeApplication(FakeApplication):
+    harvesting = 0
+    max_harvesting = 0
+    lock = threading.Lock()
+
+    def __init__(self, name, *args, **kwargs):
+        super(ConcurrentFakeApplication, self).__init__(*args, **kwargs)
+        self.name = name
+        self.calls = []
+
+    def harvest(self, shutdown=False, flexible=False, *args, **kwargs):
+        cls = type(self)
+
+        with cls.lock:
+            cls.harvesting += 1
+            cls.max_harvesting = max(cls.max_harvesting, cls.harvesting)
+
+        # Give the other applications a chance to start harvesting.
+        threading.Event().wait(0.05)
+
+        self.calls.append(flexible and 'flexible' or 'default')
+        super(ConcurrentFakeApplication, self).harvest(shutdown, flexible)
+
+        with cls.lock:
+            cls.harvesting -= 1
+
+
+@override_generic_settings(SETTINGS, dict(_override_settings, **{
+    'harvest_executor.max_workers': 2,
+}))
+def test_agent_concurrent_final_harvest():
+    agent = Agent(SETTINGS)
+    applications = [ConcurrentFakeApplication('app%d' % i) for i in range(3)]
+    agent._applications = dict((a.name, a) for a in applications)
+
+    agent.activate_agent()
+    agent.shutdown_agent(timeout=5)
+    assert not agent._harvest_thread.is_alive()
+
+    # Harvests are bounded by the worker pool and the flexible harvest of
+    # every application completes before any default harvest starts.
+
+    assert ConcurrentFakeApplication.max_harvesting == 2
+
+    for application in applications:
+        assert application.calls == ['flexible', 'default']
+
+
+def test_agent_harvest_loop_error_stops_executor(agent, monkeypatch):
+    def run():
+        raise RuntimeError('harvest loop failed')
+
+    monkeypatch.setattr(agent._scheduler, 'run', run)
+
+    agent._harvest_loop()
+
+    assert agent._harvest_executor._shutdown
@@ -12,9 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import time
+
 from newrelic.core.application import Application
 from newrelic.core.config import global_settings
-from newrelic.network.exceptions import ForceAgentDisconnect
+from newrelic.network.exceptions import (ForceAgentDisconnect,
+        RetryDataForRequest)
 
 from testing_support.fixtures import (override_generic_settings,
         failing_endpoint)
@@ -34,3 +38,21 @@ def test_http_gone_stops_connect():
     # The agent must not reattempt a connection after a ForceAgentDisconnect.
     # If it does, we'll end up with a session here.
     assert not app._active_session
+
+
+@override_generic_settings(SETTINGS, {
+    'developer_mode': True,
+})
+@failing_endpoint('preconnect', raises=functools.partial(RetryDataForRequest,
+        retry_after=600))
+def test_connect_retry_honours_retry_after(monkeypatch):
+    delays = []
+    monkeypatch.setattr(time, 'sleep', delays.append)
+
+    app = Application('Python Agent Test (agent_unittests-connect)')
+    app.connect_to_data_collector(None)
+
+    # The agent must wait as long as the data collector asked before
+    # reattempting the connection.
+    assert app._active_session
+    assert delays[-1] == 600
@@ -17,14 +17,21 @@ import logging
 import os
 import ssl
 import tempfile
+import zlib
 from collections import namedtuple
 
 import pytest
 
 import newrelic.packages.six as six
 from newrelic.common import certs, system_info
-from newrelic.common.agent_http import DeveloperModeClient
-from newrelic.common.encoding_utils import json_decode, serverless_payload_decode
+from newrelic.common.agent_http import CompressedPayload, DeveloperModeClient
+from newrelic.common.audit_log import read_records
+from newrelic.common.encoding_utils import (
+    json_decode,
+    json_encode,
+    json_encoder,
+    serverless_payload_decode,
+)
 from newrelic.common.utilization import CommonUtilization
 from newrelic.core.agent_protocol import AgentProtocol, ServerlessModeProtocol
 from newrelic.core.config import (
@@ -178,6 +185,44 @@ def override_system_info(monkeypatch):
     monkeypatch.setattr(os, "getpid", lambda *args, **kwargs: PID)
 
 
+def _backend_payload():
+    return (
+        "RUN_TOKEN",
+        {"bytes": b"\xe9", "text": u"\u00e9/", 1: (i for i in range(2))},
+        [{"large": 2 ** 70, "set": {1}}],
+    )
+
+
+@pytest.mark.parametrize("backend", ("auto", "orjson", "ujson", "json", "unknown"))
+def test_json_encoder_backends(backend):
+    encoder = json_encoder(backend)
+
+    encoded = encoder(_backend_payload())
+
+    assert isinstance(encoded, bytes)
+    assert json_decode(encoded.decode("utf-8")) == json_decode(
+        json_encode(_backend_payload())
+    )
+
+
+def test_send_encodes_payload_in_chunks():
+    settings = finalize_application_settings()
+    protocol = AgentProtocol(settings, client_cls=HttpClientRecorder)
+
+    events = ({"name": "event", "bytes": b"\xe9", "index": i} for i in range(10))
+    protocol.send("custom_event_data", ("RUN_TOKEN", {"reservoir_size": 10}, events))
+
+    expected = json_encode(
+        (
+            "RUN_TOKEN",
+            {"reservoir_size": 10},
+            [{"name": "event", "bytes": b"\xe9", "index": i} for i in range(10)],
+        )
+    )
+    payload = HttpClientRecorder.SENT[0].payload
+    assert json_decode(payload.decode("utf-8")) == json_decode(expected)
+
+
 @pytest.mark.parametrize("status_code", (None, 202))
 def test_send(status_code):
     HttpClientRecorder.STATUS_CODE = status_code
@@ -274,6 +319,26 @@ def test_status_code_exceptions(status_code, expected_exc, log_level, caplog):
     assert "123LICENSEKEY" not in message
 
 
+class CompressingHttpClientRecorder(HttpClientRecorder):
+    @staticmethod
+    def prepare_payload(chunks, endpoint=None, chunk_sizes=None):
+        data = b"".join(chunks)
+        return CompressedPayload(zlib.compress(data), "deflate", len(data), 0.0)
+
+
+def test_status_code_logs_uncompressed_content(caplog):
+    HttpClientRecorder.STATUS_CODE = 400
+    settings = finalize_application_settings()
+    protocol = AgentProtocol(settings, client_cls=CompressingHttpClientRecorder)
+
+    with pytest.raises(DiscardDataForRequest):
+        protocol.send("metric_data", (1, 2, 3))
+
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert "content=%r" % b"[1,2,3]" in message
+
+
 def test_protocol_http_error_causes_retry():
     protocol = AgentProtocol(
         finalize_application_settings(), client_cls=HttpClientException
@@ -575,6 +640,24 @@ def test_audit_logging():
     assert len(audit_log_contents) > 2
 
 
+def test_asynchronous_audit_logging(tmpdir):
+    path = str(tmpdir.join("audit.log"))
+    settings = finalize_application_settings(
+        {"audit_log_file": path, "audit_log.asynchronous": True}
+    )
+    protocol = AgentProtocol(settings, client_cls=HttpClientRecorder)
+    protocol.send("preconnect")
+
+    writer = protocol.client._audit_log_fp
+    assert writer.flush(5.0)
+
+    with open(path, "rb") as f:
+        records = list(read_records(f))
+
+    assert [metadata["type"] for metadata, _ in records] == ["request", "response"]
+    assert records[0][0]["params"]["method"] == "preconnect"
+
+
 @pytest.mark.parametrize("ca_bundle_path", (None, "custom",))
 def test_ca_bundle_path(monkeypatch, ca_bundle_path):
     # Pretend CA certificates are not available
@@ -0,0 +1,175 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+from newrelic.admin.audit_log import audit_log
+from newrelic.common.agent_http import DeveloperModeClient, HttpClient
+from newrelic.common.audit_log import (AuditLogWriter, decode_body,
+        read_records)
+
+
+def _records(path):
+    with open(path, 'rb') as fp:
+        return list(read_records(fp))
+
+
+def test_writer_writes_records(tmpdir):
+    path = str(tmpdir.join('audit.log'))
+    writer = AuditLogWriter(path)
+
+    body = b'{"metric_data": [1, 2, 3]}'
+    assert writer.put({'type': 'request', 'id': writer.next_id()}, body)
+    assert writer.put({'type': 'response', 'id': 1})
+    assert writer.flush(5.0)
+
+    assert _records(path) == [
+        ({'type': 'request', 'id': 1}, body),
+        ({'type': 'response', 'id': 1}, b''),
+    ]
+
+    writer.shutdown(5.0)
+
+    # Records logged once the writer thread has stopped are still written.
+
+    assert writer.put({'type': 'request', 'id': writer.next_id()}, b'late')
+    assert _records(path)[-1] == ({'type': 'request', 'id': 2}, b'late')
+
+
+def test_writer_rotates_file(tmpdir):
+    path = str(tmpdir.join('audit.log'))
+    writer = AuditLogWriter(path, max_bytes=200, backup_count=2)
+
+    for index in range(10):
+        writer.put({'id': index}, 40 * b'x')
+
+    assert writer.flush(5.0)
+    writer.shutdown(5.0)
+
+    assert sorted(os.listdir(str(tmpdir))) == ['audit.log', 'audit.log.1',
+            'audit.log.2']
+
+    for name in ('audit.log', 'audit.log.1', 'audit.log.2'):
+        assert os.path.getsize(str(tmpdir.join(name))) <= 200
+
+    ids = [metadata['id'] for name in ('audit.log.2', 'audit.log.1',
+            'audit.log') for metadata, _ in _records(str(tmpdir.join(name)))]
+
+    assert ids == sorted(ids)
+    assert ids[-1] == 9
+
+
+def test_writers_sharing_file_rotate_it(tmpdir):
+    # Writers in separate processes sharing the same file each open the
+    # file themselves, as is done by separate writers in one process.
+
+    path = str(tmpdir.join('audit.log'))
+    writers = [AuditLogWriter(path, max_bytes=200, backup_count=10)
+            for _ in range(2)]
+
+    for index in range(10):
+        writer = writers[index % 2]
+        writer.put({'id': index}, 40 * b'x')
+        assert writer.flush(5.0)
+
+    for writer in writers:
+        writer.shutdown(5.0)
+
+    names = sorted(os.listdir(str(tmpdir)))
+
+    for name in names:
+        assert os.path.getsize(str(tmpdir.join(name))) <= 200
+
+    ids = [metadata['id'] for name in reversed(names)
+            for metadata, _ in _records(str(tmpdir.join(name)))]
+
+    assert ids == list(range(10))
+
+
+def test_writer_put_after_shutdown_while_writing(tmpdir):
+    path = str(tmpdir.join('audit.log'))
+    writer = AuditLogWriter(path)
+
+    writer.put({'id': 1})
+    assert writer.flush(5.0)
+
+    # Where the writer thread is still writing records once shutdown, any
+    # later records are left for it to write.
+
+    with writer._notify:
+        writer._shutdown = True
+        writer._writing = True
+
+        assert writer.put({'id': 2})
+        assert list(writer._queue) == [({'id': 2}, b'')]
+
+        writer._writing = False
+        writer._notify.notify_all()
+
+    writer._thread.join(5.0)
+
+    assert [metadata['id'] for metadata, _ in _records(path)] == [1, 2]
+
+
+def test_writer_drops_records_when_queue_full(tmpdir):
+    writer = AuditLogWriter(str(tmpdir.join('audit.log')), queue_size=1)
+
+    # Hold the lock so that the writer thread cannot drain the queue.
+
+    with writer._notify:
+        results = [writer.put({'id': index}) for index in range(3)]
+
+    assert results == [True, False, False]
+    assert writer.dropped == 2
+
+    writer.shutdown(5.0)
+
+
+@pytest.mark.parametrize('compressed', (False, True))
+def test_client_audit_log_round_trip(tmpdir, capsys, compressed):
+    path = str(tmpdir.join('audit.log'))
+    writer = AuditLogWriter(path)
+
+    client = DeveloperModeClient('localhost', 1, audit_log_fp=writer)
+
+    payload = b'[{"name": "value"}]'
+
+    if compressed:
+        payload = HttpClient('localhost', compression_threshold=0,
+                compression_method='deflate').prepare_payload((payload,))
+        assert payload.method == 'deflate'
+
+    client.send_request(params={'method': 'metric_data'}, payload=payload)
+
+    assert writer.flush(5.0)
+
+    (request, body), (response, _) = _records(path)
+
+    assert request['type'] == 'request'
+    assert request['params'] == {'method': 'metric_data'}
+    assert response['type'] == 'response'
+    assert response['id'] == request['id']
+    assert decode_body(request, body) == b'[{"name": "value"}]'
+
+    audit_log([path])
+
+    out, _ = capsys.readouterr()
+
+    assert "URL: 'https://fake-collector.newrelic.com" in out
+    assert "DATA: [{'name': 'value'}]" in out
+    assert "STATUS: 200" in out
+
+    writer.shutdown(5.0)
@@ -0,0 +1,83 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from newrelic.core.harvest_executor import HarvestExecutor
+
+
+@pytest.mark.parametrize('max_workers', (1, 3))
+def test_executor_runs_all_items(max_workers):
+    executor = HarvestExecutor('test', max_workers)
+    threads = {}
+
+    def _record(item):
+        threads[item] = threading.current_thread()
+
+    executor.run(_record, range(6))
+
+    assert sorted(threads) == list(range(6))
+
+    if max_workers == 1:
+        assert set(threads.values()) == set([threading.current_thread()])
+    else:
+        assert threading.current_thread() not in threads.values()
+
+    executor.shutdown(timeout=5.0)
+
+
+def test_executor_waits_for_slow_items():
+    executor = HarvestExecutor('test', 2)
+    completed = []
+
+    def _harvest(item):
+        if item == 0:
+            threading.Event().wait(0.1)
+        completed.append(item)
+
+    executor.run(_harvest, range(2))
+
+    assert sorted(completed) == [0, 1]
+
+    executor.shutdown(timeout=5.0)
+
+
+def test_executor_survives_exceptions():
+    executor = HarvestExecutor('test', 2)
+    completed = []
+
+    def _harvest(item):
+        if item == 0:
+            raise ValueError('harvest failed')
+        completed.append(item)
+
+    executor.run(_harvest, range(3))
+    executor.run(_harvest, range(3))
+
+    assert sorted(completed) == [1, 1, 2, 2]
+
+    executor.shutdown(timeout=5.0)
+
+
+def test_executor_runs_inline_after_shutdown():
+    executor = HarvestExecutor('test', 2)
+    executor.shutdown()
+
+    threads = []
+    executor.run(lambda item: threads.append(threading.current_thread()),
+            range(2))
+
+    assert threads == [threading.current_thread()] * 2
@@ -16,6 +16,7 @@ import random
 import pytest
 import six
 import tempfile
+import threading
 import time
 
 from newrelic.common.object_wrapper import (transient_function_wrapper,
@@ -25,7 +26,9 @@ from testing_support.fixtures import (override_generic_settings,
         function_not_called, failing_endpoint)
 
 from newrelic.common.agent_http import DeveloperModeClient
+from newrelic.common.encoding_utils import json_decode
 from newrelic.core.application import Application
+from newrelic.core.harvest_schedule import HarvestSchedule
 from newrelic.core.stats_engine import CustomMetrics, SampledDataSet
 from newrelic.core.transaction_node import TransactionNode
 from newrelic.core.root_node import RootNode
@@ -33,7 +36,8 @@ from newrelic.core.custom_event import create_custom_event
 from newrelic.core.error_node import ErrorNode
 from newrelic.core.function_node import FunctionNode
 
-from newrelic.network.exceptions import RetryDataForRequest, ForceAgentDisconnect
+from newrelic.network.exceptions import (RetryDataForRequest,
+        ForceAgentDisconnect, DiscardDataForRequest, PayloadTooLarge)
 
 settings = global_settings()
 
@@ -420,6 +424,247 @@ def test_failed_spans_harvest(span_events_enabled):
     _test()
 
 
+_concurrent_upload_settings = {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'distributed_tracing.enabled': True,
+    'span_events.enabled': True,
+    'harvest_executor.max_upload_workers': 4,
+}
+
+
+def _populate_concurrent_upload_app():
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    app._stats_engine.span_events.add('span')
+    app._stats_engine.transaction_events.add('transaction')
+    app._stats_engine.record_custom_metric('Custom/concurrent_uploads', 1)
+
+    return app
+
+
+@override_generic_settings(settings, _concurrent_upload_settings)
+def test_concurrent_uploads_sent_from_workers():
+    threads = {}
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def _record_thread(wrapped, instance, args, kwargs):
+        threads[args[0]] = threading.current_thread()
+        return wrapped(*args, **kwargs)
+
+    app = _populate_concurrent_upload_app()
+
+    _record_thread(app.harvest)()
+
+    for method in ('span_event_data', 'analytic_event_data', 'metric_data'):
+        assert threads[method] is not threading.current_thread()
+
+    assert app._stats_engine.span_events.num_samples == 0
+    assert app._stats_engine.transaction_events.num_samples == 0
+
+
+@failing_endpoint('span_event_data')
+@override_generic_settings(settings, _concurrent_upload_settings)
+def test_concurrent_uploads_retry_rolls_back_failed_upload():
+    app = _populate_concurrent_upload_app()
+    period_start = app._period_start
+
+    app.harvest()
+
+    # Only the span events which failed to send are rolled back. The metric
+    # data was accepted so the reporting period has ended.
+
+    assert app._stats_engine.span_events.num_samples == 1
+    assert app._stats_engine.transaction_events.num_samples == 0
+    assert ('Custom/concurrent_uploads', '') not in (
+            app._stats_engine.stats_table)
+    assert app._period_start != period_start
+
+
+@failing_endpoint('metric_data', raises=DiscardDataForRequest)
+@override_generic_settings(settings, _concurrent_upload_settings)
+def test_concurrent_uploads_discard_drops_failed_upload():
+    app = _populate_concurrent_upload_app()
+    period_start = app._period_start
+
+    app.harvest()
+
+    assert app._discard_count == 1
+    assert app._stats_engine.span_events.num_samples == 0
+    assert ('Custom/concurrent_uploads', '') not in (
+            app._stats_engine.stats_table)
+    assert app._period_start == period_start
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'distributed_tracing.enabled': True,
+    'span_events.enabled': True,
+})
+def test_oversized_event_payload_split():
+    sent = []
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def _reject_large_payloads(wrapped, instance, args, kwargs):
+        method, payload = args
+        if method == 'span_event_data':
+            events = list(payload[2])
+            if len(events) > 3:
+                raise PayloadTooLarge(len(events))
+            sent.append((payload[1], events))
+        return wrapped(*args, **kwargs)
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    for index in range(10):
+        app._stats_engine.span_events.add(index)
+
+    _reject_large_payloads(app.harvest)()
+
+    assert sorted(event for _, events in sent for event in events) == \
+            list(range(10))
+    assert sum(info['events_seen'] for info, _ in sent) == 10
+    assert sum(info['reservoir_size'] for info, _ in sent) == \
+            settings.event_harvest_config.harvest_limits.span_event_data
+
+    metrics = app._stats_engine.stats_table
+    assert metrics[('Supportability/Python/Collector/Split/'
+            'span_event_data', '')].call_count >= 3
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'distributed_tracing.enabled': True,
+    'span_events.enabled': True,
+})
+def test_oversized_event_payload_split_by_encoded_size():
+    sent = []
+
+    @transient_function_wrapper('newrelic.common.agent_http',
+            'DeveloperModeClient.send_request')
+    def _reject_first_payload(wrapped, instance, args, kwargs):
+        params = kwargs.get('params') or {}
+        if params.get('method') == 'span_event_data':
+            sent.append(json_decode(kwargs['payload'].decode('utf-8'))[2])
+            if len(sent) == 1:
+                return 413, b''
+        return wrapped(*args, **kwargs)
+
+    encoded = []
+
+    @transient_function_wrapper('json', 'dumps')
+    def _record_encoded(wrapped, instance, args, kwargs):
+        encoded.append(args[0])
+        return wrapped(*args, **kwargs)
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    large = 'x' * 1000
+    app._stats_engine.span_events.add(large)
+    for index in range(9):
+        app._stats_engine.span_events.add(index)
+
+    _record_encoded(_reject_first_payload(app.harvest))()
+
+    # The events are split by the size they were encoded as in the
+    # rejected payload, so the large event is sent in a batch of its own,
+    # with each event only being encoded again when its batch is sent.
+
+    assert sent[1:] == [[large], list(range(9))]
+    assert encoded.count(large) == 2
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'distributed_tracing.enabled': True,
+    'span_events.enabled': True,
+})
+def test_oversized_event_payload_split_partial_failure():
+    sent = []
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def _fail_last_batch(wrapped, instance, args, kwargs):
+        method, payload = args
+        if method == 'span_event_data':
+            events = list(payload[2])
+            if len(events) > 5:
+                raise PayloadTooLarge(len(events))
+            if 9 in events:
+                raise RetryDataForRequest()
+            sent.extend(events)
+        return wrapped(*args, **kwargs)
+
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    for index in range(10):
+        app._stats_engine.span_events.add(index)
+
+    _fail_last_batch(app.harvest)()
+
+    # Only the events of the batch which failed are rolled back into the
+    # next harvest, as the batch before it was accepted.
+
+    rolled_back = sorted(app._stats_engine.span_events)
+
+    assert sent
+    assert sorted(sent + rolled_back) == list(range(10))
+    assert app._stats_engine.span_events.num_seen == len(rolled_back)
+
+
+@failing_endpoint('span_event_data')
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'distributed_tracing.enabled': True,
+    'span_events.enabled': True,
+})
+def test_harvest_spool_replays_failed_upload(tmpdir, monkeypatch):
+    monkeypatch.setattr(settings.harvest_spool, 'directory', str(tmpdir))
+
+    sent = []
+
+    @transient_function_wrapper('newrelic.core.agent_protocol',
+            'AgentProtocol.send')
+    def _record_sent(wrapped, instance, args, kwargs):
+        result = wrapped(*args, **kwargs)
+        sent.append(args)
+        return result
+
+    app = _populate_concurrent_upload_app()
+    _record_sent(app.harvest)()
+
+    # The span events are written to the spool rather than being rolled
+    # back into the next harvest.
+
+    assert app._stats_engine.span_events.num_samples == 0
+    assert len(app.harvest_spool(settings)) > 0
+    assert 'span_event_data' not in [args[0] for args in sent]
+
+    del sent[:]
+    _record_sent(app.harvest)()
+
+    spooled = [payload for method, payload in sent
+            if method == 'span_event_data']
+
+    assert len(spooled) == 1
+    assert spooled[0][0] == app._active_session.agent_run_id
+    assert spooled[0][2] == ['span']
+    assert len(app.harvest_spool(settings)) == 0
+
+    metrics = app._stats_engine.stats_table
+    assert metrics[('Supportability/Python/HarvestSpool/'
+            'Replayed/span_event_data', '')].call_count == 1
+
+    app.internal_agent_shutdown(restart=False)
+
+
 @override_generic_settings(settings, {
     'developer_mode': True,
     'license_key': '**NOT A LICENSE KEY**',
@@ -450,6 +695,84 @@ def test_transaction_count(transaction_node):
     assert app._transaction_count == 0
 
 
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'collect_custom_events': False,
+    'transaction_recorder.thread_local_stats': True,
+})
+def test_thread_local_stats_shards(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    threads = [threading.Thread(target=app.record_transaction,
+            args=(transaction_node,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    app.record_transaction(transaction_node)
+
+    # Transactions are held in the shards until harvest
+    assert len(app._stats_shards) == 3
+    assert app._transaction_count == 0
+    assert app._stats_engine.transaction_events.num_seen == 0
+
+    expected_metrics = (
+        ('Supportability/Python/RequestSampler/requests', 1),
+        ('Supportability/Python/RecordTransaction/Shards/Count', 1),
+        ('Supportability/Python/RecordTransaction/Shards/Merge', 1),
+    )
+
+    @validate_metric_payload(expected_metrics)
+    def _test():
+        app.harvest()
+
+    _test()
+
+    # Shards for threads which have exited are discarded on harvest
+    assert len(app._stats_shards) == 1
+    assert app._transaction_count == 0
+
+
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'collect_custom_events': False,
+    'transaction_recorder.asynchronous': True,
+})
+def test_asynchronous_transaction_recorder(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    for _ in range(3):
+        app.record_transaction(transaction_node)
+
+    expected_metrics = (
+        ('Supportability/Python/RequestSampler/requests', 1),
+        ('Supportability/Python/RecordTransaction/Queue/Depth', 1),
+        ('Supportability/Python/RecordTransaction/Queue/Dropped', 0),
+    )
+
+    @validate_metric_payload(expected_metrics)
+    def _test():
+        app.harvest()
+
+    _test()
+
+    # Harvest flushes the queued transactions before the snapshot, so
+    # nothing is left over for the next harvest.
+
+    assert app._transaction_count == 0
+    assert app._stats_engine.transaction_events.num_seen == 0
+
+    app.harvest(shutdown=True)
+    assert not app._transaction_recorder.active
+
+
 @override_generic_settings(settings, {
     'developer_mode': True,
     'license_key': '**NOT A LICENSE KEY**',
@@ -510,6 +833,32 @@ def test_reservoir_sizes(transaction_node):
     assert app._stats_engine.span_events.num_samples == 102
 
 
+@function_not_called('newrelic.core.node_mixin',
+        'GenericNodeMixin.span_event')
+@override_generic_settings(settings, {
+    'developer_mode': True,
+    'license_key': '**NOT A LICENSE KEY**',
+    'feature_flag': set(),
+    'distributed_tracing.enabled': True,
+    'event_harvest_config.harvest_limits.span_event_data': 1,
+})
+def test_span_events_below_priority_floor_not_built(transaction_node):
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    # Fill the span event reservoir with an event the transaction cannot
+    # displace.
+    app._stats_engine.span_events.add('event', priority=2.0)
+
+    app.record_transaction(transaction_node)
+
+    # The span events are counted as seen without being built. Add 1 for
+    # the root span.
+    assert app._stats_engine.span_events.num_samples == 1
+    assert app._stats_engine.span_events.num_seen == 1 + 102
+    assert list(app._stats_engine.span_events) == ['event']
+
+
 @pytest.mark.parametrize('harvest_name, event_name', [
     ('analytic_event_data', 'transaction_events'),
     ('error_event_data', 'error_events'),
@@ -825,6 +1174,65 @@ def test_default_events_harvested(whitelist_event):
     assert app._stats_engine.metrics_count() == 1
 
 
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'license_key': '**NOT A LICENSE KEY**',
+})
+def test_flexible_harvest_data_types():
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    settings.event_harvest_config.whitelist = frozenset(
+            ('custom_event_data', 'span_event_data'))
+    app._stats_engine.reset_stats(settings)
+
+    app._stats_engine.custom_events.add('custom event')
+    app._stats_engine.span_events.add('span event')
+    app._stats_engine.span_events.add('span event')
+
+    observations = app.harvest(flexible=True,
+            data_types=('span_event_data',))
+
+    limit = settings.event_harvest_config.harvest_limits.span_event_data
+    assert observations == {'span_event_data': (2, limit, limit)}
+    assert app._stats_engine.span_events.num_seen == 0
+    assert app._stats_engine.custom_events.num_seen == 1
+
+
+@override_generic_settings(settings, {
+        'developer_mode': True,
+        'license_key': '**NOT A LICENSE KEY**',
+        'event_harvest_config.report_period_ms': 5000,
+        'event_harvest_config.harvest_limits.span_event_data': 1000,
+})
+def test_set_harvest_scale_scales_reservoir():
+    app = Application('Python Agent Test (Harvest Loop)')
+    app.connect_to_data_collector(None)
+
+    settings.event_harvest_config.whitelist = frozenset(('span_event_data',))
+    app._stats_engine.reset_stats(settings)
+
+    # The schedule is created before the session, so with the default
+    # reporting period rather than that given by the data collector. The
+    # reservoir is sized for the reporting period of the session.
+
+    schedule = HarvestSchedule('span_event_data', 60.0, 2.5, 60.0)
+
+    for _ in range(5):
+        schedule.observe([(4000, 1000, 1000)])
+
+    assert schedule.period == 2.5
+
+    app.set_harvest_scale('span_event_data', schedule)
+    app.harvest(flexible=True, data_types=('span_event_data',))
+
+    assert app._stats_engine.span_events.capacity == 500
+
+    metric = ('Supportability/Python/HarvestPeriod/span_event_data/'
+            'ReservoirSize', '')
+    assert app._stats_engine.stats_table[metric].total_call_time == 500
+
+
 @failing_endpoint('analytic_event_data')
 @override_generic_settings(settings, {
         'developer_mode': True,
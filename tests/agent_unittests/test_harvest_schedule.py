@@ -0,0 +1,162 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.harvest_schedule import HarvestSchedule
+from newrelic.core.internal_metrics import InternalTraceContext
+from newrelic.core.stats_engine import CustomMetrics
+
+
+def _observe(schedule, observations):
+    metrics = CustomMetrics()
+
+    with InternalTraceContext(metrics):
+        period = schedule.observe(observations)
+
+    return period, dict(metrics.metrics())
+
+
+def _steady(schedule, rate, limit, harvests=10):
+    # Events arrive at a steady rate, with the reservoir sized as the
+    # schedule decided after the previous harvest.
+
+    periods = []
+    capacity = limit
+
+    for _ in range(harvests):
+        num_seen = int(rate * schedule.period)
+        periods.append(schedule.observe([(num_seen, capacity, limit)]))
+        capacity = max(1, int(limit * schedule.reservoir_scale(60.0)))
+
+    return periods, num_seen, capacity
+
+
+def test_overflow_shortens_period():
+    schedule = HarvestSchedule('span_event_data', 60.0, 5.0, 60.0)
+
+    period, metrics = _observe(schedule,
+            [(10, 100, 100), (150, 100, 100)])
+
+    assert period == schedule.period == 30.0
+    assert schedule.reservoir_scale(60.0) == 0.5
+
+    prefix = 'Supportability/Python/HarvestPeriod/span_event_data/'
+    assert metrics[prefix + 'Shortened'][0] == 1
+    assert metrics[prefix + 'Period'][1] == 30.0
+    assert metrics[prefix + 'Fill'][1] == 1.5
+    assert metrics[prefix + 'Load'][1] == 1.5
+    assert prefix + 'Lengthened' not in metrics
+
+
+def test_period_bounded_by_minimum():
+    schedule = HarvestSchedule('span_event_data', 60.0, 20.0, 60.0)
+
+    for _ in range(3):
+        period, metrics = _observe(schedule, [(200, 100, 100)])
+
+    assert period == 20.0
+    assert not any(name.endswith('/Shortened') for name in metrics)
+
+
+def test_sparse_reservoir_lengthens_period():
+    schedule = HarvestSchedule('custom_event_data', 60.0, 5.0, 240.0)
+
+    period, metrics = _observe(schedule, [(10, 100, 100)])
+
+    assert period == 120.0
+    assert metrics['Supportability/Python/HarvestPeriod/custom_event_data/'
+            'Lengthened'][0] == 1
+
+    period, _ = _observe(schedule, [])
+    period, _ = _observe(schedule, [])
+
+    assert period == 240.0
+
+
+@pytest.mark.parametrize('observations', (
+    [(50, 100, 100)],
+    [(100, 100, 100)],
+    [(100, 100, 100), (10, 100, 100)],
+))
+def test_period_unchanged(observations):
+    schedule = HarvestSchedule('error_event_data', 60.0, 5.0, 120.0)
+
+    period, metrics = _observe(schedule, observations)
+
+    assert period == 60.0
+    assert not any(name.endswith(('/Shortened', '/Lengthened'))
+            for name in metrics)
+
+
+def test_initial_period_within_bounds():
+    schedule = HarvestSchedule('span_event_data', 60.0, 5.0, 30.0)
+
+    assert schedule.period == 30.0
+    assert schedule.reservoir_scale(60.0) == 0.5
+
+
+def test_reservoir_sized_from_rate_seen():
+    schedule = HarvestSchedule('custom_event_data', 60.0, 5.0, 60.0)
+
+    _observe(schedule, [(30, 100, 100)])
+
+    assert schedule.period == 60.0
+    assert schedule.reservoir_scale(60.0) == 0.6
+
+
+def test_reservoir_bounded_by_harvest_limit():
+    schedule = HarvestSchedule('custom_event_data', 60.0, 5.0, 60.0)
+
+    _observe(schedule, [(90, 100, 100)])
+
+    assert schedule.period == 60.0
+    assert schedule.reservoir_scale(60.0) == 1.0
+
+
+def test_reservoir_sized_for_session_report_period():
+    # The reporting period given by the data collector is shorter than
+    # that used when the schedule was created, with the harvest limits
+    # being for that shorter period.
+
+    schedule = HarvestSchedule('span_event_data', 60.0, 5.0, 60.0)
+
+    for _ in range(4):
+        _observe(schedule, [(2000, 833, 833)])
+
+    assert schedule.period == 5.0
+    assert schedule.reservoir_scale(5.0) == 1.0
+    assert schedule.reservoir_scale(60.0) == 5.0 / 60.0
+
+
+@pytest.mark.parametrize('rate,period', (
+    (0.5, 60.0),
+    (5.0, 15.0),
+    (20.0, 5.0),
+))
+def test_period_converges(rate, period):
+    schedule = HarvestSchedule('span_event_data', 60.0, 5.0, 60.0)
+
+    periods, _, _ = _steady(schedule, rate, 100)
+
+    assert periods[-5:] == [period] * 5
+
+
+def test_sparse_reservoir_neither_overflows_nor_empty():
+    schedule = HarvestSchedule('span_event_data', 60.0, 5.0, 60.0)
+
+    _, num_seen, capacity = _steady(schedule, 0.5, 100)
+
+    assert num_seen <= capacity
+    assert num_seen / float(capacity) >= 0.25
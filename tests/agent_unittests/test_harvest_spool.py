@@ -0,0 +1,232 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import os
+import time
+
+import pytest
+
+from newrelic.core.harvest_spool import (HarvestSpool, HarvestSpoolDrop,
+        HarvestSpoolRetry, spool_path)
+from newrelic.network.exceptions import RetryDataForRequest
+
+
+@pytest.fixture
+def path(tmpdir):
+    return spool_path(str(tmpdir), 'Python Agent Test (Harvest Spool)')
+
+
+def _replay(spool):
+    replayed = []
+    spool.replay(lambda method, payload: replayed.append((method, payload)))
+    return replayed
+
+
+def test_replay_in_order(path):
+    spool = HarvestSpool(path, 4096, None)
+
+    assert spool.append('span_event_data', [{'reservoir_size': 1}, ['a']])
+    assert spool.append('error_data', [['b']])
+
+    assert _replay(spool) == [
+        ('span_event_data', [{'reservoir_size': 1}, ['a']]),
+        ('error_data', [['b']]),
+    ]
+    assert _replay(spool) == []
+    assert len(spool) == 0
+
+    assert spool.stats() == {
+        'Spooled': 2,
+        'Spooled/span_event_data': 1,
+        'Spooled/error_data': 1,
+        'Replayed': 2,
+        'Replayed/span_event_data': 1,
+        'Replayed/error_data': 1,
+    }
+    assert spool.stats() == {}
+
+
+def test_resume_after_reopen(path):
+    spool = HarvestSpool(path, 4096, None)
+    spool.append('error_data', [['a']])
+    spool.append('error_data', [['b']])
+
+    def _send(method, payload):
+        if payload == [['b']]:
+            raise RetryDataForRequest()
+
+    with pytest.raises(RetryDataForRequest):
+        spool.replay(_send)
+
+    spool.close()
+
+    # Only the payload which was not accepted is replayed by a new process.
+
+    spool = HarvestSpool(path, 4096, None)
+    assert _replay(spool) == [('error_data', [['b']])]
+
+
+def _random_payload(size):
+    return [[binascii.hexlify(os.urandom(size)).decode('ascii')]]
+
+
+def test_full_spool_drops_payload(path):
+    spool = HarvestSpool(path, 256, None)
+
+    assert spool.append('error_data', [['a']])
+    assert not spool.append('error_data', _random_payload(256))
+
+    assert spool.stats()['Dropped/error_data'] == 1
+    assert _replay(spool) == [('error_data', [['a']])]
+
+
+def test_append_compacts_unsent_records(path):
+    spool = HarvestSpool(path, 512, None)
+
+    spool.append('error_data', _random_payload(256))
+    spool.append('error_data', [['a']])
+
+    def _send(method, payload):
+        if payload == [['a']]:
+            raise RetryDataForRequest()
+
+    with pytest.raises(RetryDataForRequest):
+        spool.replay(_send)
+
+    # Room for the new payload is only available once the unsent record
+    # has been moved to the start of the spool.
+
+    assert spool.append('error_data', _random_payload(96))
+
+    replayed = _replay(spool)
+
+    assert len(replayed) == 2
+    assert replayed[0] == ('error_data', [['a']])
+
+
+def test_expired_and_discarded_payloads_dropped(path, monkeypatch):
+    spool = HarvestSpool(path, 4096, 60.0)
+    spool.append('error_data', [['a']])
+
+    now = time.time() + 120.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+    spool.append('error_data', [['b']])
+    spool.append('error_data', [['c']])
+
+    def _send(method, payload):
+        if payload == [['b']]:
+            raise HarvestSpoolDrop()
+
+    spool.replay(_send)
+
+    assert len(spool) == 0
+
+    stats = spool.stats()
+    assert stats['Expired'] == 1
+    assert stats['Discarded'] == 1
+    assert stats['Replayed'] == 1
+
+
+def test_partially_sent_payload_respooled(path):
+    spool = HarvestSpool(path, 4096, None)
+    spool.append('span_event_data', [{'events_seen': 2}, ['a', 'b']])
+    spool.append('error_data', [['c']])
+
+    def _send(method, payload):
+        if method == 'span_event_data':
+            raise HarvestSpoolRetry([{'events_seen': 1}, ['b']])
+
+    spool.replay(_send)
+
+    # Only the part of the payload which was not accepted remains, written
+    # after the payloads which had not yet been replayed.
+
+    assert _replay(spool) == [
+        ('error_data', [['c']]),
+        ('span_event_data', [{'events_seen': 1}, ['b']]),
+    ]
+
+
+def test_other_process_spool_taken_over(path):
+    # A spool created while the shared spool file is in use, as in another
+    # worker process, uses a file of its own, the records of which are
+    # taken over once that spool is no longer in use.
+
+    spool = HarvestSpool(path, 4096, None)
+    spool.append('error_data', [['a']])
+
+    other = HarvestSpool(path, 4096, None)
+    other.append('error_data', [['b']])
+
+    assert other.path != path
+    assert os.path.exists(other.path)
+
+    other.close()
+    spool.close()
+
+    spool = HarvestSpool(path, 4096, None)
+
+    assert _replay(spool) == [('error_data', [['a']]),
+            ('error_data', [['b']])]
+    assert not os.path.exists(other.path)
+
+
+def test_other_process_spool_removed_when_empty(path):
+    spool = HarvestSpool(path, 4096, None)
+    spool.append('error_data', [['a']])
+
+    other = HarvestSpool(path, 4096, None)
+    other.append('error_data', [['b']])
+
+    assert _replay(other) == [('error_data', [['b']])]
+
+    other.close()
+
+    assert not os.path.exists(other.path)
+
+
+def test_other_process_takes_over_shared_spool(path):
+    spool = HarvestSpool(path, 4096, None)
+    spool.append('error_data', [['a']])
+
+    other = HarvestSpool(path, 4096, None)
+    other.append('error_data', [['b']])
+    other_path = other.path
+
+    spool.close()
+
+    # Once the shared spool file is no longer in use, the next replay
+    # switches over to it, along with the records spooled so far.
+
+    assert _replay(other) == [('error_data', [['a']]),
+            ('error_data', [['b']])]
+    assert other.path == path
+    assert not os.path.exists(other_path)
+
+
+def test_corrupt_records_discarded(path):
+    spool = HarvestSpool(path, 4096, None)
+    spool.append('error_data', [['a']])
+    spool.close()
+
+    with open(path, 'r+b') as spool_file:
+        spool_file.seek(48)
+        spool_file.write(b'corrupt')
+
+    spool = HarvestSpool(path, 4096, None)
+
+    assert _replay(spool) == []
+    assert len(spool) == 0
@@ -23,11 +23,18 @@ import pytest
 from newrelic.common import certs
 from newrelic.common.agent_http import (
     ApplicationModeClient,
+    ConnectionPoolRegistry,
     DeveloperModeClient,
     HttpClient,
     InsecureHttpClient,
     ServerlessModeClient,
 )
+from newrelic.common.compression import (
+    DEFAULT_LEVEL,
+    PAYLOAD_DICTIONARY,
+    ZDICT_SUPPORTED,
+    PayloadCompressor,
+)
 from newrelic.common.encoding_utils import ensure_str
 from newrelic.common.object_names import callable_name
 from newrelic.core.internal_metrics import InternalTraceContext
@@ -257,7 +264,8 @@ def test_http_close_connection_in_context_manager():
         (ApplicationModeClient, "deflate", 100),
     ),
 )
-def test_http_payload_compression(server, client_cls, method, threshold):
+@pytest.mark.parametrize("prepared", (False, True))
+def test_http_payload_compression(server, client_cls, method, threshold, prepared):
     payload = b"*" * 20
 
     internal_metrics = CustomMetrics()
@@ -269,9 +277,15 @@ def test_http_payload_compression(server, client_cls, method, threshold):
         compression_method=method,
         compression_threshold=threshold,
     ) as client:
+        if prepared:
+            # The payload is compressed as the chunks are produced.
+            prepared_payload = client.prepare_payload(iter((payload[:5], payload[5:])))
+        else:
+            prepared_payload = payload
+
         with InternalTraceContext(internal_metrics):
             status, data = client.send_request(
-                payload=payload, params={"method": "test"}
+                payload=prepared_payload, params={"method": "test"}
             )
 
     assert status == 200
@@ -305,7 +319,12 @@ def test_http_payload_compression(server, client_cls, method, threshold):
                 :2
             ] == [1, len(payload)]
 
-            assert len(internal_metrics) == 3
+            # Verify the compression ratio is recorded
+            assert internal_metrics["Supportability/Python/Collector/ZLIB/Ratio/test"][
+                :2
+            ] == [1, float(len(payload)) / payload_byte_len]
+
+            assert len(internal_metrics) == 4
         else:
             # Verify no ZLIB compression metrics were sent
             assert len(internal_metrics) == 1
@@ -336,6 +355,53 @@ def test_http_payload_compression(server, client_cls, method, threshold):
     assert sent_payload == payload
 
 
+@pytest.mark.skipif(not ZDICT_SUPPORTED, reason="zdict is not supported")
+def test_payload_compression_dictionary():
+    payload = b'[{"name":"Function/foo","scope":""},[1,2.0,1.0,2.0,2.0,4.0]]'
+
+    client = HttpClient(
+        "localhost",
+        compression_method="deflate",
+        compression_threshold=0,
+        compression_dictionary=PAYLOAD_DICTIONARY,
+    )
+    primed = client.prepare_payload((payload,))
+
+    client = HttpClient("localhost", compression_method="deflate", compression_threshold=0)
+    unprimed = client.prepare_payload((payload,))
+
+    assert primed.dictionary == PAYLOAD_DICTIONARY
+    assert len(primed) < len(unprimed)
+    assert primed.decompress() == payload
+
+
+def test_payload_compression_level_adapts_to_time_budget():
+    compressor = PayloadCompressor("gzip", time_budget=0.1)
+
+    assert compressor.level("metric_data") == DEFAULT_LEVEL
+
+    # Compression exceeding the time budget lowers the level.
+    for _ in range(3):
+        level = compressor.level("metric_data")
+        compressor.record("metric_data", level, 1000, 0.5)
+
+    assert compressor.level("metric_data") == DEFAULT_LEVEL - 3
+    assert compressor.level("span_event_data") == DEFAULT_LEVEL
+
+    # Compression comfortably within the time budget raises it again.
+    for _ in range(10):
+        level = compressor.level("metric_data")
+        compressor.record("metric_data", level, 1000, 0.001)
+
+    assert compressor.level("metric_data") == DEFAULT_LEVEL
+
+    # A configured level is never changed.
+    compressor = PayloadCompressor("gzip", level=9, time_budget=0.1)
+    compressor.record("metric_data", 9, 1000, 0.5)
+
+    assert compressor.level("metric_data") == 9
+
+
 def test_cert_path(server):
     with HttpClient("localhost", server.port, ca_bundle_path=SERVER_CERT) as client:
         status, data = client.send_request()
@@ -645,3 +711,68 @@ def test_closed_connection():
     with HttpClient("localhost", MockExternalHTTPServer.get_open_port()) as client:
         with pytest.raises(NetworkInterfaceException):
             client.send_request()
+
+
+def test_connection_pool_reused_across_clients(server):
+    pools = ConnectionPoolRegistry()
+    internal_metrics = CustomMetrics()
+
+    def _send():
+        with ApplicationModeClient(
+            "localhost",
+            server.port,
+            disable_certificate_validation=True,
+            connection_pools=pools,
+        ) as client:
+            client.send_request(payload=b"*", params={"method": "test"})
+            return client._connection
+
+    with InternalTraceContext(internal_metrics):
+        first = _send()
+        second = _send()
+
+    assert first is second
+    assert first.pool is not None
+
+    internal_metrics = dict(internal_metrics.metrics())
+    assert internal_metrics["Supportability/Python/Collector/Connections/New"][0] == 1
+    assert (
+        internal_metrics["Supportability/Python/Collector/Connections/Reused"][0] == 1
+    )
+
+
+def test_connection_pool_closed_when_idle(insecure_server):
+    pools = ConnectionPoolRegistry()
+
+    def _send():
+        client = InsecureHttpClient(
+            "localhost",
+            insecure_server.port,
+            connection_pools=pools,
+            connection_max_idle_time=0.0,
+        )
+        client.send_request(payload=b"*")
+        connection = client._connection
+        client.close_connection()
+        return connection
+
+    first = _send()
+    second = _send()
+
+    assert first is not second
+    assert first.pool is None
+
+
+def retry_later(self):
+    self.send_response(503)
+    self.send_header("Retry-After", "120")
+    self.end_headers()
+
+
+def test_retry_after():
+    with InsecureServer(handler=retry_later) as server:
+        client = InsecureHttpClient("localhost", server.port)
+        status, _ = client.send_request()
+
+    assert status == 503
+    assert client.retry_after() == 120
@@ -0,0 +1,78 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.reconnect import (MAX_RETRY_AFTER, ReconnectScheduler,
+        RetryBudget)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_scheduler_delays_grow_within_bounds():
+    scheduler = ReconnectScheduler(uniform=lambda low, high: high)
+
+    assert [scheduler.next_delay() for _ in range(5)] == [45.0, 135.0,
+            300.0, 300.0, 300.0]
+
+
+def test_scheduler_delays_are_jittered():
+    scheduler = ReconnectScheduler()
+    delays = [scheduler.next_delay() for _ in range(50)]
+
+    assert all(15.0 <= delay <= 300.0 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.parametrize('retry_after,expected', (
+    (None, 15.0),
+    (5, 15.0),
+    (600, 600),
+    (10 * MAX_RETRY_AFTER, MAX_RETRY_AFTER),
+))
+def test_scheduler_honours_retry_after(retry_after, expected):
+    scheduler = ReconnectScheduler(uniform=lambda low, high: low)
+
+    assert scheduler.next_delay(retry_after) == expected
+
+
+def test_retry_budget_shared_between_schedulers():
+    clock = FakeClock()
+    budget = RetryBudget(capacity=2, refill_interval=30.0, clock=clock)
+
+    first = ReconnectScheduler(budget, uniform=lambda low, high: low)
+    second = ReconnectScheduler(budget, uniform=lambda low, high: low)
+
+    assert first.next_delay() == 15.0
+    assert second.next_delay() == 15.0
+
+    # The budget is exhausted, so later retries wait for it to refill in
+    # turn, rather than all retrying together.
+
+    assert first.next_delay() == 30.0
+    assert second.next_delay() == 60.0
+
+    clock.now += 60.0
+
+    assert first.next_delay() == 30.0
+
+    clock.now += 300.0
+
+    assert second.next_delay() == 15.0
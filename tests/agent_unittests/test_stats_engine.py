@@ -0,0 +1,392 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.metric import ApdexMetric
+from newrelic.core.stats_engine import (ApdexStats, CountStats,
+        MetricStatsTable, SampledDataSet, StatsEngine, TimeStats,
+        _metric_rollup)
+
+
+def test_metric_table_time_metric_matches_time_stats():
+    table = MetricStatsTable()
+    expected = TimeStats(1, 2.0, 1.0, 2.0, 2.0, 4.0)
+
+    table.merge_raw_time_metric(('Function/foo', ''), 2.0, 1.0)
+    for duration in (0.5, 3.0):
+        table.merge_raw_time_metric(('Function/foo', ''), duration)
+        expected.merge_raw_time_metric(duration)
+
+    stats = table[('Function/foo', '')]
+
+    assert isinstance(stats, TimeStats)
+    assert stats == expected
+    assert stats.call_count == 3
+
+
+def test_metric_table_apdex_metric_matches_apdex_stats():
+    table = MetricStatsTable()
+    expected = ApdexStats(apdex_t=0.5)
+
+    for metric in (ApdexMetric('Apdex', 1, 0, 0, 0.5),
+            ApdexMetric('Apdex', 0, 1, 0, 0.25)):
+        table.merge_apdex_metric(('Apdex', ''), metric)
+        expected.merge_apdex_metric(metric)
+
+    stats = table[('Apdex', '')]
+
+    assert isinstance(stats, ApdexStats)
+    assert stats == expected
+
+
+def test_metric_table_count_stats_ignore_time_values():
+    table = MetricStatsTable()
+    table.merge_stats(('Count', ''), CountStats(call_count=2))
+    table.merge_raw_time_metric(('Count', ''), 10.0)
+    table.merge_stats(('Count', ''), CountStats(call_count=3))
+
+    stats = table[('Count', '')]
+
+    assert isinstance(stats, CountStats)
+    assert stats == [5, 0, 0, 0, 0, 0]
+
+
+def test_metric_table_counts_are_integers():
+    table = MetricStatsTable()
+    table.merge_raw_time_metric(('Time', ''), 1.5)
+    table.merge_apdex_metric(('Apdex', ''),
+            ApdexMetric('Apdex', 1, 0, 0, 0.5))
+
+    assert type(table[('Time', '')].call_count) is int
+    assert [type(value) for value in table[('Apdex', '')][:3]] == [int] * 3
+
+
+def test_metric_table_single_values():
+    table = MetricStatsTable()
+    table.merge_raw_time_metric(('Time', ''), 1.5)
+    table.merge_raw_time_metric(('Time', ''), 0.5)
+
+    assert table.call_count(('Time', '')) == 2
+    assert type(table.call_count(('Time', ''))) is int
+    assert table.total_call_time(('Time', '')) == 2.0
+
+    assert table.call_count(('Missing', '')) is None
+    assert table.total_call_time(('Missing', '')) is None
+
+
+@pytest.mark.parametrize('populated', (True, False))
+def test_metric_table_merge_table(populated):
+    table = MetricStatsTable()
+    other = MetricStatsTable()
+    expected = TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0)
+
+    if populated:
+        table.merge_raw_time_metric(('Function/foo', ''), 4.0)
+        expected = TimeStats(1, 4.0, 4.0, 4.0, 4.0, 16.0)
+        expected.merge_stats(TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+
+    other.merge_raw_time_metric(('Function/foo', ''), 1.0)
+    other.merge_stats(('Count', ''), CountStats(call_count=2))
+
+    table.merge_table(other)
+
+    assert len(table) == 2
+    assert table[('Function/foo', '')] == expected
+    assert isinstance(table[('Count', '')], CountStats)
+
+    # The merged table must not share storage with the source table.
+
+    other.merge_raw_time_metric(('Function/foo', ''), 1.0)
+    assert table[('Function/foo', '')] == expected
+
+
+def test_metric_table_normalized():
+    table = MetricStatsTable()
+    table.merge_raw_time_metric(('Function/a', ''), 1.0)
+    table.merge_raw_time_metric(('Function/b', ''), 2.0)
+    table.merge_raw_time_metric(('Function/c', 'scope'), 3.0)
+
+    def normalizer(name):
+        return name.replace('Function/a', 'Function/b'), False
+
+    normalized = table.normalized(normalizer)
+
+    assert sorted(normalized.keys()) == [('Function/b', ''),
+            ('Function/c', 'scope')]
+    assert normalized[('Function/b', '')].call_count == 2
+    assert normalized[('Function/b', '')].min_call_time == 1.0
+
+
+def _sequential_data_set(capacity, samples, priorities):
+    data_set = SampledDataSet(capacity)
+    for sample, priority in zip(samples, priorities):
+        data_set.add(sample, priority)
+    return data_set
+
+
+@pytest.mark.parametrize('capacity,count', (
+    (10, 5),
+    (10, 10),
+    (10, 100),
+    (0, 10),
+))
+def test_sampled_data_set_add_many_matches_add(capacity, count):
+    samples = list(range(count))
+    priorities = [(i * 7919) % 101 / 101.0 for i in samples]
+
+    expected = _sequential_data_set(capacity, samples, priorities)
+
+    data_set = SampledDataSet(capacity)
+    data_set.add_many(samples, priorities)
+
+    assert data_set.num_seen == expected.num_seen == count
+    assert sorted(data_set.samples) == sorted(expected.samples)
+    assert data_set.num_samples == min(capacity, count)
+
+
+def test_sampled_data_set_add_many_into_full_heap():
+    data_set = SampledDataSet(4)
+    data_set.add_many(range(4), (0.1, 0.2, 0.3, 0.4))
+    data_set.add_many(range(4, 8), (0.05, 0.5, 0.25, 0.01))
+
+    assert data_set.heap
+    assert sorted(data_set.samples) == [2, 3, 5, 6]
+    assert data_set.pq[0][0] == 0.25
+    assert data_set.num_seen == 8
+
+
+def test_sampled_data_set_add_many_random_priorities():
+    data_set = SampledDataSet(5)
+    data_set.add_many(range(20))
+
+    assert data_set.num_seen == 20
+    assert data_set.num_samples == 5
+    assert all(0.0 <= priority < 1.0 for priority, _, _ in data_set.pq)
+
+
+def test_sampled_data_set_merge_keeps_highest_priorities():
+    data_set = SampledDataSet(3)
+    data_set.add_many('abc', (0.1, 0.5, 0.9))
+
+    other = SampledDataSet(3)
+    other.add_many('defg', (0.2, 0.8, 0.95, 0.7))
+
+    data_set.merge(other)
+
+    assert sorted(data_set.samples) == ['c', 'e', 'f']
+    assert data_set.num_seen == 7
+
+
+def test_sampled_data_set_merge_bounds_queue_after_partial_merge():
+    # Merging a data set which has seen more samples than it retains must
+    # not stop the queue from being bounded by its capacity.
+
+    other = SampledDataSet(2)
+    other.add_many(range(10))
+
+    data_set = SampledDataSet(5)
+    data_set.merge(other)
+    data_set.add_many(range(10, 20))
+    for sample in range(20, 30):
+        data_set.add(sample)
+
+    assert data_set.num_seen == 30
+    assert data_set.num_samples == 5
+
+
+@pytest.mark.parametrize('capacity,count,expected', (
+    (2, 1, None),
+    (2, 2, 0.25),
+    (0, 0, float('inf')),
+))
+def test_sampled_data_set_min_priority(capacity, count, expected):
+    data_set = SampledDataSet(capacity)
+    data_set.add_many(range(count), (0.5, 0.25)[:count])
+
+    assert data_set.min_priority == expected
+
+
+def test_sampled_data_set_add_unsampled():
+    data_set = SampledDataSet(2)
+    data_set.add('a', 0.5)
+    data_set.add_unsampled(3)
+
+    assert data_set.num_seen == 4
+    assert list(data_set.samples) == ['a']
+
+
+@pytest.mark.parametrize('flexible', (True, False))
+def test_harvest_snapshot_swaps_in_standby(flexible):
+    settings = finalize_application_settings()
+    settings.event_harvest_config.whitelist = frozenset(('span_event_data',))
+
+    stats = StatsEngine()
+    stats.reset_stats(settings)
+    stats.record_custom_metric('Custom/standby', 1)
+    stats.span_events.add('span')
+    stats.custom_events.add('custom')
+
+    standby = stats.create_standby()
+    snapshot = stats.harvest_snapshot(flexible, standby)
+
+    if flexible:
+        # Only the whitelisted span events are harvested.
+        assert stats.span_events is standby.span_events
+        assert list(snapshot.span_events) == ['span']
+        assert list(stats.custom_events) == ['custom']
+        assert ('Custom/standby', '') in stats.stats_table
+    else:
+        assert stats.custom_events is standby.custom_events
+        assert stats.stats_table is standby.stats_table
+        assert list(snapshot.custom_events) == ['custom']
+        assert ('Custom/standby', '') in snapshot.stats_table
+        assert list(stats.span_events) == ['span']
+
+
+def test_harvest_snapshot_ignores_stale_standby():
+    stats = StatsEngine()
+    stats.reset_stats(finalize_application_settings())
+
+    standby = stats.create_standby()
+    stats.reset_stats(finalize_application_settings())
+
+    stats.harvest_snapshot(False, standby)
+
+    assert stats.custom_events is not standby.custom_events
+
+
+def test_metric_table_folded_keeps_heaviest_metrics():
+    table = MetricStatsTable()
+
+    for name, count in (('Custom/a', 3), ('Custom/b', 1), ('Custom/c', 2),
+            ('Supportability/d', 1)):
+        for _ in range(count):
+            table.merge_raw_time_metric((name, ''), 1.0)
+
+    def rollup(key, kind):
+        if key[0].startswith('Supportability/'):
+            return None
+        return ('Custom/all-folded', key[1])
+
+    folded, counts = table.folded(2, rollup)
+
+    assert sorted(folded.keys()) == [('Custom/a', ''),
+            ('Custom/all-folded', ''), ('Custom/c', ''),
+            ('Supportability/d', '')]
+    assert folded[('Custom/a', '')] == table[('Custom/a', '')]
+    assert folded[('Custom/all-folded', '')] == table[('Custom/b', '')]
+    assert counts == {('Custom/all-folded', ''): 1}
+
+    assert table.folded(3, rollup) == (table, {})
+
+
+def test_stats_engine_limits_metric_cardinality():
+    settings = finalize_application_settings()
+    settings.agent_limits.max_metric_names = 4
+
+    stats = StatsEngine()
+    stats.reset_stats(settings)
+
+    for _ in range(10):
+        stats.record_custom_metric('Custom/heavy', 1)
+
+    for index in range(20):
+        stats.record_custom_metric('Custom/user/%d' % index, 1)
+
+    # The table is bounded at twice the limit while recording.
+
+    assert stats.metrics_count() <= 8 + 3
+
+    metrics = dict((key['name'], value) for key, value in stats.metric_data())
+
+    assert metrics['Custom/heavy'][0] == 10
+    assert sum(value[0] for name, value in metrics.items()
+            if name.startswith('Custom/')) == 30
+    assert len([name for name in metrics
+            if not name.startswith('Supportability/')]) == 5
+    assert metrics['Custom/all-folded'][0] >= 17
+    assert metrics['Supportability/Python/MetricCardinality/Folded'][0] == \
+            metrics['Supportability/Python/MetricCardinality/Folded/'
+            'Custom/all-folded'][0]
+
+
+def test_metric_table_folded_by_kind():
+    table = MetricStatsTable()
+
+    table.merge_raw_time_metric(('Custom/time', ''), 1.0)
+    table.merge_stats(('Custom/count', ''), CountStats(call_count=1))
+    table.merge_raw_time_metric(('Custom/heavy', ''), 1.0)
+    table.merge_raw_time_metric(('Custom/heavy', ''), 1.0)
+
+    folded, counts = table.folded(1, _metric_rollup)
+
+    assert counts == {('Custom/all-folded', ''): 1,
+            ('Custom/all-folded/count', ''): 1}
+    assert isinstance(folded[('Custom/all-folded/count', '')], CountStats)
+    assert folded[('Custom/all-folded', '')] == table[('Custom/time', '')]
+
+
+def test_metric_rollup_names():
+    assert _metric_rollup(('WebTransaction', ''), 0) == (
+            'WebTransaction/all-folded', '')
+    assert _metric_rollup(('WebTransaction/all-folded', ''), 0) is None
+    assert _metric_rollup(('Supportability/a', ''), 0) is None
+
+
+def test_stats_engine_metric_data_unchanged_stats():
+    settings = finalize_application_settings()
+    settings.agent_limits.max_metric_names = 4
+
+    stats = StatsEngine()
+    stats.reset_stats(settings)
+
+    for index in range(8):
+        stats.record_custom_metric('Custom/user/%d' % index, 1)
+
+    metrics = dict((key['name'], value) for key, value in stats.metric_data())
+
+    assert metrics['Custom/all-folded'][0] == 4
+    assert stats.metrics_count() == 8
+    assert ('Custom/user/0', '') in stats.stats_table
+
+
+def test_stats_engine_metric_data_string_table():
+    settings = finalize_application_settings()
+
+    stats = StatsEngine()
+    stats.reset_stats(settings)
+    stats.stats_table.merge_raw_time_metric(('Function/foo', ''), 0.5)
+    stats.stats_table.merge_raw_time_metric(('Function/foo', 'WebTransaction'),
+            2.0)
+    stats.record_custom_metric('Custom/count', {'count': 3})
+
+    metric_data = stats.metric_data_string_table()
+
+    assert metric_data['strings'] == ['', 'Function/foo', 'WebTransaction',
+            'Custom/count']
+    assert metric_data['metrics'] == [
+        [1, 0, 1, 0.5, 0.5, 0.5, 0.5, 0.25],
+        [1, 2, 1, 2, 2, 2, 2, 4],
+        [3, 0, 3, 0, 0, 0, 0, 0],
+    ]
+
+
+def test_stats_engine_metric_data_without_settings():
+    stats = StatsEngine()
+
+    assert stats.metric_data() == []
+    assert stats.metric_data_string_table() == {'strings': [''],
+            'metrics': []}
@@ -0,0 +1,84 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.api.database_trace import DatabaseTrace
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.external_trace import ExternalTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.memcache_trace import MemcacheTrace
+from newrelic.api.message_trace import MessageTrace
+from newrelic.api.solr_trace import SolrTrace
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.function_node import FunctionNode
+
+
+@pytest.mark.parametrize('trace', (
+    FunctionTrace('name'),
+    DatastoreTrace('product', 'target', 'operation'),
+    DatabaseTrace('select 1'),
+    ExternalTrace('library', 'http://localhost/'),
+    MemcacheTrace('get'),
+    MessageTrace('library', 'Produce', 'Queue', 'name'),
+    SolrTrace('library', 'query'),
+), ids=lambda trace: type(trace).__name__)
+def test_trace_has_no_instance_dict(trace):
+    assert not hasattr(trace, '__dict__')
+
+
+def test_trace_allocates_attributes_on_demand():
+    trace = FunctionTrace('name')
+
+    assert trace._guid is None
+    assert trace._agent_attributes is None
+    assert trace._user_attributes is None
+    assert trace.children == ()
+
+    guid = trace.guid
+
+    assert len(guid) == 16
+    assert trace.guid == guid
+
+    trace.agent_attributes['key'] = 'value'
+    assert trace._agent_attributes == {'key': 'value'}
+
+    trace.guid = 'abcdef0123456789'
+    assert trace.guid == 'abcdef0123456789'
+
+
+def _node(name, children=(), guid=None):
+    return FunctionNode(group='Function', name=name, children=children,
+            start_time=0.0, end_time=1.0, duration=1.0, exclusive=1.0,
+            label=None, params=None, rollup=None, guid=guid,
+            agent_attributes=None, user_attributes=None)
+
+
+def test_span_events_generate_missing_guids():
+    settings = finalize_application_settings()
+    root = _node('root', (_node('child'), _node('child')),
+            guid='0123456789abcdef')
+
+    events = list(root.span_events(settings))
+    intrinsics = [event[0] for event in events]
+
+    assert intrinsics[0]['guid'] == '0123456789abcdef'
+
+    child_guids = [i_attrs['guid'] for i_attrs in intrinsics[1:]]
+
+    assert all(child_guids)
+    assert child_guids[0] != child_guids[1]
+    assert all(i_attrs['parentId'] == '0123456789abcdef'
+            for i_attrs in intrinsics[1:])
+    assert all(event[2] == {} for event in events)
@@ -0,0 +1,150 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+import newrelic.core.trace_cache as trace_cache_module
+from newrelic.core.trace_cache import (ContextTraceCache, TraceCache,
+        configure_trace_cache, contextvars, trace_cache)
+
+requires_contextvars = pytest.mark.skipif(contextvars is None,
+        reason='Requires contextvars.')
+
+
+class Trace(object):
+    def __init__(self, cache, parent=None):
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.exited = False
+        self.transaction = None
+        self.thread_id = cache.current_thread_id()
+
+    def has_outstanding_children(self):
+        return False
+
+
+@pytest.fixture
+def cache():
+    return ContextTraceCache()
+
+
+@requires_contextvars
+def test_context_trace_cache_save_and_pop(cache):
+    root = Trace(cache)
+    cache.save_trace(root)
+
+    child = Trace(cache, root)
+    cache.save_trace(child)
+
+    assert cache.current_trace() is child
+    assert cache.get_trace(child.thread_id) is child
+
+    child.exited = True
+    cache.pop_current(child)
+
+    assert cache.current_trace() is root
+
+    cache.complete_root(root)
+
+    assert cache.current_trace() is None
+    assert not cache._cache
+
+
+@requires_contextvars
+def test_context_trace_cache_not_shared_with_threads(cache):
+    root = Trace(cache)
+    cache.save_trace(root)
+
+    traces = []
+    thread = threading.Thread(target=lambda: traces.append(
+            cache.current_trace()))
+    thread.start()
+    thread.join()
+
+    assert traces == [None]
+
+    cache.complete_root(root)
+
+
+@requires_contextvars
+def test_context_trace_cache_completed_from_other_context(cache):
+    # A trace completed from a context other than the one it was saved
+    # in, such as by the last of its children running in another task,
+    # leaves the context it was saved in referring to the exited trace.
+    # The trace saved away under the thread ID is then used instead.
+
+    root = Trace(cache)
+    cache.save_trace(root)
+
+    trace = Trace(cache, root)
+    cache.save_trace(trace)
+
+    def _complete():
+        trace.exited = True
+        cache.pop_current(trace)
+
+    contextvars.copy_context().run(_complete)
+
+    assert cache._context.get()() is trace
+    assert cache.current_trace() is root
+
+    cache.complete_root(root)
+
+
+@requires_contextvars
+def test_context_trace_cache_set_trace(cache):
+    trace = Trace(cache)
+
+    cache.set_trace(trace.thread_id, trace)
+    assert cache.current_trace() is trace
+
+    cache.set_trace(trace.thread_id, None)
+    assert cache.current_trace() is None
+    assert not cache._cache
+
+
+@pytest.fixture
+def original_trace_cache(monkeypatch):
+    monkeypatch.setattr(trace_cache_module, '_trace_cache', TraceCache())
+
+
+@requires_contextvars
+def test_configure_trace_cache(original_trace_cache):
+    assert configure_trace_cache('contextvars')
+    assert type(trace_cache()) is ContextTraceCache
+
+    assert configure_trace_cache('thread')
+    assert type(trace_cache()) is TraceCache
+
+
+def test_configure_trace_cache_unknown_backend(original_trace_cache):
+    cache = trace_cache()
+
+    assert not configure_trace_cache('unknown')
+    assert trace_cache() is cache
+
+
+@requires_contextvars
+def test_configure_trace_cache_in_use(original_trace_cache):
+    cache = trace_cache()
+    root = Trace(cache)
+    cache.save_trace(root)
+
+    try:
+        assert not configure_trace_cache('contextvars')
+        assert trace_cache() is cache
+    finally:
+        cache.complete_root(root)
@@ -0,0 +1,49 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.trace_cache import ContextTraceCache, contextvars
+
+from test_trace_cache import Trace
+
+pytestmark = pytest.mark.skipif(contextvars is None,
+        reason='Requires contextvars.')
+
+
+@pytest.fixture
+def cache():
+    return ContextTraceCache()
+
+
+def test_context_trace_cache_propagates_to_tasks(cache):
+    import asyncio
+
+    async def _task():
+        return cache.current_trace()
+
+    async def _main():
+        root = Trace(cache)
+        cache.save_trace(root)
+
+        try:
+            assert await asyncio.ensure_future(_task()) is root
+        finally:
+            cache.complete_root(root)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_main())
+    finally:
+        loop.close()
@@ -0,0 +1,146 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from newrelic.core.transaction_recorder import TransactionRecorder
+
+
+class BlockingRecord(object):
+    def __init__(self):
+        self.recorded = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, data):
+        self.started.set()
+        self.release.wait(5.0)
+        self.recorded.append(data)
+
+
+def test_recorder_records_in_background():
+    recorded = []
+    recorder = TransactionRecorder('test', recorded.append, 10)
+
+    for i in range(5):
+        assert recorder.put(i)
+
+    assert recorder.flush(5.0)
+    assert recorded == [0, 1, 2, 3, 4]
+    assert recorder._thread.name == 'NR-Transaction-Recorder/test'
+
+    recorder.shutdown()
+    assert not recorder.active
+
+
+def test_recorder_drop_policy():
+    record = BlockingRecord()
+    recorder = TransactionRecorder('test', record, 2, 'drop')
+
+    # The first transaction is taken by the recorder thread, leaving room
+    # in the queue for two more before any are dropped.
+
+    assert recorder.put(0)
+    assert record.started.wait(5.0)
+
+    assert recorder.put(1)
+    assert recorder.put(2)
+    assert not recorder.put(3)
+
+    max_depth, dropped = recorder.stats()
+    assert max_depth == 2
+    assert dropped == 1
+
+    record.release.set()
+
+    assert recorder.flush(5.0)
+    assert record.recorded == [0, 1, 2]
+
+    recorder.shutdown()
+
+
+def test_recorder_block_policy():
+    record = BlockingRecord()
+    recorder = TransactionRecorder('test', record, 1, 'block')
+
+    assert recorder.put(0)
+    assert record.started.wait(5.0)
+    assert recorder.put(1)
+
+    blocked = threading.Thread(target=recorder.put, args=(2,))
+    blocked.start()
+    blocked.join(0.1)
+
+    # The producer waits for room in the queue rather than dropping.
+
+    assert blocked.is_alive()
+
+    record.release.set()
+    blocked.join(5.0)
+
+    assert recorder.flush(5.0)
+    assert record.recorded == [0, 1, 2]
+    assert recorder.stats()[1] == 0
+
+    recorder.shutdown()
+
+
+def test_recorder_flush_timeout():
+    record = BlockingRecord()
+    recorder = TransactionRecorder('test', record, 10)
+
+    recorder.put(0)
+    assert not recorder.flush(0.05)
+
+    record.release.set()
+    assert recorder.flush(5.0)
+
+    recorder.shutdown()
+
+
+def test_recorder_shutdown_discards_queued():
+    record = BlockingRecord()
+    recorder = TransactionRecorder('test', record, 10)
+
+    recorder.put(0)
+    assert record.started.wait(5.0)
+
+    recorder.put(1)
+    recorder.put(2)
+
+    recorder.shutdown(timeout=0.0)
+
+    record.release.set()
+    recorder._thread.join(5.0)
+
+    assert record.recorded == [0]
+    assert recorder.stats()[1] == 2
+
+
+def test_recorder_put_after_shutdown():
+    recorded = []
+    recorder = TransactionRecorder('test', recorded.append, 10)
+    recorder.shutdown()
+
+    assert not recorder.put(0)
+    assert recorded == []
+
+
+@pytest.mark.parametrize('policy', ('drop', 'unknown'))
+def test_recorder_overflow_policy(policy):
+    recorder = TransactionRecorder('test', lambda data: None, 10, policy)
+    assert recorder._overflow_policy == 'drop'
+    recorder.shutdown()
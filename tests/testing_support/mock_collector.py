@@ -0,0 +1,152 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import os
+import ssl
+import threading
+import zlib
+
+from newrelic.common.agent_http import DeveloperModeClient
+from newrelic.packages.six.moves import BaseHTTPServer, socketserver
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+from testing_support.mock_external_http_server import MockExternalHTTPServer
+
+# This defines an in process stand in for the data collector, which the agent
+# can be pointed at by setting the host and port and disabling certificate
+# validation. Each agent endpoint responds in the same way as when in
+# developer mode, with the number of requests and the size of the payloads
+# received for each endpoint being recorded, so that the overhead of the
+# agent can be measured without any network dependency.
+
+# The self signed certificate and key used by the tests of the HTTP client
+# are shared, rather than committing a second key for the stand in.
+
+SERVER_CERT = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+        'agent_unittests', 'cert.pem')
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn,
+        BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class MockCollector(threading.Thread):
+    # Unlike the mock external server, the collector is served over HTTPS,
+    # with a thread per connection so that connections can be kept alive.
+
+    def __init__(self, responses=None, port=None):
+        super(MockCollector, self).__init__()
+        self.daemon = True
+
+        self.responses = dict(DeveloperModeClient.RESPONSES)
+        self.responses['preconnect'] = {u'redirect_host': u'localhost'}
+        self.responses.update(responses or {})
+
+        self._lock = threading.Lock()
+        self.reset()
+
+        collector = self
+
+        class ResponseHandler(BaseHTTPServer.BaseHTTPRequestHandler,
+                object):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                params = parse_qs(urlparse(self.path).query)
+                method = params.get('method', [None])[0]
+
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+
+                if self.headers.get('Content-Encoding') in ('gzip',
+                        'deflate'):
+                    data = zlib.decompress(body, 47)
+                else:
+                    data = body
+
+                collector.record(method, body, data)
+
+                if method in collector.responses:
+                    status = 200
+                    response = json.dumps({u'return_value':
+                            collector.responses[method]}).encode('utf-8')
+                else:
+                    status = 400
+                    response = b'Invalid method received'
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER',
+                ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(SERVER_CERT)
+
+        self.port = port or MockExternalHTTPServer.get_open_port()
+        self.httpd = ThreadingHTTPServer(('localhost', self.port),
+                ResponseHandler)
+        self.httpd.socket = context.wrap_socket(self.httpd.socket,
+                server_side=True, do_handshake_on_connect=False)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.stop()
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.socket.close()
+        self.join()
+
+    def record(self, method, body, data):
+        with self._lock:
+            stats = self._stats[method]
+            stats['requests'] += 1
+            stats['bytes'] += len(body)
+            stats['uncompressed_bytes'] += len(data)
+            self.payloads[method] = data
+
+    def reset(self):
+        with self._lock:
+            self._stats = collections.defaultdict(lambda: {
+                    'requests': 0, 'bytes': 0, 'uncompressed_bytes': 0})
+            self.payloads = {}
+
+    def stats(self):
+        """Returns a dictionary mapping each endpoint called to the number
+        of requests received for it and the total size of the payloads,
+        both as sent and once decompressed.
+
+        """
+
+        with self._lock:
+            return dict((method, dict(stats))
+                    for method, stats in self._stats.items())